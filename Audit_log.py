@@ -0,0 +1,181 @@
+# Audit_log.py
+"""
+Asynchronous structured audit log for the order paths.
+
+Callers hand a dict to audit(); it is queued without formatting or I/O and a
+single background thread serializes it as one compact JSON line into
+DATA_DIR/logs/audit.jsonl (size-based rotation). Console echo is optional and
+also happens on the writer thread, so no print sits on the order path.
+
+Env:
+  AUDIT_LEVEL        off | error | info | debug   (default info)
+  AUDIT_CONSOLE      1 to echo each line to stdout (default 1)
+  AUDIT_MAX_BYTES    rotate after this many bytes (default 20 MB)
+  AUDIT_BACKUPS      rotated files kept (default 5)
+  AUDIT_QUEUE_MAX    events buffered before new ones are dropped (default 100000)
+"""
+import os, json, time, queue, threading
+from typing import Any, Dict
+
+LEVELS = {"debug": 10, "info": 20, "error": 40, "off": 100}
+
+BASE_DIR  = os.path.abspath(os.environ.get("DATA_DIR", "./data"))
+AUDIT_DIR = os.path.join(BASE_DIR, "logs")
+AUDIT_FILE = os.path.join(AUDIT_DIR, "audit.jsonl")
+
+MAX_BYTES = int(os.getenv("AUDIT_MAX_BYTES", str(20 * 1024 * 1024)))
+BACKUPS   = int(os.getenv("AUDIT_BACKUPS", "5"))
+CONSOLE   = os.getenv("AUDIT_CONSOLE", "1").strip().lower() in ("1", "true", "yes", "on")
+
+_level = LEVELS.get(os.getenv("AUDIT_LEVEL", "info").strip().lower(), LEVELS["info"])
+_q: "queue.Queue" = queue.Queue(maxsize=int(os.getenv("AUDIT_QUEUE_MAX", "100000")))
+_state: Dict[str, Any] = {"thread": None, "written": 0, "dropped": 0, "errors": 0}
+_start_lock = threading.Lock()
+_STOP = object()
+
+
+# ---------------------------
+# public API
+# ---------------------------
+def enabled(level: str = "info") -> bool:
+    """Cheap check so callers can skip building large event dicts."""
+    return LEVELS.get(level, LEVELS["info"]) >= _level
+
+def set_level(name: str) -> str:
+    """Switch the level at runtime; returns the active level name."""
+    global _level
+    key = (name or "").strip().lower()
+    if key not in LEVELS:
+        raise ValueError(f"unknown audit level: {name}")
+    _level = LEVELS[key]
+    return key
+
+def get_level() -> str:
+    for name, val in LEVELS.items():
+        if val == _level:
+            return name
+    return "info"
+
+def audit(event: str, level: str = "info", **fields: Any) -> None:
+    """Queue one audit event. Never blocks and never raises."""
+    if LEVELS.get(level, LEVELS["info"]) < _level:
+        return
+    if _state["thread"] is None:
+        _start()
+    try:
+        _q.put_nowait((time.time(), level, event, fields))
+    except queue.Full:
+        _state["dropped"] += 1
+
+def flush(timeout: float = 5.0) -> bool:
+    """Wait until everything queued so far has been written."""
+    if _state["thread"] is None:
+        return True
+    done = threading.Event()
+    try:
+        _q.put(done, timeout=timeout)
+    except queue.Full:
+        return False
+    return done.wait(timeout)
+
+def shutdown(timeout: float = 5.0) -> None:
+    t = _state["thread"]
+    if t is None:
+        return
+    try:
+        _q.put(_STOP, timeout=timeout)
+    except queue.Full:
+        return
+    t.join(timeout)
+    _state["thread"] = None
+
+def stats() -> Dict[str, Any]:
+    return {
+        "level": get_level(),
+        "file": AUDIT_FILE,
+        "queued": _q.qsize(),
+        "written": _state["written"],
+        "dropped": _state["dropped"],
+        "errors": _state["errors"],
+    }
+
+
+# ---------------------------
+# writer thread
+# ---------------------------
+def _start() -> None:
+    with _start_lock:
+        if _state["thread"] is not None:
+            return
+        t = threading.Thread(target=_writer, name="audit-writer", daemon=True)
+        _state["thread"] = t
+        t.start()
+
+def _line(item) -> str:
+    ts, level, event, fields = item
+    rec = {"ts": round(ts, 6), "level": level, "event": event}
+    rec.update(fields)
+    return json.dumps(rec, separators=(",", ":"), ensure_ascii=False, default=str)
+
+def _rotate(fh):
+    fh.close()
+    for i in range(BACKUPS - 1, 0, -1):
+        src, dst = f"{AUDIT_FILE}.{i}", f"{AUDIT_FILE}.{i + 1}"
+        if os.path.exists(src):
+            os.replace(src, dst)
+    if BACKUPS > 0:
+        os.replace(AUDIT_FILE, f"{AUDIT_FILE}.1")
+    else:
+        os.remove(AUDIT_FILE)
+    return open(AUDIT_FILE, "a", encoding="utf-8")
+
+def _writer() -> None:
+    os.makedirs(AUDIT_DIR, exist_ok=True)
+    fh = open(AUDIT_FILE, "a", encoding="utf-8")
+    try:
+        while True:
+            batch = [_q.get()]
+            # drain whatever else is already waiting, write it in one go
+            while len(batch) < 1000:
+                try:
+                    batch.append(_q.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            waiters = []
+            stop = False
+            for item in batch:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    try:
+                        lines.append(_line(item))
+                    except Exception:
+                        _state["errors"] += 1
+
+            if lines:
+                text = "\n".join(lines) + "\n"
+                try:
+                    fh.write(text)
+                    fh.flush()
+                    if MAX_BYTES > 0 and fh.tell() >= MAX_BYTES:
+                        fh = _rotate(fh)
+                except Exception as e:
+                    _state["errors"] += 1
+                    print(f"[audit] write failed: {e}")
+                if CONSOLE:
+                    print(text, end="")
+                _state["written"] += len(lines)
+
+            for w in waiters:
+                w.set()
+            if stop:
+                break
+    finally:
+        try:
+            fh.close()
+        except Exception:
+            pass
@@ -0,0 +1,185 @@
+# Bench_fanout.py
+"""
+Offline end-to-end benchmark of the router's fan-out paths against the
+Mock_brokers stand-in server (no live accounts needed).
+
+For every group size it creates that many accounts (alternating Dhan and
+Motilal by default), a group holding them, and then repeatedly:
+
+  place   POST /place_orders for the group (LIMIT, so orders stay open)
+  book    GET  /get_orders
+  cancel  POST /cancel_order for every leg placed in that run
+
+It reports p50/p99/max end-to-end latency per operation, and for "place" the
+per-leg latency: request start -> the mock finished serving that leg.
+
+    python Bench_fanout.py --sizes 10,100,1000 --runs 20 --latency-ms 20 --jitter-ms 10
+    python Bench_fanout.py --brokers dhan --rate-429 0.02 --json bench.json
+
+The router runs in-process (FastAPI TestClient, no startup hooks), so GitHub
+sync, copy engine and keep-alive stay off. Accounts and the journal live in a
+throw-away DATA_DIR unless --data-dir is given.
+"""
+import os, sys, json, time, tempfile, argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+
+def pct(values: List[float], p: float) -> float:
+    """Nearest-rank percentile (0 for no values)."""
+    if not values:
+        return 0.0
+    v = sorted(values)
+    k = max(0, min(len(v) - 1, int(round(p / 100.0 * len(v) + 0.5)) - 1))
+    return round(v[k], 2)
+
+def summary(values: List[float]) -> Dict[str, Any]:
+    return {"n": len(values), "p50": pct(values, 50), "p99": pct(values, 99),
+            "max": round(max(values), 2) if values else 0.0}
+
+
+def _prepare(data_dir: str, total: int, brokers: List[str]) -> List[Dict[str, Any]]:
+    accounts = []
+    for i in range(total):
+        brk = brokers[i % len(brokers)]
+        uid = f"{'D' if brk == 'dhan' else 'M'}{i:05d}"
+        cj = {"name": f"bench-{uid}", "userid": uid, "capital": 100000, "session_active": True}
+        if brk == "dhan":
+            cj["apikey"] = f"tok-{uid}"
+        else:
+            cj.update({"password": "pw", "pan": "ABCDE1234F", "apikey": f"key-{uid}", "totpkey": ""})
+        folder = os.path.join(data_dir, "clients", brk)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"{uid}.json"), "w", encoding="utf-8") as f:
+            json.dump(cj, f)
+        accounts.append({"broker": brk, "json": cj})
+    return accounts
+
+def _write_group(data_dir: str, size: int, accounts: List[Dict[str, Any]]) -> str:
+    gid = f"bench{size}"
+    folder = os.path.join(data_dir, "groups")
+    os.makedirs(folder, exist_ok=True)
+    doc = {"id": gid, "name": gid, "multiplier": 1,
+           "members": [{"broker": a["broker"], "userid": a["json"]["userid"]} for a in accounts[:size]]}
+    with open(os.path.join(folder, f"{gid}.json"), "w", encoding="utf-8") as f:
+        json.dump(doc, f)
+    return gid
+
+def _placed_ids(result: Dict[str, Any], names: Dict[str, str]) -> List[Dict[str, str]]:
+    out = []
+    for brk in ("dhan", "motilal"):
+        for key, resp in ((result.get(brk) or {}).get("order_responses") or {}).items():
+            oid = (resp or {}).get("orderId") or (resp or {}).get("uniqueorderid") if isinstance(resp, dict) else None
+            uid = key.split(":")[-1]
+            if oid and uid in names:
+                out.append({"name": names[uid], "order_id": str(oid)})
+    return out
+
+
+def main(argv=None) -> Dict[str, Any]:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--sizes", default="10,100,1000")
+    ap.add_argument("--runs", type=int, default=20)
+    ap.add_argument("--warmup-runs", type=int, default=2)
+    ap.add_argument("--brokers", default="dhan,motilal")
+    ap.add_argument("--latency-ms", type=float, default=20.0)
+    ap.add_argument("--jitter-ms", type=float, default=10.0)
+    ap.add_argument("--rate-429", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--ops", default="place,book,cancel")
+    ap.add_argument("--data-dir", default="")
+    ap.add_argument("--json", default="", help="write the report here as JSON")
+    a = ap.parse_args(argv)
+
+    sizes = [int(x) for x in a.sizes.split(",") if x.strip()]
+    brokers = [b.strip() for b in a.brokers.split(",") if b.strip()]
+    ops = {o.strip() for o in a.ops.split(",")}
+    data_dir = os.path.abspath(a.data_dir or tempfile.mkdtemp(prefix="mb-bench-"))
+
+    # mock first: the adapters read DHAN_API / MO_BASE_URL at import
+    import Mock_brokers
+    _, base = Mock_brokers.start(latency_ms=a.latency_ms, jitter_ms=a.jitter_ms,
+                                 rate_429=a.rate_429, error_rate=a.error_rate)
+    os.environ.update({
+        "DATA_DIR": data_dir, "DHAN_API": f"{base}/v2", "MO_BASE_URL": base,
+        "AUDIT_CONSOLE": "0", "COPY_ENGINE": "0", "SESSION_KEEPALIVE": "0",
+    })
+    os.environ.pop("GITHUB_TOKEN", None)
+
+    accounts = _prepare(data_dir, max(sizes), brokers)
+    groups = {n: _write_group(data_dir, n, accounts) for n in sizes}
+    names = {acc["json"]["userid"]: acc["json"]["name"] for acc in accounts}
+
+    import MultiBroker_Router as R
+    from fastapi.testclient import TestClient
+    client = TestClient(R.app)
+
+    report: Dict[str, Any] = {"config": {**vars(a), "data_dir": data_dir}, "sizes": {}}
+
+    mo = [acc["json"] for acc in accounts if acc["broker"] == "motilal"]
+    if mo:
+        import Broker_motilal
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=32) as ex:
+            ok = sum(1 for r in ex.map(Broker_motilal.login, mo) if r)
+        report["motilal_login"] = {"accounts": len(mo), "ok": ok,
+                                   "total_s": round(time.perf_counter() - t0, 3)}
+        print(f"motilal login: {ok}/{len(mo)} in {report['motilal_login']['total_s']}s")
+
+    order = {"symbol": "NSE|PNB EQ|10666|10666", "groupacc": True, "quantityinlot": 1,
+             "action": "BUY", "ordertype": "LIMIT", "price": 10, "producttype": "CNC"}
+
+    for n in sizes:
+        lat: Dict[str, List[float]] = {"place": [], "leg": [], "book": [], "cancel": []}
+        failed_legs = 0
+        for run in range(a.warmup_runs + a.runs):
+            measure = run >= a.warmup_runs
+            mark = len(Mock_brokers.placements)
+            t0 = time.perf_counter()
+            resp = client.post("/place_orders", json={**order, "groups": [groups[n]]})
+            e2e = (time.perf_counter() - t0) * 1000
+            legs = Mock_brokers.placements[mark:]
+            placed = _placed_ids((resp.json() or {}).get("result") or {}, names) if resp.status_code == 200 else []
+            if measure:
+                lat["place"].append(e2e)
+                lat["leg"].extend((t - t0) * 1000 for t, _, _ in legs)
+                failed_legs += max(0, n - len(placed))
+
+            if "book" in ops:
+                t0 = time.perf_counter()
+                client.get("/get_orders")
+                if measure:
+                    lat["book"].append((time.perf_counter() - t0) * 1000)
+
+            if "cancel" in ops and placed:
+                t0 = time.perf_counter()
+                client.post("/cancel_order", json={"orders": placed})
+                if measure:
+                    lat["cancel"].append((time.perf_counter() - t0) * 1000)
+
+        row = {k: summary(v) for k, v in lat.items() if v}
+        row["failed_legs"] = failed_legs
+        report["sizes"][n] = row
+
+    report["mock"] = Mock_brokers.stats()
+
+    print(f"\n{'accounts':>8} {'op':<7} {'n':>6} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for n, row in report["sizes"].items():
+        for op in ("place", "leg", "book", "cancel"):
+            if op in row:
+                s = row[op]
+                print(f"{n:>8} {op:<7} {s['n']:>6} {s['p50']:>9} {s['p99']:>9} {s['max']:>9}")
+        if row["failed_legs"]:
+            print(f"{n:>8} failed legs: {row['failed_legs']}")
+    print(f"\nmock: {report['mock']['requests']} requests, {report['mock']['throttled']} throttled, "
+          f"{report['mock']['errors']} errors")
+
+    if a.json:
+        with open(a.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+    return report
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
@@ -0,0 +1,145 @@
+# Book_models.py
+"""
+Broker-agnostic rows for the order, position and holdings books.
+
+Each adapter turns the broker's own payload (Dhan tradingSymbol / orderId,
+Motilal symbol / uniqueorderid, ...) into these records once, where the
+payload is read. Everything after that, bucketing, merging the brokers'
+books and the modify path's snapshot lookups, reads fields instead of
+probing alternative keys. Records are NamedTuples: a row is one tuple
+rather than a dict, and the field set is fixed.
+
+The router converts a whole response body to plain JSON types once, at
+the edge:
+
+    return Book_models.dump(buckets)
+
+The wire format is the one the UI already reads, plus `broker` and
+`client_id` on every row. Orders.jsx echoes both back on cancel and modify,
+so the router can route by them instead of guessing from the order id
+shape or the client's display name.
+"""
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+ORDER_BUCKETS = ("pending", "traded", "rejected", "cancelled", "others")
+
+
+class Order(NamedTuple):
+    name: str
+    symbol: str
+    transaction_type: str
+    quantity: Any
+    price: Any
+    status: str
+    order_id: str
+    broker: str
+    client_id: str
+    # internal, not sent: one of ORDER_BUCKETS, from the adapter's own status mapping
+    bucket: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(zip(_ORDER_WIRE, self))
+
+
+class Position(NamedTuple):
+    name: str
+    symbol: str
+    quantity: Any
+    buy_avg: float
+    sell_avg: float
+    net_profit: float
+    broker: str
+    client_id: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(zip(self._fields, self))
+
+
+class Holding(NamedTuple):
+    name: str
+    symbol: str
+    quantity: float
+    buy_avg: float
+    ltp: float
+    pnl: float
+    broker: str
+    client_id: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(zip(self._fields, self))
+
+
+class Funds(NamedTuple):
+    """One account's row of the holdings summary."""
+    name: str
+    capital: float
+    invested: float
+    pnl: float
+    current_value: float
+    available_margin: float
+    net_gain: float
+    broker: str
+    client_id: str
+    # broker-specific balance breakdown (Dhan fundlimit), sent as top-level keys
+    balances: Optional[Dict[str, float]] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = dict(zip(_FUNDS_WIRE, self))
+        if self.balances:
+            d.update(self.balances)
+        return d
+
+
+_ORDER_WIRE = Order._fields[:-1]
+_FUNDS_WIRE = Funds._fields[:-1]
+_RECORDS = (Order, Position, Holding, Funds)
+
+
+# ---------------------------
+# aggregation (both adapters, and the router across brokers)
+# ---------------------------
+def bucket_orders(per_client: Iterable[Iterable[Order]]) -> Dict[str, List[Order]]:
+    out: Dict[str, List[Order]] = {k: [] for k in ORDER_BUCKETS}
+    for rows in per_client:
+        for row in rows:
+            out[row.bucket].append(row)
+    return out
+
+def bucket_positions(per_client: Iterable[Iterable[Position]]) -> Dict[str, List[Position]]:
+    out: Dict[str, List[Position]] = {"open": [], "closed": []}
+    for rows in per_client:
+        for row in rows:
+            out["closed" if row.quantity == 0 else "open"].append(row)
+    return out
+
+def merge_holdings(per_client: Iterable[Optional[Tuple[List[Holding], Funds]]]) -> Dict[str, List[Any]]:
+    """(holdings, funds) per client, None for clients without a session."""
+    out: Dict[str, List[Any]] = {"holdings": [], "summary": []}
+    for res in per_client:
+        if not res:
+            continue
+        rows, funds = res
+        out["holdings"].extend(rows)
+        out["summary"].append(funds)
+    return out
+
+def merge_into(into: Dict[str, List[Any]], part: Any) -> None:
+    """Extend every list of `into` with the same key's list from one broker's book."""
+    if not isinstance(part, dict):
+        return
+    for k, rows in into.items():
+        rows.extend(part.get(k) or [])
+
+
+# ---------------------------
+# API edge
+# ---------------------------
+def dump(obj: Any) -> Any:
+    """obj with every record turned into a plain dict (dicts and lists are walked)."""
+    if isinstance(obj, _RECORDS):
+        return obj.to_dict()
+    if isinstance(obj, list):
+        return [dump(v) for v in obj]
+    if isinstance(obj, dict):
+        return {k: dump(v) for k, v in obj.items()}
+    return obj
@@ -1,15 +1,43 @@
 # Broker_dhan.py
 
-import os, json, threading
-from typing import Dict, Any, List, Optional
+import os, json, threading, asyncio, time
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
 import requests
 
+from Audit_log import audit
+import Req_timing
+from Req_timing import span
+import Metrics
+from Circuit_breaker import breakers, CircuitOpen
+import Req_deadline
+from Req_deadline import DeadlineExceeded
+import Read_hedge
+import Rate_limiter
+import Book_models
+from Book_models import Order, Position, Holding, Funds
+
+try:
+    import httpx
+except Exception:
+    httpx = None
+
 STAT_KEYS = ["pending", "traded", "rejected", "cancelled", "others"]
 
 # use same DATA_DIR as router
 BASE_DIR    = os.path.abspath(os.environ.get("DATA_DIR", "./data"))
 CLIENTS_DIR = os.path.join(BASE_DIR, "clients", "dhan")
 
+# DHAN_API points the adapter at a stand-in server (Mock_brokers.py) for benchmarks
+DHAN_API = os.getenv("DHAN_API", "https://api.dhan.co/v2").rstrip("/")
+
+# connection pools for the async adapter, one per router lane (see _async_client):
+# order entry never queues for a connection behind book/holdings refreshes
+ASYNC_LANE_CONNECTIONS = {
+    "orders":  int(os.getenv("DHAN_ORDER_MAX_CONN", "100")),
+    "reports": int(os.getenv("DHAN_REPORT_MAX_CONN", "20")),
+}
+
 
 # ---------------------------
 # helpers
@@ -64,6 +92,105 @@ def _needs_trigger(ot: str) -> bool:
     # both SL-limit and SL-market need trigger
     return ot in ("STOP_LOSS", "STOP_LOSS_MARKET")
 
+def _token_of(c: Dict[str, Any]) -> str:
+    return (c.get("apikey") or c.get("access_token") or "").strip()
+
+def _name_of(c: Dict[str, Any]) -> str:
+    return c.get("name") or c.get("display_name") or c.get("userid") or c.get("client_id") or ""
+
+def _uid_of(c: Dict[str, Any]) -> str:
+    return str(c.get("userid") or c.get("client_id") or "").strip()
+
+def _headers(token: str) -> Dict[str, str]:
+    return {"Content-Type": "application/json", "access-token": token}
+
+
+# ---------------------------
+# row builders (shared by the sync and async adapters)
+# ---------------------------
+def _bucket_of(status: Any) -> str:
+    s = str(status).lower()
+    if "pend" in s:
+        return "pending"
+    if "trade" in s or s == "executed":
+        return "traded"
+    if "reject" in s or "error" in s:
+        return "rejected"
+    if "cancel" in s:
+        return "cancelled"
+    return "others"
+
+def _order_row(name: str, uid: str, o: Dict[str, Any]) -> Order:
+    status = o.get("orderStatus", "")
+    return Order(name, o.get("tradingSymbol", ""), o.get("transactionType", ""), o.get("quantity", ""),
+                 o.get("price", ""), status, o.get("orderId", ""), "dhan", uid, _bucket_of(status))
+
+def _position_row(name: str, uid: str, pos: Dict[str, Any]) -> Position:
+    net_qty   = pos.get("netQty", 0) or 0
+    buy_avg   = pos.get("buyAvg", 0) or 0
+    sell_avg  = pos.get("sellAvg", 0) or 0
+    symbol    = pos.get("tradingSymbol", "") or ""
+    realized  = pos.get("realizedProfit", 0) or 0
+    unreal    = pos.get("unrealizedProfit", 0) or 0
+    net_pnl   = (realized + unreal)
+    return Position(name, symbol, net_qty, round(buy_avg, 2), round(sell_avg, 2), round(net_pnl, 2), "dhan", uid)
+
+def _holdings_and_summary(c: Dict[str, Any], rows: List[Dict[str, Any]],
+                          funds: Dict[str, Any]) -> Tuple[List[Holding], Funds]:
+    """Turn raw /v2/holdings rows + /v2/fundlimit body into (holding rows, summary row)."""
+    name, uid = _name_of(c), _uid_of(c)
+    try:
+        capital = float(c.get("capital", 0) or c.get("base_amount", 0) or 0.0)
+    except Exception:
+        capital = 0.0
+
+    holdings_rows: List[Holding] = []
+    invested = 0.0
+    total_pnl = 0.0
+
+    for h in rows:
+        symbol = (h.get("tradingSymbol") or "").strip()
+        try:
+            qty    = float(h.get("availableQty", h.get("totalQty", 0)) or 0)
+            buyavg = float(h.get("avgCostPrice", 0) or 0)
+            ltp    = float(h.get("lastTradedPrice", h.get("LTP", h.get("ltp", h.get("lastprice", 0)))) or 0)
+        except Exception:
+            qty, buyavg, ltp = 0.0, 0.0, 0.0
+
+        if qty <= 0:
+            continue
+
+        pnl = round((ltp - buyavg) * qty, 2)
+        invested  += qty * buyavg
+        total_pnl += pnl
+
+        holdings_rows.append(Holding(name, symbol, qty, round(buyavg, 2), round(ltp, 2), pnl, "dhan", uid))
+
+    current_value = invested + total_pnl
+
+    available_balance     = float(funds.get("availabelBalance", funds.get("availableBalance", 0)) or 0)
+    withdrawable_balance  = float(funds.get("withdrawableBalance", 0) or 0)
+    utilized_amount       = float(funds.get("utilizedAmount", 0) or 0)
+    sod_limit             = float(funds.get("sodLimit", 0) or 0)
+    collateral_amount     = float(funds.get("collateralAmount", 0) or 0)
+    receivable_amount     = float(funds.get("receivableAmount", funds.get("receiveableAmount", 0)) or 0)
+    blocked_payout_amount = float(funds.get("blockedPayoutAmount", 0) or 0)
+
+    available_margin = available_balance
+    net_gain = round((current_value + available_margin) - capital, 2)
+
+    summary = Funds(name, round(capital, 2), round(invested, 2), round(total_pnl, 2), round(current_value, 2),
+                    round(available_margin, 2), net_gain, "dhan", uid, {
+                        "available_balance": round(available_balance, 2),
+                        "withdrawable_balance": round(withdrawable_balance, 2),
+                        "utilized_amount": round(utilized_amount, 2),
+                        "sod_limit": round(sod_limit, 2),
+                        "collateral_amount": round(collateral_amount, 2),
+                        "receivable_amount": round(receivable_amount, 2),
+                        "blocked_payout_amount": round(blocked_payout_amount, 2),
+                    })
+    return holdings_rows, summary
+
 
 # ---------------------------
 # session / info
@@ -71,7 +198,7 @@ def _needs_trigger(ot: str) -> bool:
 # ---------------------------
 # session / info  (upgraded)
 # ---------------------------
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 try:
     from zoneinfo import ZoneInfo
     _IST = ZoneInfo("Asia/Kolkata")
@@ -120,7 +247,7 @@ def login(client: Dict[str, Any]) -> Dict[str, Any]:
 
     try:
         r = requests.get(
-            "https://api.dhan.co/v2/profile",
+            f"{DHAN_API}/profile",
             headers={"access-token": token},
             timeout=15
         )
@@ -168,45 +295,35 @@ def login(client: Dict[str, Any]) -> Dict[str, Any]:
 
 
 
-def get_orders() -> Dict[str, List[Dict[str, Any]]]:
-    buckets: Dict[str, List[Dict[str, Any]]] = {k: [] for k in STAT_KEYS}
+def get_orders() -> Dict[str, List[Order]]:
+    per_client: List[List[Order]] = []
     for c in _read_clients():
-        token = (c.get("apikey") or c.get("access_token") or "").strip()
+        token = _token_of(c)
         if not token:
             continue
-        name = c.get("name") or c.get("display_name") or c.get("userid") or c.get("client_id") or ""
+        name = _name_of(c)
         try:
-            resp = requests.get("https://api.dhan.co/v2/orders",
-                                headers={"Content-Type": "application/json", "access-token": token},
-                                timeout=10)
+            resp = requests.get(f"{DHAN_API}/orders", headers=_headers(token), timeout=10)
             orders = resp.json() if resp.status_code == 200 else []
             if not isinstance(orders, list):
                 orders = []
         except Exception as e:
             print(f"[DHAN] get_orders error for {name}: {e}")
             orders = []
-        for o in orders:
-            row = {
-                "name": name,
-                "symbol": o.get("tradingSymbol", ""),
-                "transaction_type": o.get("transactionType", ""),
-                "quantity": o.get("quantity", ""),
-                "price": o.get("price", ""),
-                "status": o.get("orderStatus", ""),
-                "order_id": o.get("orderId", ""),
-            }
-            s = str(row["status"]).lower()
-            if "pend" in s:
-                buckets["pending"].append(row)
-            elif "trade" in s or s == "executed":
-                buckets["traded"].append(row)
-            elif "reject" in s or "error" in s:
-                buckets["rejected"].append(row)
-            elif "cancel" in s:
-                buckets["cancelled"].append(row)
-            else:
-                buckets["others"].append(row)
-    return buckets
+        per_client.append([_order_row(name, _uid_of(c), o) for o in orders])
+    return Book_models.bucket_orders(per_client)
+
+def raw_order_book(client_id: str) -> Optional[List[Dict[str, Any]]]:
+    """Unnormalized /v2/orders for one client (None when it cannot be fetched)."""
+    c = _clients_by_id().get(str(client_id).strip())
+    token = _token_of(c) if c else ""
+    if not token:
+        return None
+    resp = requests.get(f"{DHAN_API}/orders", headers=_headers(token), timeout=10)
+    if resp.status_code != 200:
+        return None
+    orders = resp.json()
+    return orders if isinstance(orders, list) else []
 
 
 # ---------------------------
@@ -217,9 +334,10 @@ def cancel_order_dhan(client_json: Dict[str, Any], order_id: str) -> Dict[str, A
     if not token:
         return {"status": "error", "message": "Missing access token", "raw": {}}
 
+    uid = str(client_json.get("userid") or client_json.get("client_id") or "").strip()
     try:
-        r = requests.delete(
-            f"https://api.dhan.co/v2/orders/{order_id}",
+        r = _order_send(
+            "DELETE", f"{DHAN_API}/orders/{order_id}", uid,
             headers={"Content-Type": "application/json", "access-token": token},
             timeout=15,
         )
@@ -260,50 +378,23 @@ def cancel_order_dhan(client_json: Dict[str, Any], order_id: str) -> Dict[str, A
 # ---------------------------
 # positions / square-off
 # ---------------------------
-def get_positions() -> Dict[str, List[Dict[str, Any]]]:
-    positions_data: Dict[str, List[Dict[str, Any]]] = {"open": [], "closed": []}
-
+def get_positions() -> Dict[str, List[Position]]:
+    per_client: List[List[Position]] = []
     for c in _read_clients():
-        token = (c.get("apikey") or c.get("access_token") or "").strip()
+        token = _token_of(c)
         if not token:
             continue
-        name = c.get("name") or c.get("display_name") or c.get("userid") or c.get("client_id") or ""
+        name = _name_of(c)
         try:
-            resp = requests.get(
-                "https://api.dhan.co/v2/positions",
-                headers={"Content-Type": "application/json", "access-token": token},
-                timeout=10
-            )
+            resp = requests.get(f"{DHAN_API}/positions", headers=_headers(token), timeout=10)
             rows = resp.json() if resp.status_code == 200 else []
             if not isinstance(rows, list):
                 rows = []
         except Exception as e:
             print(f"[DHAN] get_positions error for {name}: {e}")
             rows = []
-
-        for pos in rows:
-            net_qty   = pos.get("netQty", 0) or 0
-            buy_avg   = pos.get("buyAvg", 0) or 0
-            sell_avg  = pos.get("sellAvg", 0) or 0
-            symbol    = pos.get("tradingSymbol", "") or ""
-            realized  = pos.get("realizedProfit", 0) or 0
-            unreal    = pos.get("unrealizedProfit", 0) or 0
-            net_pnl   = (realized + unreal)
-
-            row = {
-                "name": name,
-                "symbol": symbol,
-                "quantity": net_qty,
-                "buy_avg": round(buy_avg, 2),
-                "sell_avg": round(sell_avg, 2),
-                "net_profit": round(net_pnl, 2),
-            }
-            if net_qty == 0:
-                positions_data["closed"].append(row)
-            else:
-                positions_data["open"].append(row)
-
-    return positions_data
+        per_client.append([_position_row(name, _uid_of(c), pos) for pos in rows])
+    return Book_models.bucket_positions(per_client)
 
 
 def close_positions(positions: List[Dict[str, Any]]) -> List[str]:
@@ -332,7 +423,7 @@ def close_positions(positions: List[Dict[str, Any]]) -> List[str]:
         # fetch fresh positions
         try:
             p = requests.get(
-                "https://api.dhan.co/v2/positions",
+                f"{DHAN_API}/positions",
                 headers={"Content-Type": "application/json", "access-token": token},
                 timeout=10
             )
@@ -379,8 +470,8 @@ def close_positions(positions: List[Dict[str, Any]]) -> List[str]:
         }
 
         try:
-            r = requests.post(
-                "https://api.dhan.co/v2/orders",
+            r = _order_send(
+                "POST", f"{DHAN_API}/orders", client,
                 headers={"Content-Type": "application/json", "access-token": token},
                 json=payload,
                 timeout=10
@@ -417,28 +508,16 @@ def close_positions(positions: List[Dict[str, Any]]) -> List[str]:
 # holdings + funds
 # ---------------------------
 def get_holdings() -> Dict[str, Any]:
-    holdings_rows: List[Dict[str, Any]] = []
-    summaries: List[Dict[str, Any]] = []
-
+    per_client: List[Tuple[List[Holding], Funds]] = []
     for c in _read_clients():
-        name       = c.get("name") or c.get("display_name") or c.get("userid") or c.get("client_id") or ""
-        access_tok = (c.get("apikey") or c.get("access_token") or "").strip()
-
-        try:
-            capital = float(c.get("capital", 0) or c.get("base_amount", 0) or 0.0)
-        except Exception:
-            capital = 0.0
-
+        name       = _name_of(c)
+        access_tok = _token_of(c)
         if not access_tok:
             continue
 
         # 1) holdings
         try:
-            resp = requests.get(
-                "https://api.dhan.co/v2/holdings",
-                headers={"Content-Type": "application/json", "access-token": access_tok},
-                timeout=10
-            )
+            resp = requests.get(f"{DHAN_API}/holdings", headers=_headers(access_tok), timeout=10)
             rows = resp.json() if resp.status_code == 200 else []
             if not isinstance(rows, list):
                 rows = []
@@ -446,85 +525,248 @@ def get_holdings() -> Dict[str, Any]:
             print(f"[DHAN] get_holdings error for {name}: {e}")
             rows = []
 
-        invested = 0.0
-        total_pnl = 0.0
-
-        for h in rows:
-            symbol = (h.get("tradingSymbol") or "").strip()
-            try:
-                qty    = float(h.get("availableQty", h.get("totalQty", 0)) or 0)
-                buyavg = float(h.get("avgCostPrice", 0) or 0)
-                ltp    = float(h.get("lastTradedPrice", h.get("LTP", h.get("ltp", h.get("lastprice", 0)))) or 0)
-            except Exception:
-                qty, buyavg, ltp = 0.0, 0.0, 0.0
-
-            if qty <= 0:
-                continue
-
-            pnl = round((ltp - buyavg) * qty, 2)
-            invested  += qty * buyavg
-            total_pnl += pnl
-
-            holdings_rows.append({
-                "name": name,
-                "symbol": symbol,
-                "quantity": qty,
-                "buy_avg": round(buyavg, 2),
-                "ltp": round(ltp, 2),
-                "pnl": pnl
-            })
-
-        current_value = invested + total_pnl
-
         # 2) funds
         funds = {}
         try:
-            f = requests.get(
-                "https://api.dhan.co/v2/fundlimit",
-                headers={"Content-Type": "application/json", "access-token": access_tok},
-                timeout=10
-            )
+            f = requests.get(f"{DHAN_API}/fundlimit", headers=_headers(access_tok), timeout=10)
             if f.status_code == 200 and f.content:
                 funds = f.json() or {}
         except Exception as e:
             print(f"[DHAN] fundlimit error for {name}: {e}")
 
-        available_balance     = float(funds.get("availabelBalance", funds.get("availableBalance", 0)) or 0)
-        withdrawable_balance  = float(funds.get("withdrawableBalance", 0) or 0)
-        utilized_amount       = float(funds.get("utilizedAmount", 0) or 0)
-        sod_limit             = float(funds.get("sodLimit", 0) or 0)
-        collateral_amount     = float(funds.get("collateralAmount", 0) or 0)
-        receivable_amount     = float(funds.get("receivableAmount", funds.get("receiveableAmount", 0)) or 0)
-        blocked_payout_amount = float(funds.get("blockedPayoutAmount", 0) or 0)
+        per_client.append(_holdings_and_summary(c, rows, funds))
+    return Book_models.merge_holdings(per_client)
 
-        available_margin = available_balance
-        net_gain = round((current_value + available_margin) - capital, 2)
 
-        summaries.append({
-            "name": name,
-            "capital": round(capital, 2),
-            "invested": round(invested, 2),
-            "pnl": round(total_pnl, 2),
-            "current_value": round(current_value, 2),
-            "available_margin": round(available_margin, 2),
+# ---------------------------
+# place orders (fixed)
+# ---------------------------
+# Dhan mappings
+EXCHANGE_MAP = {
+    "NSE": "NSE_EQ",
+    "BSE": "BSE_EQ",
+    "NSEFO": "NSE_FNO",
+    "NSE_FO": "NSE_FNO",
+    "NSECD": "NSE_CURRENCY",
+    "MCX": "MCX_COMM",
+    "BSEFO": "BSE_FNO",
+    "BSECD": "BSE_CURRENCY",
+    "NCDEX": "NCDEX",
+}
+PRODUCT_MAP = {
+    "INTRADAY": "INTRADAY",
+    "MIS": "INTRADAY",
+    "DELIVERY": "CNC",
+    "CNC": "CNC",
+    "NORMAL": "MARGIN",
+    "NRML": "MARGIN",
+    "VALUEPLUS": "INTRADAY",
+    "MTF": "MTF",
+}
+
+# Dhan exchangeSegment / productType -> router vocabulary (used by the copy
+# engine; router values are understood by both adapters)
+SEGMENT_TO_EXCHANGE = {
+    "NSE_EQ": "NSE",
+    "BSE_EQ": "BSE",
+    "NSE_FNO": "NSEFO",
+    "NSE_CURRENCY": "NSECD",
+    "MCX_COMM": "MCX",
+    "BSE_FNO": "BSEFO",
+    "BSE_CURRENCY": "BSECD",
+    "NCDEX": "NCDEX",
+}
+PRODUCT_TO_ROUTER = {
+    "CNC": "DELIVERY",
+    "INTRADAY": "VALUEPLUS",
+    "MARGIN": "NORMAL",
+    "MTF": "MTF",
+}
+
+def fill_snapshot(o: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Fill state of one raw /v2/orders row in router vocabulary (None if unusable)."""
+    oid = str(o.get("orderId") or "").strip()
+    if not oid:
+        return None
+    try:
+        filled = int(float(o.get("filledQty") or 0))
+    except Exception:
+        filled = 0
+    seg = str(o.get("exchangeSegment") or "").upper()
+    prod = str(o.get("productType") or "").upper()
+    return {
+        "order_id": oid,
+        "status": str(o.get("orderStatus") or "").upper(),
+        "filled_qty": filled,
+        "security_id": str(o.get("securityId") or ""),
+        "symbol": o.get("tradingSymbol") or "",
+        "exchange": SEGMENT_TO_EXCHANGE.get(seg, seg),
+        "action": str(o.get("transactionType") or "").upper(),
+        "producttype": PRODUCT_TO_ROUTER.get(prod, prod),
+        "price": o.get("averageTradedPrice") or o.get("price") or 0,
+        "correlation_id": o.get("correlationId") or "",
+        "fill_time": o.get("exchangeTime") or o.get("updateTime") or "",
+        "open": str(o.get("orderStatus") or "").upper() in ("PENDING", "TRANSIT", "PART_TRADED"),
+    }
 
-            "available_balance": round(available_balance, 2),
-            "withdrawable_balance": round(withdrawable_balance, 2),
-            "utilized_amount": round(utilized_amount, 2),
-            "sod_limit": round(sod_limit, 2),
-            "collateral_amount": round(collateral_amount, 2),
-            "receivable_amount": round(receivable_amount, 2),
-            "blocked_payout_amount": round(blocked_payout_amount, 2),
+def _order_key(od: Dict[str, Any]) -> str:
+    uid = str(od.get("client_id") or "").strip()
+    tag = od.get("tag") or ""
+    return f"{tag}:{uid}" if tag else uid
 
-            "net_gain": net_gain
-        })
+# Fields shared by every leg of one router request. They are validated and
+# mapped to Dhan enums once per batch; only the per-client fields are stamped.
+_TEMPLATE_FIELDS = (
+    "exchange", "ordertype", "producttype", "orderduration", "action",
+    "security_id", "price", "triggerprice", "disclosedquantity", "amoorder",
+)
 
-    return {"holdings": holdings_rows, "summary": summaries}
+def _template_key(od: Dict[str, Any]) -> tuple:
+    return tuple(od.get(f) for f in _TEMPLATE_FIELDS)
 
+def compile_order_template(od: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Validate and normalize the common fields of a router order row into a
+    prebuilt /v2/orders body (without dhanClientId, correlationId, quantity).
+    Returns (template, None) on success or (None, error_response) on failure.
+    """
+    exchange   = (od.get("exchange") or "NSE").upper()
+    ordertype  = _norm_order_type(od.get("ordertype") or "")
+    product_in = (od.get("producttype") or "").upper()
+    validity   = (od.get("orderduration") or "DAY").upper()
+
+    security_id = str(od.get("security_id") or "").strip()  # REQUIRED
+    try:
+        price = float(od.get("price") or 0)
+    except Exception:
+        price = 0.0
+    try:
+        trig = float(od.get("triggerprice") or 0)
+    except Exception:
+        trig = 0.0
+    disc_qty    = int(od.get("disclosedquantity") or 0)
+    is_amo      = (od.get("amoorder") or "N") == "Y"
+
+    # Validations to prevent DH-905
+    if not security_id:
+        return None, {"status": "ERROR", "message": "Missing securityId for Dhan"}
+    if _needs_price(ordertype) and price <= 0:
+        return None, {"status": "ERROR", "message": "Order requires price > 0"}
+    if _needs_trigger(ordertype) and trig <= 0:
+        return None, {"status": "ERROR", "message": "Order requires triggerPrice > 0"}
+
+    template: Dict[str, Any] = {
+        "dhanClientId": "",
+        "correlationId": "",
+        "transactionType": (od.get("action") or "").upper(),
+        "exchangeSegment": EXCHANGE_MAP.get(exchange, exchange),
+        "productType": PRODUCT_MAP.get(product_in, product_in),
+        "orderType": ordertype,                # already normalized
+        "validity": validity,
+        "securityId": security_id,
+        "quantity": 0,
+        "disclosedQuantity": disc_qty,         # always numeric
+        "price": price if _needs_price(ordertype) else 0,
+        "triggerPrice": trig if _needs_trigger(ordertype) else 0,
+        "afterMarketOrder": is_amo,
+        "amoTime": "OPEN",
+        "boProfitValue": 0,
+        "boStopLossValue": 0,
+    }
+    return template, None
+
+def _stamp_payload(compiled: Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]],
+                   od: Dict[str, Any], cj: Optional[Dict[str, Any]]) -> Tuple[Optional[str], Any]:
+    """Copy a compiled template and stamp the per-client fields onto it."""
+    uid = str(od.get("client_id") or "").strip()
+    if not cj:
+        return None, {"status": "ERROR", "message": "Client JSON not found"}
+
+    token = _token_of(cj)
+    if not token:
+        return None, {"status": "ERROR", "message": "Missing access token"}
+
+    template, err = compiled
+    if template is None:
+        return None, err
+
+    data = dict(template)
+    data["dhanClientId"] = uid
+    data["correlationId"] = od.get("correlation_id") or f"ROUTER{uid[-4:].zfill(4)}"
+    data["quantity"] = int(od.get("qty") or 0)
+    return token, data
+
+def _payload_builder():
+    """Per-batch builder: compiles each distinct template once, then stamps."""
+    compiled: Dict[tuple, Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]] = {}
+
+    def build(od: Dict[str, Any], cj: Optional[Dict[str, Any]]) -> Tuple[Optional[str], Any]:
+        key = _template_key(od)
+        tpl = compiled.get(key)
+        if tpl is None:
+            tpl = compiled[key] = compile_order_template(od)
+        return _stamp_payload(tpl, od, cj)
+
+    return build
+
+def _build_place_payload(od: Dict[str, Any], cj: Optional[Dict[str, Any]]) -> Tuple[Optional[str], Any]:
+    """
+    Validate one router order row and build the Dhan /v2/orders body.
+    Returns (token, payload) on success or (None, error_response) on failure.
+    """
+    return _stamp_payload(compile_order_template(od), od, cj)
+
+def _log_place(od: Dict[str, Any], token: str, data: Dict[str, Any]) -> None:
+    uid = str(od.get("client_id") or "").strip()
+    safe_token = f"{token[:6]}...{token[-4:]}" if token else ""
+    audit("dhan.place", level="debug", name=od.get("name") or uid, uid=uid,
+          token=safe_token, payload=data)
+
+def _log_place_response(od: Dict[str, Any], status_code: Any, resp: Any) -> None:
+    uid = str(od.get("client_id") or "").strip()
+    audit("dhan.place.response", name=od.get("name") or uid, uid=uid,
+          correlation_id=od.get("correlation_id") or "", http_status=status_code, response=resp)
+
+def _clients_by_id() -> Dict[str, Dict[str, Any]]:
+    by_id: Dict[str, Dict[str, Any]] = {}
+    for c in _read_clients():
+        uid = str(c.get("userid") or c.get("client_id") or "").strip()
+        if uid:
+            by_id[uid] = c
+    return by_id
+
+def _is_auth_error(status_code: Any, resp: Any) -> bool:
+    """401 / DH-901: the access token was rejected."""
+    if status_code == 401:
+        return True
+    return isinstance(resp, dict) and str(resp.get("errorCode") or "").upper() == "DH-901"
+
+def _fresh_client(uid: str, used_token: str) -> Optional[Dict[str, Any]]:
+    """Client record re-read from disk, only if it now carries a different token."""
+    c = _clients_by_id().get(uid)
+    return c if c and _token_of(c) and _token_of(c) != used_token else None
+
+def check_session(c: Dict[str, Any], relogin_before_s: float = 0) -> Dict[str, Any]:
+    """
+    Keep-alive probe: /v2/profile with the token-validity parsing of login().
+    Dhan access tokens are generated by the user, so nothing can be renewed
+    here; a token inside relogin_before_s of expiry is reported as expiring.
+    """
+    res = login(c)
+    exp = None
+    if res.get("token_validity_iso"):
+        try:
+            exp = datetime.fromisoformat(res["token_validity_iso"]).timestamp()
+        except Exception:
+            exp = None
+    action = "ok"
+    if not res.get("ok"):
+        action = "invalid"
+    elif exp is not None and exp - time.time() <= relogin_before_s:
+        action = "expiring"
+    return {"ok": bool(res.get("ok")), "action": action, "expires_at": exp,
+            "message": res.get("message") or None}
 
-# ---------------------------
-# place orders (fixed)
-# ---------------------------
 def place_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
     Place a batch of orders on Dhan.
@@ -538,146 +780,53 @@ def place_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
         return {"status": "empty", "order_responses": {}}
 
     # Build a quick lookup: dhan userid -> client json
-    by_id: Dict[str, Dict[str, Any]] = {}
-    for c in _read_clients():
-        uid = str(c.get("userid") or c.get("client_id") or "").strip()
-        if uid:
-            by_id[uid] = c
-
-    # Dhan mappings
-    EXCHANGE_MAP = {
-        "NSE": "NSE_EQ",
-        "BSE": "BSE_EQ",
-        "NSEFO": "NSE_FNO",
-        "NSE_FO": "NSE_FNO",
-        "NSECD": "NSE_CURRENCY",
-        "MCX": "MCX_COMM",
-        "BSEFO": "BSE_FNO",
-        "BSECD": "BSE_CURRENCY",
-        "NCDEX": "NCDEX",
-    }
-    PRODUCT_MAP = {
-        "INTRADAY": "INTRADAY",
-        "MIS": "INTRADAY",
-        "DELIVERY": "CNC",
-        "CNC": "CNC",
-        "NORMAL": "MARGIN",
-        "NRML": "MARGIN",
-        "VALUEPLUS": "INTRADAY",
-        "MTF": "MTF",
-    }
+    by_id = _clients_by_id()
+    build = _payload_builder()
 
     responses: Dict[str, Any] = {}
     lock = threading.Lock()
     threads: List[threading.Thread] = []
 
     def _worker(od: Dict[str, Any]) -> None:
-        uid  = str(od.get("client_id") or "").strip()
-        tag  = od.get("tag") or ""
-        key  = f"{tag}:{uid}" if tag else uid
-        name = od.get("name") or uid
-
-        cj = by_id.get(uid)
-        if not cj:
-            with lock:
-                responses[key] = {"status": "ERROR", "message": "Client JSON not found"}
-            return
-
-        token = (cj.get("apikey") or cj.get("access_token") or "").strip()
-        if not token:
-            with lock:
-                responses[key] = {"status": "ERROR", "message": "Missing access token"}
-            return
-
-        # Gather/normalize fields
-        exchange   = (od.get("exchange") or "NSE").upper()
-        ordertype  = _norm_order_type(od.get("ordertype") or "")
-        product_in = (od.get("producttype") or "").upper()
-        validity   = (od.get("orderduration") or "DAY").upper()
-
-        security_id = str(od.get("security_id") or "").strip()  # REQUIRED
-        qty         = int(od.get("qty") or 0)
-        try:
-            price = float(od.get("price") or 0)
-        except Exception:
-            price = 0.0
-        try:
-            trig = float(od.get("triggerprice") or 0)
-        except Exception:
-            trig = 0.0
-        disc_qty    = int(od.get("disclosedquantity") or 0)
-        is_amo      = (od.get("amoorder") or "N") == "Y"
-        corr_id     = od.get("correlation_id") or f"ROUTER{uid[-4:].zfill(4)}"
-
-        # Validations to prevent DH-905
-        if not security_id:
-            with lock:
-                responses[key] = {"status": "ERROR", "message": "Missing securityId for Dhan"}
-            return
-        if _needs_price(ordertype) and price <= 0:
-            with lock:
-                responses[key] = {"status": "ERROR", "message": "Order requires price > 0"}
-            return
-        if _needs_trigger(ordertype) and trig <= 0:
+        key = _order_key(od)
+        with lock:
+            token, data = build(od, by_id.get(str(od.get("client_id") or "").strip()))
+        if token is None:
             with lock:
-                responses[key] = {"status": "ERROR", "message": "Order requires triggerPrice > 0"}
+                responses[key] = data
             return
 
-        data: Dict[str, Any] = {
-            "dhanClientId": uid,
-            "correlationId": corr_id,
-            "transactionType": (od.get("action") or "").upper(),
-            "exchangeSegment": EXCHANGE_MAP.get(exchange, exchange),
-            "productType": PRODUCT_MAP.get(product_in, product_in),
-            "orderType": ordertype,                # already normalized
-            "validity": validity,
-            "securityId": security_id,
-            "quantity": qty,
-            "disclosedQuantity": disc_qty,         # always numeric
-            "price": price if _needs_price(ordertype) else 0,
-            "triggerPrice": trig if _needs_trigger(ordertype) else 0,
-            "afterMarketOrder": is_amo,
-            "amoTime": "OPEN",
-            "boProfitValue": 0,
-            "boStopLossValue": 0,
-        }
+        _log_place(od, token, data)
 
-        # --- DEBUG: print final payload & response ---
-        try:
-            safe_token = f"{token[:6]}...{token[-4:]}" if token else ""
-            print(f"[DHAN] placing name={name} uid={uid} token={safe_token}")
-            print("[DHAN] payload =>")
-            print(json.dumps(data, indent=2))
-        except Exception:
-            pass
-
-        try:
-            r = requests.post(
-                "https://api.dhan.co/v2/orders",
-                headers={"Content-Type": "application/json", "access-token": token},
-                json=data,
-                timeout=15,
-            )
+        def _send(token, data):
+            uid = str(od.get("client_id") or "").strip()
+            try:
+                r = _order_send("POST", f"{DHAN_API}/orders", uid, headers=_headers(token), json=data, timeout=15)
+            except Exception as e:
+                return None, {"status": "ERROR", "message": str(e)}
             try:
-                resp = r.json()
+                return r, r.json()
             except Exception:
-                resp = {"_raw": getattr(r, "text", "")}
-        except Exception as e:
-            r = None
-            resp = {"status": "ERROR", "message": str(e)}
+                return r, {"_raw": getattr(r, "text", "")}
 
-        try:
-            print(f"[DHAN] http_status={getattr(r, 'status_code', 'NA')}")
-            print("[DHAN] response =>")
-            print(json.dumps(resp, indent=2))
-        except Exception:
-            pass
+        r, resp = _send(token, data)
+        if _is_auth_error(getattr(r, "status_code", None), resp):
+            # the token was replaced on disk since this batch loaded it: retry once
+            fresh = _fresh_client(str(od.get("client_id") or "").strip(), token)
+            if fresh is not None:
+                audit("dhan.place.auth_retry", uid=od.get("client_id"))
+                with lock:
+                    token, data = build(od, fresh)
+                if token is not None:
+                    r, resp = _send(token, data)
+
+        _log_place_response(od, getattr(r, "status_code", "NA"), resp)
 
         with lock:
             responses[key] = resp
 
     for item in orders:
-        t = threading.Thread(target=_worker, args=(item,))
+        t = threading.Thread(target=Req_timing.bind(_worker, item))
         t.start()
         threads.append(t)
     for t in threads:
@@ -824,33 +973,20 @@ def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
             if payload.get("quantity", 1) <= 0:
                 payload.pop("quantity", None)  # don't send zero/negative qty
 
-            url = f"https://api.dhan.co/v2/orders/{order_id}"
+            url = f"{DHAN_API}/orders/{order_id}"
             headers = {"Content-Type": "application/json", "access-token": token}
 
-            # --- DEBUG OUT ---
-            try:
-                safe_token = f"{token[:6]}...{token[-4:]}"
-                print("---- Dhan ModifyOrder (OUT) ----")
-                print(json.dumps({
-                    "url": url,
-                    "headers": {"access-token": safe_token},
-                    "payload": payload
-                }, indent=2))
-            except Exception:
-                pass
+            audit("dhan.modify", level="debug", name=name, uid=dhan_id, order_id=order_id,
+                  token=f"{token[:6]}...{token[-4:]}", payload=payload)
 
-            r = requests.put(url, headers=headers, json=payload, timeout=20)
+            r = _order_send("PUT", url, dhan_id, headers=headers, json=payload, timeout=20)
             try:
                 body = r.json() if r.content else {}
             except Exception:
                 body = {"raw": getattr(r, "text", "")}
 
-            # --- DEBUG RESP ---
-            try:
-                print("---- Dhan ModifyOrder (RESP) ----")
-                print(json.dumps({"status_code": r.status_code, "response": body}, indent=2))
-            except Exception:
-                pass
+            audit("dhan.modify.response", name=name, uid=dhan_id, order_id=order_id,
+                  http_status=r.status_code, response=body)
 
             # Success heuristic: 2xx and no errorType
             ok = (200 <= r.status_code < 300) and not (isinstance(body, dict) and body.get("errorType"))
@@ -869,27 +1005,465 @@ def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
 
 
 
+# ---------------------------
+# async adapter (httpx)
+# ---------------------------
+# One pooled AsyncClient per lane and running event loop. The router awaits
+# these coroutines with asyncio.gather, so book refreshes and order fan-out no
+# longer hold a threadpool worker per broker call.
+_async_state: Dict[str, Any] = {"loop": None, "clients": {}}
+_lane_inflight: Dict[str, int] = {lane: 0 for lane in ASYNC_LANE_CONNECTIONS}
+
+def _async_client(lane: str = "reports"):
+    loop = asyncio.get_running_loop()
+    if _async_state["loop"] is not loop:
+        _async_state["loop"], _async_state["clients"] = loop, {}
+    cli = _async_state["clients"].get(lane)
+    if cli is None or cli.is_closed:
+        conns = ASYNC_LANE_CONNECTIONS.get(lane, ASYNC_LANE_CONNECTIONS["reports"])
+        cli = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=conns, max_keepalive_connections=conns),
+            timeout=15,
+        )
+        _async_state["clients"][lane] = cli
+    return cli
+
+def lane_stats() -> Dict[str, Dict[str, int]]:
+    """In-flight async requests and pool size per lane."""
+    return {lane: {"inflight": _lane_inflight.get(lane, 0), "max_connections": conns}
+            for lane, conns in ASYNC_LANE_CONNECTIONS.items()}
+
+def _api_of(method: str, url: str) -> str:
+    """'GET /orders' for metrics labels; numeric path segments (order ids) collapse to {id}."""
+    path = url[len(DHAN_API):] if url.startswith(DHAN_API) else url
+    segs = [("{id}" if s.isdigit() else s) for s in path.split("?", 1)[0].split("/")]
+    return f"{method} {'/'.join(segs)}"
+
+def _observe_call(api: str, uid: str, t0: float, status: Any) -> None:
+    client = Metrics.client_label(uid)
+    Metrics.BROKER_CALL_SECONDS.observe(time.perf_counter() - t0, "dhan", api, client)
+    if status != 200:
+        reason = "transport" if status is None else ("throttled" if status == 429 else f"http_{status}")
+        Metrics.BROKER_CALL_ERRORS.inc("dhan", api, client, reason)
+
+def _breaker_record(uid: Any, status: Any, err: str) -> None:
+    # only transport failures and 5xx say the broker is unwell
+    if err:
+        breakers.record("dhan", uid, ok=False, reason=err)
+    elif isinstance(status, int):
+        breakers.record("dhan", uid, ok=status < 500, reason=f"http {status}")
+
+def _throttled(r: Any) -> bool:
+    # 429, or Dhan's DH-904 ("too many requests") under another status
+    status = getattr(r, "status_code", 200)
+    return status == 429 or (status >= 400 and b"DH-904" in (r.content or b""))
+
+def _order_send_once(method: str, url: str, uid: str, **kw):
+    breakers.check("dhan", uid)
+    t0, r, err = time.perf_counter(), None, ""
+    try:
+        with span("dhan.http.orders"):
+            r = requests.request(method, url, **kw)
+        return r
+    except Exception as e:
+        err = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        status = getattr(r, "status_code", None)
+        _observe_call(_api_of(method, url), uid, t0, status)
+        _breaker_record(uid, status, err)
+
+def _order_send(method: str, url: str, uid: str, **kw):
+    """
+    Blocking twin of _asend for order calls made on threads (place, modify,
+    cancel, square-off): waits for an order slot of the account's rate limit,
+    and a throttled call is queued again and resent, up to THROTTLE_RETRIES
+    times. Raises CircuitOpen, Rate_limiter.Throttled and transport errors.
+    """
+    lim = Rate_limiter.limiter("dhan", uid)
+    attempt = 0
+    while True:
+        lim.wait_sync(Rate_limiter.ORDER)
+        r = _order_send_once(method, url, uid, **kw)
+        if not _throttled(r):
+            lim.ok()
+            return r
+        lim.throttled(Rate_limiter.retry_after_s(r.headers))
+        if attempt >= Rate_limiter.RETRIES:
+            return r
+        attempt += 1
+        Rate_limiter.REQUEUED.inc("dhan")
+        audit("dhan.order.requeue", uid=uid, api=_api_of(method, url), attempt=attempt)
+
+async def _asend(lane: str, method: str, url: str, uid: str = "", **kw):
+    """
+    One Dhan request behind the account's rate limit (orders lane first, the
+    reports lane yields). A throttled order is queued again and resent, up to
+    THROTTLE_RETRIES times; a throttled read is returned as is.
+    """
+    prio = Rate_limiter.ORDER if lane == "orders" else Rate_limiter.READ
+    lim = Rate_limiter.limiter("dhan", uid)
+    attempt = 0
+    while True:
+        await lim.wait(prio)
+        r = await _asend_once(lane, method, url, uid, **kw)
+        if not _throttled(r):
+            lim.ok()
+            return r
+        lim.throttled(Rate_limiter.retry_after_s(r.headers))
+        if prio != Rate_limiter.ORDER or attempt >= Rate_limiter.RETRIES:
+            return r
+        attempt += 1
+        Rate_limiter.REQUEUED.inc("dhan")
+        audit("dhan.order.requeue", uid=uid, api=_api_of(method, url), attempt=attempt)
+
+async def _asend_once(lane: str, method: str, url: str, uid: str = "", **kw):
+    try:
+        breakers.check("dhan", uid)
+    except CircuitOpen:
+        Req_deadline.mark("dhan", uid, "circuit_open")
+        raise
+    # never wait past the request's deadline
+    timeout, bound = Req_deadline.bounded(float(kw.get("timeout") or 15))
+    if timeout <= 0:
+        Req_deadline.mark("dhan", uid, "skipped")
+        breakers.release("dhan", uid)
+        raise DeadlineExceeded("request deadline passed")
+    kw["timeout"] = timeout
+    _lane_inflight[lane] = _lane_inflight.get(lane, 0) + 1
+    t0, status, err = time.perf_counter(), None, ""
+    try:
+        with span(f"dhan.http.{lane}"):
+            call = _async_client(lane).request(method, url, **kw)
+            r = await (asyncio.wait_for(call, timeout) if bound else call)
+            status = r.status_code
+            return r
+    except Exception as e:
+        if bound and isinstance(e, (asyncio.TimeoutError, httpx.TimeoutException)):
+            # our budget ran out first; that says nothing about the broker
+            Req_deadline.mark("dhan", uid, "timed_out")
+        else:
+            err = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _lane_inflight[lane] -= 1
+        _observe_call(_api_of(method, url), uid, t0, status)
+        if status is None and not err:
+            # cut off by our deadline or cancelled: no verdict on the broker
+            breakers.release("dhan", uid)
+        else:
+            _breaker_record(uid, status, err)
+
+async def aclose() -> None:
+    """Close the pooled async clients (router shutdown)."""
+    clients = list(_async_state["clients"].values())
+    _async_state["loop"], _async_state["clients"] = None, {}
+    for cli in clients:
+        if not cli.is_closed:
+            await cli.aclose()
+
+def _transient_read(r: Any, exc: Optional[BaseException]) -> bool:
+    if exc is not None:
+        return isinstance(exc, httpx.TransportError)
+    return getattr(r, "status_code", None) in (500, 502, 503, 504)
+
+async def _aread(token: str, path: str, uid: str):
+    """Idempotent GET on the reports lane, hedged and retried per Read_hedge (never used for orders)."""
+    return await Read_hedge.call(
+        ("dhan", f"GET {path}"),
+        lambda: _asend("reports", "GET", f"{DHAN_API}{path}", uid=uid, headers=_headers(token), timeout=10),
+        _transient_read)
+
+async def _aget_list(token: str, path: str, name: str, what: str, uid: str = "") -> List[Dict[str, Any]]:
+    try:
+        r = await _aread(token, path, uid)
+        rows = r.json() if r.status_code == 200 else []
+        return rows if isinstance(rows, list) else []
+    except (CircuitOpen, DeadlineExceeded):
+        return []
+    except Exception as e:
+        print(f"[DHAN] {what} error for {name}: {e}")
+        return []
 
+async def _aget_dict(token: str, path: str, name: str, what: str, uid: str = "") -> Dict[str, Any]:
+    try:
+        r = await _aread(token, path, uid)
+        if r.status_code == 200 and r.content:
+            body = r.json() or {}
+            return body if isinstance(body, dict) else {}
+    except (CircuitOpen, DeadlineExceeded):
+        return {}
+    except Exception as e:
+        print(f"[DHAN] {what} error for {name}: {e}")
+    return {}
+
+async def _book_clients(clients: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """The caller's cached client records, else the client files read off the loop."""
+    if clients is None:
+        clients = await asyncio.to_thread(_read_clients)
+    return [c for c in clients if _token_of(c)]
+
+async def get_orders_async(clients: Optional[List[Dict[str, Any]]] = None) -> Dict[str, List[Order]]:
+    if httpx is None:
+        return await asyncio.to_thread(get_orders)
+    clients = await _book_clients(clients)
+    books = await asyncio.gather(*[
+        _aget_list(_token_of(c), "/orders", _name_of(c), "get_orders", _uid_of(c)) for c in clients
+    ])
+    return Book_models.bucket_orders(
+        [_order_row(_name_of(c), _uid_of(c), o) for o in orders] for c, orders in zip(clients, books))
+
+async def get_positions_async(clients: Optional[List[Dict[str, Any]]] = None) -> Dict[str, List[Position]]:
+    if httpx is None:
+        return await asyncio.to_thread(get_positions)
+    clients = await _book_clients(clients)
+    books = await asyncio.gather(*[
+        _aget_list(_token_of(c), "/positions", _name_of(c), "get_positions", _uid_of(c)) for c in clients
+    ])
+    return Book_models.bucket_positions(
+        [_position_row(_name_of(c), _uid_of(c), pos) for pos in rows] for c, rows in zip(clients, books))
+
+async def get_holdings_async(clients: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    if httpx is None:
+        return await asyncio.to_thread(get_holdings)
+
+    async def _one(c: Dict[str, Any]):
+        token, name = _token_of(c), _name_of(c)
+        rows, funds = await asyncio.gather(
+            _aget_list(token, "/holdings", name, "get_holdings", _uid_of(c)),
+            _aget_dict(token, "/fundlimit", name, "fundlimit", _uid_of(c)),
+        )
+        return _holdings_and_summary(c, rows, funds)
 
+    clients = await _book_clients(clients)
+    return Book_models.merge_holdings(await asyncio.gather(*[_one(c) for c in clients]))
 
+async def place_orders_async(orders: List[Dict[str, Any]],
+                             clients: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Async twin of place_orders(): same input/output, one pooled HTTP request per order.
+    `clients` (userid -> client json) skips reading the client files when the
+    caller already holds them.
+    """
+    if not isinstance(orders, list) or not orders:
+        return {"status": "empty", "order_responses": {}}
+    if httpx is None:
+        return await asyncio.to_thread(place_orders, orders)
 
+    by_id = clients if clients is not None else _clients_by_id()
+    build = _payload_builder()
 
+    async def _send(token: str, data: Dict[str, Any], uid: str):
+        try:
+            r = await _asend("orders", "POST", f"{DHAN_API}/orders", uid=uid,
+                             headers=_headers(token), json=data, timeout=15)
+            try:
+                return r.status_code, r.json()
+            except Exception:
+                return r.status_code, {"_raw": r.text}
+        except Exception as e:
+            return "NA", {"status": "ERROR", "message": str(e)}
+
+    async def _one(od: Dict[str, Any]):
+        uid = str(od.get("client_id") or "").strip()
+        token, data = build(od, by_id.get(uid))
+        if token is None:
+            return _order_key(od), data
+        _log_place(od, token, data)
+        status_code, resp = await _send(token, data, uid)
+        if _is_auth_error(status_code, resp):
+            # the token was replaced on disk since the caller loaded it: retry once
+            fresh = await asyncio.to_thread(_fresh_client, uid, token)
+            if fresh is not None:
+                audit("dhan.place.auth_retry", uid=uid)
+                token, data = build(od, fresh)
+                if token is not None:
+                    status_code, resp = await _send(token, data, uid)
+        _log_place_response(od, status_code, resp)
+        return _order_key(od), resp
+
+    results = await asyncio.gather(*[_one(od) for od in orders])
+    return {"status": "completed", "order_responses": dict(results)}
 
 
+# ---------------------------
+# master order poller (copy engine, UI stream)
+# ---------------------------
+# Dhan has no push feed for a master's orders, so /v2/orders is polled, one
+# thread per watched client. The interval drops to DHAN_POLL_MIN_S after any
+# change or while orders are open and grows by 1.5x per quiet poll up to
+# DHAN_POLL_MAX_S. An unchanged response body is skipped without parsing;
+# otherwise each order is diffed against its last seen state and every
+# new state is emitted once to the client's subscribers.
+POLL_MIN_S = float(os.getenv("DHAN_POLL_MIN_S", "0.25"))
+POLL_MAX_S = float(os.getenv("DHAN_POLL_MAX_S", "2.0"))
+POLL_ERR_S = float(os.getenv("DHAN_POLL_ERR_S", "5.0"))
+
+# fixed offset: the ZoneInfo _IST above may be None without tzdata
+_IST_FIXED = timezone(timedelta(hours=5, minutes=30))
+_OPEN_STATUSES = ("PENDING", "TRANSIT", "PART_TRADED")
+
+def _ist_epoch(ts: Any) -> Optional[float]:
+    try:
+        return datetime.strptime(str(ts).strip()[:19], "%Y-%m-%d %H:%M:%S").replace(tzinfo=_IST_FIXED).timestamp()
+    except Exception:
+        return None
 
+def _order_state(o: Dict[str, Any]) -> tuple:
+    return (o.get("orderStatus"), o.get("filledQty"), o.get("quantity"),
+            o.get("price"), o.get("triggerPrice"), o.get("updateTime"))
+
+class _MasterPoller:
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.subscribers: List[Any] = []
+        self.interval = POLL_MIN_S
+        self.stats = {"polls": 0, "unchanged": 0, "events": 0, "errors": 0}
+        self.latency = deque(maxlen=1000)      # detection latency samples (ms)
+        self._state: Dict[str, tuple] = {}     # order_id -> last emitted state
+        self._filled: Dict[str, int] = {}
+        self._body_hash = None
+        self._open = False
+        self._seeded = False
+        self._token = ""
+        self._token_at = 0.0
+        self._http = requests.Session()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"dhan-poll-{client_id}", daemon=True)
+
+    def _auth(self) -> str:
+        # re-read the client file now and then so a fresh token is picked up
+        now = time.time()
+        if not self._token or now - self._token_at > 30:
+            c = _clients_by_id().get(self.client_id)
+            self._token = _token_of(c) if c else ""
+            self._token_at = now
+        return self._token
+
+    def _emit(self, ev: Dict[str, Any]) -> None:
+        self.stats["events"] += 1
+        for cb in list(self.subscribers):
+            try:
+                cb(ev)
+            except Exception as e:
+                print(f"[DHAN] poller subscriber failed for {self.client_id}: {e}")
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    def poll_once(self) -> bool:
+        """One poll; returns True when something changed or orders are open."""
+        token = self._auth()
+        if not token:
+            raise RuntimeError("missing access token")
+        lim = Rate_limiter.limiter("dhan", self.client_id)
+        lim.wait_sync(Rate_limiter.READ)
+        r = self._http.get(f"{DHAN_API}/orders", headers=_headers(token), timeout=10)
+        if _throttled(r):
+            lim.throttled(Rate_limiter.retry_after_s(r.headers))
+        else:
+            lim.ok()
+        if r.status_code != 200:
+            raise RuntimeError(f"http {r.status_code}")
+        detected = time.time()
+        self.stats["polls"] += 1
+
+        body_hash = hash(r.content)
+        if body_hash == self._body_hash:
+            self.stats["unchanged"] += 1
+            return self._open
+        self._body_hash = body_hash
+
+        orders = r.json()
+        if not isinstance(orders, list):
+            orders = []
+        changed = False
+        self._open = False
+        current = set()
+        for o in orders:
+            if not isinstance(o, dict):
+                continue
+            oid = str(o.get("orderId") or "")
+            if not oid:
+                continue
+            current.add(oid)
+            self._open = self._open or str(o.get("orderStatus") or "").upper() in _OPEN_STATUSES
+            st = _order_state(o)
+            prev = self._state.get(oid)
+            if prev == st:
+                continue
+            self._state[oid] = st
+            snap = fill_snapshot(o) or {}
+            prev_filled = self._filled.get(oid, 0)
+            self._filled[oid] = snap.get("filled_qty", 0)
+            if not self._seeded:
+                continue  # the book as it was when watching started is not news
+            changed = True
+            ev = {
+                "type": "new" if prev is None else "changed",
+                "broker": "dhan",
+                "client_id": self.client_id,
+                "order": snap,
+                "fill_qty": max(0, snap.get("filled_qty", 0) - prev_filled),
+                "detected_at": detected,
+            }
+            t_upd = _ist_epoch(o.get("updateTime") or o.get("exchangeTime"))
+            if t_upd is not None:
+                ev["detect_latency_ms"] = round((detected - t_upd) * 1000, 1)
+                self.latency.append(ev["detect_latency_ms"])
+            self._emit(ev)
+        # the book is intraday: forget orders it no longer lists (yesterday's)
+        for oid in self._state.keys() - current:
+            self._state.pop(oid, None)
+            self._filled.pop(oid, None)
+        self._seeded = True
+        return changed or self._open
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                busy = self.poll_once()
+                self.interval = POLL_MIN_S if busy else min(POLL_MAX_S, self.interval * 1.5)
+            except Exception as e:
+                self.stats["errors"] += 1
+                self.interval = min(POLL_ERR_S, max(self.interval, POLL_MIN_S) * 2)
+                print(f"[DHAN] poll {self.client_id} failed: {e}")
+            self._stop.wait(self.interval)
+        self._http.close()
+
+    def snapshot(self) -> Dict[str, Any]:
+        lat = sorted(self.latency)
+        pick = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] if lat else 0.0
+        return {**self.stats, "interval_s": round(self.interval, 3), "subscribers": len(self.subscribers),
+                "orders_seen": len(self._state), "open_orders": self._open,
+                "detect_latency_ms": {"count": len(lat), "p50": pick(0.5), "p95": pick(0.95), "max": pick(1.0)}}
+
+_pollers: Dict[str, _MasterPoller] = {}
+_pollers_lock = threading.Lock()
+
+def subscribe_orders(client_id: str, callback):
+    """
+    Watch a client's order book; callback(event) runs on the poller thread for
+    every new or changed order. Returns an unsubscribe function; the poller
+    stops when its last subscriber leaves.
+    """
+    uid = str(client_id).strip()
+    with _pollers_lock:
+        p = _pollers.get(uid)
+        if p is None:
+            p = _pollers[uid] = _MasterPoller(uid)
+            p.subscribers.append(callback)
+            p._thread.start()
+        else:
+            p.subscribers.append(callback)
+
+    def _unsubscribe():
+        with _pollers_lock:
+            if callback in p.subscribers:
+                p.subscribers.remove(callback)
+            if not p.subscribers and _pollers.get(uid) is p:
+                del _pollers[uid]
+                p._stop.set()
+    return _unsubscribe
+
+def poller_stats() -> Dict[str, Any]:
+    with _pollers_lock:
+        items = list(_pollers.items())
+    return {uid: p.snapshot() for uid, p in items}
@@ -1,6 +1,7 @@
-import os, json, logging
-from typing import Dict, Any, List
+import os, json, logging, asyncio, time
+from typing import Dict, Any, List, Optional, Tuple
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import threading
 from datetime import datetime, timedelta, timezone
 IST = timezone(timedelta(hours=5, minutes=30))
@@ -15,14 +16,261 @@ except Exception:
     pyotp = None
 
 from MOFSLOPENAPI import MOFSLOPENAPI  # requires your SDK
+import MOFSLOPENAPI as _sdk_module
+import requests
+from Audit_log import audit
+import Req_timing
+from Req_timing import span
+import Metrics
+from Session_store import SessionStore
+from Circuit_breaker import breakers, CircuitOpen
+import Req_deadline
+from Req_deadline import DeadlineExceeded
+import Read_hedge
+import Rate_limiter
+import Book_models
+from Book_models import Order, Position, Holding, Funds
+import hashlib
 
 BASE_URL        = os.getenv("MO_BASE_URL", "https://openapi.motilaloswal.com")
 SOURCE_ID       = os.getenv("MO_SOURCE_ID", "Desktop")
 BROWSER_NAME    = os.getenv("MO_BROWSER", "chrome")
 BROWSER_VERSION = os.getenv("MO_BROWSER_VER", "104")
+HTTP_TIMEOUT_S  = float(os.getenv("MO_HTTP_TIMEOUT_S", "15"))
+# how long watch_trades() waits for the trade-status socket to open and answer
+TRADE_WS_ACK_S  = float(os.getenv("MO_TRADE_WS_ACK_S", "10"))
+
+
+# ---------------------------
+# SDK transport
+# ---------------------------
+# MOFSLOPENAPI posts with requests.post and no timeout, and turns transport
+# errors into a string it then fails to parse, so a dead broker looks like a
+# JSON error. The SDK module's `requests` is swapped for this shim: every
+# request gets min(own timeout, request deadline) and transport failures and
+# 429s are noted per thread, which is what _guarded() reports to the circuit
+# breakers and the rate limiter. A request the deadline skipped or cut off is
+# noted too, so the breakers get their trial slot back instead of a verdict.
+_tls = threading.local()
+
+class _SdkTransport:
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+    def _timeout(self, kw: Dict[str, Any]) -> bool:
+        timeout, bound = Req_deadline.bounded(float(kw.get("timeout") or HTTP_TIMEOUT_S))
+        if timeout <= 0:
+            _tls.no_answer = True
+            raise DeadlineExceeded("request deadline passed")
+        kw["timeout"] = timeout
+        return bound
+
+    def post(self, url, **kw):
+        bound = self._timeout(kw)
+        try:
+            r = requests.post(url, **kw)
+        except Exception as e:
+            if bound and isinstance(e, requests.Timeout):
+                # the request's budget ran out, not the broker
+                Req_deadline.mark("motilal", getattr(_tls, "uid", ""), "timed_out")
+                _tls.no_answer = True
+            else:
+                _tls.transport_error = f"{type(e).__name__}: {e}"
+            raise
+        if r.status_code == 429:
+            _tls.throttle = Rate_limiter.retry_after_s(r.headers) or 0.0
+        elif r.status_code >= 500:
+            _tls.transport_error = f"http {r.status_code}"
+        return r
+
+    def get(self, url, **kw):
+        # the SDK's post-failure connectivity check must respect the deadline too
+        self._timeout(kw)
+        return requests.get(url, **kw)
+
+_sdk_module.requests = _SdkTransport()
+
+class _TransportError(Exception):
+    """A read whose HTTP exchange failed (see _SdkTransport); retryable."""
+
+def _read(uid: str, api: str, fn, *args):
+    """Idempotent SDK read, hedged and retried per Read_hedge (never used for orders)."""
+    def once():
+        resp = _guarded(uid, fn, *args)
+        if _tls.transport_error:
+            raise _TransportError(_tls.transport_error)
+        return resp
+    return Read_hedge.call_sync(("motilal", api), once)
+
+# SDK calls that move orders: they go ahead of reads on the account's rate
+# limit and are resent when throttled
+_ORDER_CALLS = {"PlaceOrder", "ModifyOrder", "CancelOrder"}
+_THROTTLE_HINTS = ("too many request", "rate limit", "throttl")
+
+def _throttle_of(resp: Any) -> Optional[float]:
+    """None if the call was not throttled, else Retry-After seconds (0.0 when not given)."""
+    if _tls.throttle is not None:
+        return _tls.throttle
+    if isinstance(resp, dict) and str(resp.get("status") or "").upper() != "SUCCESS":
+        msg = str(resp.get("message") or "").lower()
+        if str(resp.get("errorcode") or "") == "429" or any(h in msg for h in _THROTTLE_HINTS):
+            return 0.0
+    return None
+
+def _guarded(uid: str, fn, *args):
+    """
+    One SDK call behind the account's rate limit. A throttled order call is
+    queued again and resent, up to THROTTLE_RETRIES times; a throttled read
+    is returned as is.
+    """
+    order = getattr(fn, "__name__", "") in _ORDER_CALLS
+    lim = Rate_limiter.limiter("motilal", uid)
+    attempt = 0
+    while True:
+        lim.wait_sync(Rate_limiter.ORDER if order else Rate_limiter.READ)
+        resp = _guarded_once(uid, fn, *args)
+        retry_after = _throttle_of(resp)
+        if retry_after is None:
+            lim.ok()
+            return resp
+        lim.throttled(retry_after or None)
+        if not order or attempt >= Rate_limiter.RETRIES:
+            return resp
+        attempt += 1
+        Rate_limiter.REQUEUED.inc("motilal")
+        audit("mo.requeue", uid=uid, api=fn.__name__, attempt=attempt)
+
+def _guarded_once(uid: str, fn, *args):
+    """One SDK call behind the account and broker circuit breakers and the request deadline."""
+    try:
+        breakers.check("motilal", uid)
+    except CircuitOpen:
+        Req_deadline.mark("motilal", uid, "circuit_open")
+        raise
+    left = Req_deadline.remaining()
+    if left is not None and left <= 0:
+        Req_deadline.mark("motilal", uid, "skipped")
+        breakers.release("motilal", uid)
+        raise DeadlineExceeded("request deadline passed")
+    _tls.transport_error, _tls.throttle, _tls.uid, _tls.no_answer = None, None, uid, False
+    try:
+        return fn(*args)
+    finally:
+        err = _tls.transport_error
+        if err is None and _tls.no_answer:
+            breakers.release("motilal", uid)
+        else:
+            breakers.record("motilal", uid, ok=err is None, reason=err or "")
 
 STAT_KEYS = ["pending","traded","rejected","cancelled","others"]
-_sessions: Dict[str, MOFSLOPENAPI] = {}
+
+class _SessionManager:
+    """
+    userid -> logged-in SDK, safe to use from any thread.
+
+    Logins are single-flight per client: concurrent callers for the same
+    userid wait on that client's lock and reuse the session the first one
+    created, instead of each building an SDK and logging in (a second login
+    can invalidate the first token). The map is an LRU capped at max_size;
+    sessions unused for idle_s are evicted on the next insert or sweep.
+    """
+
+    def __init__(self, max_size: int, idle_s: float):
+        self.max_size = max_size
+        self.idle_s = idle_s
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._flights: Dict[str, threading.RLock] = {}
+        self.counters = {"hits": 0, "misses": 0, "logins": 0, "login_failures": 0,
+                         "login_ms_total": 0.0, "deduplicated": 0, "evicted_lru": 0,
+                         "evicted_idle": 0}
+
+    def get(self, uid: str) -> Optional[MOFSLOPENAPI]:
+        with self._lock:
+            e = self._items.get(uid)
+            if e is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits"] += 1
+            e["used_at"] = time.time()
+            self._items.move_to_end(uid)
+            return e["sdk"]
+
+    def __contains__(self, uid: str) -> bool:
+        with self._lock:
+            return uid in self._items
+
+    def issued_at(self, uid: str) -> Optional[float]:
+        with self._lock:
+            e = self._items.get(uid)
+            return e["issued_at"] if e else None
+
+    def put(self, uid: str, sdk: MOFSLOPENAPI, issued_at: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._items[uid] = {"sdk": sdk, "issued_at": issued_at, "used_at": now}
+            self._items.move_to_end(uid)
+            self._evict(now)
+
+    def discard(self, uid: str, sdk: Optional[MOFSLOPENAPI] = None) -> bool:
+        """Drop uid's session (only if it is still `sdk`, when given)."""
+        with self._lock:
+            e = self._items.get(uid)
+            if e is None or (sdk is not None and e["sdk"] is not sdk):
+                return False
+            del self._items[uid]
+            return True
+
+    def flight(self, uid: str) -> threading.RLock:
+        with self._lock:
+            lk = self._flights.get(uid)
+            if lk is None:
+                lk = self._flights[uid] = threading.RLock()
+            return lk
+
+    def note_dedup(self) -> None:
+        with self._lock:
+            self.counters["deduplicated"] += 1
+
+    def record_login(self, ok: bool, ms: float) -> None:
+        with self._lock:
+            self.counters["logins" if ok else "login_failures"] += 1
+            self.counters["login_ms_total"] += ms
+
+    def sweep(self) -> None:
+        with self._lock:
+            self._evict(time.time())
+
+    def _evict(self, now: float) -> None:
+        # caller holds the lock; oldest-used first
+        if self.idle_s > 0:
+            for uid in [u for u, e in self._items.items() if now - e["used_at"] > self.idle_s]:
+                del self._items[uid]
+                self.counters["evicted_idle"] += 1
+        while len(self._items) > self.max_size > 0:
+            self._items.popitem(last=False)
+            self.counters["evicted_lru"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            c = dict(self.counters)
+            size = len(self._items)
+        attempts = c["logins"] + c["login_failures"]
+        lookups = c["hits"] + c["misses"]
+        c["mean_login_ms"] = round(c.pop("login_ms_total") / attempts, 1) if attempts else 0.0
+        c["hit_rate"] = round(c["hits"] / lookups, 4) if lookups else 0.0
+        c.update({"size": size, "max_size": self.max_size, "idle_s": self.idle_s})
+        return c
+
+
+SESSION_MAX    = int(os.getenv("MO_SESSION_MAX", "1000"))
+SESSION_IDLE_S = float(os.getenv("MO_SESSION_IDLE_H", "24")) * 3600
+_sessions = _SessionManager(SESSION_MAX, SESSION_IDLE_S)
+
+# AuthTokens survive restarts in an encrypted store; a token is reused only
+# while it is younger than MO_SESSION_TTL_H and GetProfile still accepts it.
+SESSION_TTL_S = float(os.getenv("MO_SESSION_TTL_H", "12")) * 3600
+_store = SessionStore("motilal")
 
 DATA_DIR    = os.path.abspath(os.environ.get("DATA_DIR", "./data"))
 CLIENTS_DIR = os.path.join(DATA_DIR, "clients", "motilal")
@@ -31,6 +279,11 @@ _MO_DIR     = CLIENTS_DIR
 # Path to symbols.db built by MultiBroker_Router.refresh_symbols()
 SQLITE_DB = os.path.join(DATA_DIR, "symbols.db")
 
+# MOFSLOPENAPI is blocking (requests.post per call). The async adapter runs SDK
+# calls on this dedicated pool instead of the web server's default threadpool.
+ASYNC_WORKERS = int(os.getenv("MO_ASYNC_WORKERS", "32"))
+_sdk_pool = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix="mo-sdk")
+
 
 def _read_clients() -> List[Dict[str, Any]]:
     items: List[Dict[str, Any]] = []
@@ -59,6 +312,20 @@ def login(client: Dict[str, Any]) -> bool:
         return False
     if userid in _sessions:
         return True
+    with _sessions.flight(userid):
+        if userid in _sessions:
+            # another thread logged this client in while we waited
+            _sessions.note_dedup()
+            return True
+        t0 = time.perf_counter()
+        with span("mo.login"):
+            ok = _login_locked(userid, client)
+        took = time.perf_counter() - t0
+        _sessions.record_login(ok, took * 1000)
+        Metrics.LOGIN_SECONDS.observe(took, "motilal", "ok" if ok else "failed")
+        return ok
+
+def _login_locked(userid: str, client: Dict[str, Any]) -> bool:
     apikey   = _pick(client.get("apikey"), (client.get("creds") or {}).get("apikey"))
     password = _pick(client.get("password"), (client.get("creds") or {}).get("password"))
     pan      = _pick(client.get("pan"), (client.get("creds") or {}).get("pan"), (client.get("creds") or {}).get("PAN"))
@@ -67,18 +334,114 @@ def login(client: Dict[str, Any]) -> bool:
     if not (userid and apikey and password and pan):
         logging.error("[MO] login(): missing credentials for %s", userid)
         return False
+    if _rehydrate(userid, apikey):
+        return True
     try:
         otp = pyotp.TOTP(totpkey).now() if (pyotp and totpkey) else ""
         sdk = MOFSLOPENAPI(apikey, BASE_URL, None, SOURCE_ID, BROWSER_NAME, BROWSER_VERSION)
-        resp = sdk.login(userid, password, pan, otp, userid)
+        resp = _guarded(userid, sdk.login, userid, password, pan, otp, userid)
         if resp and resp.get("status") == "SUCCESS":
-            _sessions[userid] = sdk
+            _sessions.put(userid, sdk, time.time())
+            _store.put(userid, sdk.m_strMOFSLToken, SESSION_TTL_S, key=_key_id(apikey))
             return True
         logging.error("[MO] login failed for %s: %s", userid, (resp or {}).get("message"))
+    except CircuitOpen as e:
+        logging.error("[MO] login skipped for %s: %s", userid, e)
     except Exception as e:
         logging.exception("[MO] login error for %s: %s", userid, e)
     return False
 
+def _key_id(apikey: str) -> str:
+    # a saved token only belongs to the api key it was issued for
+    return hashlib.sha256(apikey.encode("utf-8")).hexdigest()[:16]
+
+def _rehydrate(userid: str, apikey: str) -> bool:
+    """Rebuild an SDK from a persisted AuthToken; True if GetProfile accepts it."""
+    rec = _store.get(userid)
+    if not rec or rec.get("key") != _key_id(apikey):
+        return False
+    try:
+        sdk = MOFSLOPENAPI(apikey, BASE_URL, None, SOURCE_ID, BROWSER_NAME, BROWSER_VERSION)
+        # what sdk.login() would have set
+        sdk.m_strMOFSLToken = rec["token"]
+        sdk.m_clientcode = userid
+        sdk.m_vendorinfo = userid
+        resp = sdk.GetProfile(userid)
+        if isinstance(resp, dict) and resp.get("status") == "SUCCESS":
+            _sessions.put(userid, sdk, rec.get("saved_at") or time.time())
+            audit("mo.session.rehydrated", uid=userid, age_s=round(time.time() - rec.get("saved_at", 0)))
+            return True
+        audit("mo.session.stale", uid=userid, message=(resp or {}).get("message") if isinstance(resp, dict) else None)
+    except Exception as e:
+        audit("mo.session.stale", uid=userid, message=str(e))
+    _store.drop(userid)
+    return False
+
+def session_store_stats() -> Dict[str, Any]:
+    return _store.stats()
+
+_AUTH_HINTS = ("invalid session", "session expired", "session is expired", "authorization",
+               "invalid token", "token expired", "token is expired", "unauthori", "login again")
+
+def _is_auth_error(resp: Any) -> bool:
+    """Does a failed SDK response mean the AuthToken is no longer accepted?"""
+    if not isinstance(resp, dict) or resp.get("status") == "SUCCESS":
+        return False
+    msg = str(resp.get("message") or "").lower()
+    return any(h in msg for h in _AUTH_HINTS)
+
+def refresh_session(c: Dict[str, Any], stale: Optional[MOFSLOPENAPI] = None) -> Optional[MOFSLOPENAPI]:
+    """
+    Replace a client's session with a fresh login. When `stale` is given and
+    another thread already swapped it out, the newer session is returned
+    instead of logging in again.
+    """
+    uid = (c.get('userid') or c.get('client_id') or '').strip()
+    if not uid:
+        return None
+    with _sessions.flight(uid):
+        cur = _sessions.get(uid)
+        if stale is not None and cur is not None and cur is not stale:
+            _sessions.note_dedup()
+            return cur
+        _sessions.discard(uid)
+        _store.drop(uid)
+        return _sessions.get(uid) if login(c) else None
+
+def check_session(c: Dict[str, Any], relogin_before_s: float = 0) -> Dict[str, Any]:
+    """
+    Keep-alive probe: GetProfile on the live session; log in when there is
+    none, re-login when the token is within relogin_before_s of its TTL or
+    the probe is rejected.
+    """
+    uid = (c.get('userid') or c.get('client_id') or '').strip()
+    sdk = _sessions.get(uid)
+    if sdk is None:
+        ok = login(c)
+        return {"ok": ok, "action": "login", "expires_at": _expires_at(uid)}
+    exp = _expires_at(uid)
+    if exp is not None and exp - time.time() <= relogin_before_s:
+        sdk = refresh_session(c, stale=sdk)
+        return {"ok": sdk is not None, "action": "relogin_expiry", "expires_at": _expires_at(uid)}
+    try:
+        resp = sdk.GetProfile(uid)
+    except Exception as e:
+        resp = {"status": "ERROR", "message": str(e)}
+    if isinstance(resp, dict) and resp.get("status") == "SUCCESS":
+        return {"ok": True, "action": "ok", "expires_at": exp}
+    msg = resp.get("message") if isinstance(resp, dict) else None
+    sdk = refresh_session(c, stale=sdk)
+    return {"ok": sdk is not None, "action": "relogin_failed_check", "message": msg,
+            "expires_at": _expires_at(uid)}
+
+def _expires_at(uid: str) -> Optional[float]:
+    t = _sessions.issued_at(uid)
+    return t + SESSION_TTL_S if t else None
+
+def session_stats() -> Dict[str, Any]:
+    _sessions.sweep()
+    return _sessions.stats()
+
 def _ensure_session(c: Dict[str, Any]) -> MOFSLOPENAPI | None:
     uid = (c.get('userid') or c.get('client_id') or '').strip()
     if not uid:
@@ -89,65 +452,235 @@ def _ensure_session(c: Dict[str, Any]) -> MOFSLOPENAPI | None:
     if login(c):
         return _sessions.get(uid)
     return None
-def get_orders() -> Dict[str, List[Dict[str, Any]]]:
-    """
-    Fetch Motilal orders for all logged-in clients and bucketize:
-    { pending:[], traded:[], rejected:[], cancelled:[], others:[] }
-    """
-    orders_data: Dict[str, List[Dict[str, Any]]] = {
-        "pending":   [],
-        "traded":    [],
-        "rejected":  [],
-        "cancelled": [],
-        "others":    []
+def _order_row(name: str, uid: str, order: Dict[str, Any]) -> Order:
+    status = order.get("orderstatus", "")
+    return Order(name, order.get("symbol", ""), order.get("buyorsell", ""), order.get("orderqty", ""),
+                 order.get("price", ""), status, order.get("uniqueorderid", ""), "motilal", uid, _bucket_of(status))
+
+def _bucket_of(status: Any) -> str:
+    s = (status or "").lower()
+    if "confirm" in s:
+        return "pending"
+    if "traded" in s:
+        return "traded"
+    if "rejected" in s or "error" in s:
+        return "rejected"
+    if "cancel" in s:
+        return "cancelled"
+    return "others"
+
+def _orders_for_client(c: Dict[str, Any]) -> List[Order]:
+    """Order-book rows for one client ([] when no session or on error)."""
+    name   = c.get("name") or c.get("display_name") or c.get("userid") or c.get("client_id") or ""
+    userid = str(c.get("userid") or c.get("client_id") or "").strip()
+    sdk    = _ensure_session(c)
+    if not sdk or not userid:
+        logging.error("[MO] get_orders: no session/userid for %s", name)
+        return []
+
+    try:
+        today_date = datetime.now().strftime("%d-%b-%Y 09:00:00")
+        resp = _read(userid, "GetOrderBook", sdk.GetOrderBook, {"clientcode": userid, "datetimestamp": today_date})
+
+        if resp and resp.get("status") != "SUCCESS":
+            logging.error("❌ Error fetching orders for %s: %s",
+                          name, resp.get("message", "No message"))
+
+        orders = resp.get("data", []) if isinstance(resp, dict) else []
+        if not isinstance(orders, list):
+            orders = []
+        return [_order_row(name, userid, order) for order in orders]
+
+    except Exception as e:
+        print(f"❌ Error fetching orders for {name}: {e}")
+        return []
+
+def raw_order_book(client_id: str) -> Optional[List[Dict[str, Any]]]:
+    """Unnormalized GetOrderBook rows for one client (None when no session)."""
+    c = _clients_by_id().get(str(client_id).strip())
+    sdk = _ensure_session(c) if c else None
+    if not sdk:
+        return None
+    today_date = datetime.now().strftime("%d-%b-%Y 09:00:00")
+    resp = sdk.GetOrderBook({"clientcode": str(client_id).strip(), "datetimestamp": today_date})
+    if not isinstance(resp, dict) or resp.get("status") != "SUCCESS":
+        return None
+    data = resp.get("data") or []
+    return data if isinstance(data, list) else []
+
+def _first(d: Dict[str, Any], *keys: str, default: Any = "") -> Any:
+    for k in keys:
+        v = d.get(k)
+        if v not in (None, ""):
+            return v
+    return default
+
+def fill_snapshot(o: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Fill state of one raw GetOrderBook row in router vocabulary (None if unusable)."""
+    oid = str(o.get("uniqueorderid") or "").strip()
+    if not oid:
+        return None
+    try:
+        filled = int(float(_first(o, "qtytradedtoday", "tradedquantity", "filledqty", default=0)))
+    except Exception:
+        filled = 0
+    status = str(o.get("orderstatus") or "")
+    return {
+        "order_id": oid,
+        "status": status.upper(),
+        "filled_qty": filled,
+        "security_id": str(o.get("symboltoken") or ""),
+        "symbol": o.get("symbol") or "",
+        "exchange": str(o.get("exchange") or "").upper(),
+        "action": str(o.get("buyorsell") or "").upper(),
+        "producttype": str(o.get("producttype") or "").upper(),
+        "price": _first(o, "averageprice", "tradedprice", "price", default=0),
+        "tag": o.get("tag") or "",
+        "fill_time": _first(o, "lastmodifiedtime", "recordinserttime"),
+        "open": _bucket_of(status) == "pending" or "partial" in status.lower(),
     }
 
-    for c in _read_clients():
-        name   = c.get("name") or c.get("display_name") or c.get("userid") or c.get("client_id") or ""
-        userid = str(c.get("userid") or c.get("client_id") or "").strip()
-        sdk    = _ensure_session(c)
-        if not sdk or not userid:
-            logging.error("[MO] get_orders: no session/userid for %s", name)
+def _trade_fills(client_id: str, message: Any) -> List[Dict[str, Any]]:
+    """Parse a trade-status websocket message into fill events."""
+    try:
+        msg = json.loads(message) if isinstance(message, (str, bytes)) else message
+    except Exception:
+        return []
+    rows = msg.get("data") if isinstance(msg, dict) and "data" in msg else msg
+    if isinstance(rows, dict):
+        rows = [rows]
+    if not isinstance(rows, list):
+        return []
+    fills: List[Dict[str, Any]] = []
+    for t in rows:
+        if not isinstance(t, dict):
             continue
-
+        oid = str(t.get("uniqueorderid") or "").strip()
         try:
-            today_date = datetime.now().strftime("%d-%b-%Y 09:00:00")
-            resp = sdk.GetOrderBook({"clientcode": userid, "datetimestamp": today_date})
-
-            if resp and resp.get("status") != "SUCCESS":
-                logging.error("❌ Error fetching orders for %s: %s",
-                              name, resp.get("message", "No message"))
-
-            orders = resp.get("data", []) if isinstance(resp, dict) else []
-            if not isinstance(orders, list):
-                orders = []
-
-            for order in orders:
-                row = {
-                    "name": name,
-                    "symbol": order.get("symbol", ""),
-                    "transaction_type": order.get("buyorsell", ""),
-                    "quantity": order.get("orderqty", ""),
-                    "price": order.get("price", ""),
-                    "status": order.get("orderstatus", ""),
-                    "order_id": order.get("uniqueorderid", "")
-                }
-                s = (row["status"] or "").lower()
-                if "confirm" in s:
-                    orders_data["pending"].append(row)
-                elif "traded" in s:
-                    orders_data["traded"].append(row)
-                elif "rejected" in s or "error" in s:
-                    orders_data["rejected"].append(row)
-                elif "cancel" in s:
-                    orders_data["cancelled"].append(row)
-                else:
-                    orders_data["others"].append(row)
+            qty = int(float(_first(t, "tradeqty", "tradedquantity", "quantity", "qty", default=0)))
+        except Exception:
+            qty = 0
+        if not oid or qty <= 0:
+            continue  # order-status or heartbeat packets
+        clientid = str(t.get("clientid") or t.get("clientcode") or client_id)
+        if clientid != str(client_id):
+            continue
+        fills.append({
+            "fill_id": f"{oid}:{_first(t, 'tradeid', 'tradeno', 'exchtradeid', default=qty)}",
+            "order_id": oid,
+            "qty": qty,
+            "security_id": str(t.get("symboltoken") or ""),
+            "symbol": t.get("symbol") or "",
+            "exchange": str(t.get("exchange") or "").upper(),
+            "action": str(t.get("buyorsell") or "").upper(),
+            "producttype": str(t.get("producttype") or "").upper(),
+            "price": _first(t, "tradeprice", "tradedprice", "price", default=0),
+            "tag": t.get("tag") or "",
+            "fill_time": _first(t, "tradetime", "lastmodifiedtime"),
+        })
+    return fills
+
+class TradeStream:
+    """
+    One client's trade-status websocket. The SDK instance is shared per
+    client and its hooks are replaced by the next watch_trades(), so every
+    hook checks that the socket is still this stream's.
+    """
 
+    def __init__(self, uid: str, sdk, on_fill, on_lost):
+        self.uid = uid
+        self.sdk = sdk
+        self.on_fill = on_fill
+        self.on_lost = on_lost
+        self.ws = None
+        self.acked = threading.Event()
+        self.closed = False
+
+    def _on_open(self, ws2):
+        if self.closed or self.ws is not None:
+            # a reconnect the SDK started on its own; this stream is done with
+            _close_ws(ws2)
+            return
+        self.ws = ws2
+        try:
+            self.sdk.Tradelogin()
+            self.sdk.TradeSubscribe()
         except Exception as e:
-            print(f"❌ Error fetching orders for {name}: {e}")
+            logging.error("[MO] trade-status subscribe failed for %s: %s", self.uid, e)
+            self.close()
+
+    def _on_message(self, ws2, message_type, message):
+        if self.closed or ws2 is not self.ws:
+            return
+        # the first answer after subscribing (ack or heartbeat) says the stream is live
+        self.acked.set()
+        for fill in _trade_fills(self.uid, message):
+            try:
+                self.on_fill(fill)
+            except Exception as e:
+                logging.error("[MO] trade-status handler failed for %s: %s", self.uid, e)
+
+    def _on_close(self, ws2, code, msg):
+        if self.closed or (self.ws is not None and ws2 is not self.ws):
+            return
+        self.closed = True
+        audit("mo.trade_stream.closed", uid=self.uid, code=code, message=msg)
+        if self.acked.is_set() and self.on_lost is not None:
+            try:
+                self.on_lost()
+            except Exception as e:
+                logging.error("[MO] trade-status close handler failed for %s: %s", self.uid, e)
+
+    def close(self) -> None:
+        self.closed = True
+        _close_ws(self.ws)
+
+def _close_ws(ws) -> None:
+    try:
+        if ws is not None:
+            ws.close()
+    except Exception:
+        pass
 
-    return orders_data
+def watch_trades(client_id: str, on_fill, on_lost=None) -> Optional[TradeStream]:
+    """
+    Stream fills for one client over the SDK's trade-status websocket.
+    on_fill(fill) is called on the websocket thread; on_lost() once, if the
+    socket closes after it was live. Returns the stream once the socket has
+    opened and answered the subscription within MO_TRADE_WS_ACK_S, else None
+    (no session, connect or subscribe failure); callers then poll
+    raw_order_book instead. Call close() on the stream to stop it.
+    """
+    uid = str(client_id).strip()
+    c = _clients_by_id().get(uid)
+    sdk = _ensure_session(c) if c else None
+    if not sdk:
+        return None
+
+    stream = TradeStream(uid, sdk, on_fill, on_lost)
+    # the SDK dispatches through these instance hooks
+    sdk._TradeStatus_on_open = stream._on_open
+    sdk._TradeStatus_on_message = stream._on_message
+    sdk._TradeStatus_on_close = stream._on_close
+    sdk.TradeStatusHeartbeat_flag = True
+    try:
+        # only starts the socket thread; failures show up as no answer below
+        sdk.TradeStatus_connect()
+    except Exception as e:
+        logging.error("[MO] trade-status connect failed for %s: %s", uid, e)
+        return None
+    if not stream.acked.wait(TRADE_WS_ACK_S) or stream.closed:
+        logging.error("[MO] trade-status for %s did not answer within %.0fs", uid, TRADE_WS_ACK_S)
+        stream.close()
+        return None
+    return stream
+
+def get_orders() -> Dict[str, List[Order]]:
+    """
+    Fetch Motilal orders for all logged-in clients and bucketize:
+    { pending:[], traded:[], rejected:[], cancelled:[], others:[] }
+    """
+    return Book_models.bucket_orders([_orders_for_client(c) for c in _read_clients()])
 
 def cancel_orders(orders: List[Dict[str, Any]]) -> List[str]:
     """
@@ -190,7 +723,7 @@ def cancel_orders(orders: List[Dict[str, Any]]) -> List[str]:
             return
 
         try:
-            resp = sdk.CancelOrder(order_id, userid)
+            resp = _guarded(userid, sdk.CancelOrder, order_id, userid)
             msg  = (resp.get("message", "") or "").lower() if isinstance(resp, dict) else ""
             with lock:
                 if "cancel order request sent" in msg:
@@ -213,73 +746,64 @@ def cancel_orders(orders: List[Dict[str, Any]]) -> List[str]:
 
 
 
-def get_positions() -> Dict[str, List[Dict[str, Any]]]:
+def _positions_for_client(c: Dict[str, Any]) -> List[Position]:
+    """Position rows for one client ([] when no session or on error)."""
+    name = c.get("name") or c.get("display_name") or c.get("userid") or c.get("client_id") or ""
+    uid  = str(c.get("userid") or c.get("client_id") or "").strip()
+    sdk  = _ensure_session(c)
+    if not sdk or not uid:
+        logging.error("[MO] get_positions: no session/userid for %s", name)
+        return []
+
+    # --- API call aligned with get_orders() ---
+    try:
+        resp = _read(uid, "GetPosition", sdk.GetPosition, {"clientcode": uid})
+        if resp and resp.get("status") != "SUCCESS":
+            logging.error("❌ Error fetching positions for %s: %s", name, resp.get("message", "No message"))
+        rows = resp.get("data", []) if isinstance(resp, dict) else []
+        if not isinstance(rows, list):
+            rows = []
+    except Exception as e:
+        logging.error("[MO] get_positions error for %s: %s", name, e)
+        rows = []
+    # -----------------------------------------
+
+    # --- same parsing / math you already use ---
+    out: List[Position] = []
+    for pos in rows:
+        buy_qty  = (pos.get("buyquantity", 0)  or 0)
+        sell_qty = (pos.get("sellquantity", 0) or 0)
+        qty      = buy_qty - sell_qty
+        booked   = (pos.get("bookedprofitloss", 0) or 0)
+        buy_amt  = (pos.get("buyamount", 0) or 0)
+        sell_amt = (pos.get("sellamount", 0) or 0)
+        ltp      = (pos.get("LTP", 0) or 0)
+
+        buy_avg  = (buy_amt / buy_qty)  if buy_qty  > 0 else 0
+        sell_avg = (sell_amt / sell_qty) if sell_qty > 0 else 0
+        # MTM + booked P&L (unchanged)
+        net_pnl  = ((ltp - buy_avg) * qty if qty > 0 else (sell_avg - ltp) * abs(qty)) + booked
+
+        out.append(Position(name, pos.get("symbol", "") or "", qty, round(buy_avg, 2), round(sell_avg, 2),
+                            round(net_pnl, 2), "motilal", uid))
+    # -------------------------------------------
+    return out
+
+def get_positions() -> Dict[str, List[Position]]:
     """
     Fetch Motilal positions for all logged-in clients and bucketize:
     { open:[], closed:[] }
     API call pattern mirrors get_orders(): pass {"clientcode": userid}.
     """
-    data: Dict[str, List[Dict[str, Any]]] = {"open": [], "closed": []}
-
-    for c in _read_clients():
-        name = c.get("name") or c.get("display_name") or c.get("userid") or c.get("client_id") or ""
-        uid  = str(c.get("userid") or c.get("client_id") or "").strip()
-        sdk  = _ensure_session(c)
-        if not sdk or not uid:
-            logging.error("[MO] get_positions: no session/userid for %s", name)
-            continue
-
-        # --- API call aligned with get_orders() ---
-        try:
-            resp = sdk.GetPosition({"clientcode": uid})
-            if resp and resp.get("status") != "SUCCESS":
-                logging.error("❌ Error fetching positions for %s: %s", name, resp.get("message", "No message"))
-            rows = resp.get("data", []) if isinstance(resp, dict) else []
-            if not isinstance(rows, list):
-                rows = []
-        except Exception as e:
-            logging.error("[MO] get_positions error for %s: %s", name, e)
-            rows = []
-        # -----------------------------------------
-
-        # --- same parsing / math you already use ---
-        for pos in rows:
-            buy_qty  = (pos.get("buyquantity", 0)  or 0)
-            sell_qty = (pos.get("sellquantity", 0) or 0)
-            qty      = buy_qty - sell_qty
-            booked   = (pos.get("bookedprofitloss", 0) or 0)
-            buy_amt  = (pos.get("buyamount", 0) or 0)
-            sell_amt = (pos.get("sellamount", 0) or 0)
-            ltp      = (pos.get("LTP", 0) or 0)
-
-            buy_avg  = (buy_amt / buy_qty)  if buy_qty  > 0 else 0
-            sell_avg = (sell_amt / sell_qty) if sell_qty > 0 else 0
-            # MTM + booked P&L (unchanged)
-            net_pnl  = ((ltp - buy_avg) * qty if qty > 0 else (sell_avg - ltp) * abs(qty)) + booked
-
-            row = {
-                "name": name,
-                "symbol": pos.get("symbol", "") or "",
-                "quantity": qty,
-                "buy_avg": round(buy_avg, 2),
-                "sell_avg": round(sell_avg, 2),
-                "net_profit": round(net_pnl, 2),
-            }
-            if qty == 0:
-                data["closed"].append(row)
-            else:
-                data["open"].append(row)
-        # -------------------------------------------
-
-    return data
+    return Book_models.bucket_positions([_positions_for_client(c) for c in _read_clients()])
 
 def close_positions(positions: List[Dict[str, Any]]) -> List[str]:
     """
     Close (square-off) positions for given [{name, symbol}] by placing
-    opposite MARKET orders via MOFSLOPENAPI. Also prints the exact payload
-    and raw response so you can see them in Railway Logs.
+    opposite MARKET orders via MOFSLOPENAPI. The payload (debug) and the
+    broker's response go to the audit log.
     """
-    import json, os, sqlite3, sys, logging
+    import os, sqlite3, sys, logging
 
     # --- map client display name -> client json (reuse the login/session flow)
     by_name: Dict[str, Dict[str, Any]] = {}
@@ -323,7 +847,7 @@ def close_positions(positions: List[Dict[str, Any]]) -> List[str]:
 
         # --- fetch fresh positions so we get exchange, product, symboltoken, and net qty
         try:
-            resp = sdk.GetPosition()
+            resp = _guarded(uid, sdk.GetPosition)
             rows = resp.get("data", []) if (resp and resp.get("status") == "SUCCESS") else []
         except Exception as e:
             out.append(f"❌ GetPosition failed for {name}: {e}")
@@ -371,26 +895,15 @@ def close_positions(positions: List[Dict[str, Any]]) -> List[str]:
             "tag": "SQUAREOFF",
         }
 
-        # --- print the payload (and flush so it appears in logs immediately)
-        try:
-            print(f"[MO][CLOSE] payload for {name} - {symbol} =>", flush=True)
-            print(json.dumps(order, indent=2), flush=True)
-        except Exception:
-            # never let logging break the flow
-            pass
+        audit("mo.close", level="debug", name=name, uid=uid, symbol=symbol, payload=order)
 
         # --- call the API
         try:
-            r = sdk.PlaceOrder(order)
+            r = _guarded(uid, sdk.PlaceOrder, order)
         except Exception as e:
             r = {"status": "ERROR", "message": str(e)}
 
-        # --- print the raw response too
-        try:
-            print(f"[MO][CLOSE] response for {name} - {symbol} =>", flush=True)
-            print(json.dumps(r, indent=2), flush=True)
-        except Exception:
-            pass
+        audit("mo.close.response", name=name, uid=uid, symbol=symbol, response=r)
 
         # --- normalize message for UI
         msg = r.get("message") if isinstance(r, dict) else None
@@ -409,7 +922,7 @@ def _get_available_margin(sdk, clientcode: str) -> float:
     Returns 0.0 on any error.
     """
     try:
-        resp = sdk.GetReportMarginSummary(clientcode)
+        resp = _guarded(clientcode, sdk.GetReportMarginSummary, clientcode)
         if not (isinstance(resp, dict) and resp.get("status") == "SUCCESS"):
             return 0.0
         rows = resp.get("data", []) or []
@@ -425,201 +938,216 @@ def _get_available_margin(sdk, clientcode: str) -> float:
 
 
 
-def get_holdings() -> Dict[str, Any]:
-    """
-    Motilal holdings using GetDPHolding + per-scrip GetLtp.
-    Returns: {"holdings": [...], "summary": [...]}
+def _holdings_for_client(c: Dict[str, Any]) -> Optional[Tuple[List[Holding], Funds]]:
+    """(holding rows, summary row) for one client, or None when it has no session."""
+    holdings_rows: List[Holding] = []
+    userid = str(c.get("userid") or c.get("client_id") or "").strip()
+    name   = c.get("name") or c.get("display_name") or userid
+    if not userid:
+        return None
 
-    holdings rows:
-      {name, symbol, quantity, buy_avg, ltp, pnl}
+    # capital from client file (fallback 0.0)
+    try:
+        capital = float(c.get("capital", 0) or c.get("base_amount", 0) or 0.0)
+    except Exception:
+        capital = 0.0
 
-    summary rows:
-      {name, capital, invested, pnl, current_value, available_margin, net_gain}
-    """
-    holdings_rows: List[Dict[str, Any]] = []
-    summaries: List[Dict[str, Any]] = []
+    sdk = _ensure_session(c)
+    if not sdk:
+        logging.error("[MO] No session for %s (%s)", name, userid)
+        return None
 
-    for c in _read_clients():
-        userid = str(c.get("userid") or c.get("client_id") or "").strip()
-        name   = c.get("name") or c.get("display_name") or userid
-        if not userid:
-            continue
+    # --- 1) HOLDINGS (DP holdings)
+    rows: List[Dict[str, Any]] = []
+    try:
+        # Your working shape prefers plain userid; try that first.
+        resp = _guarded(userid, sdk.GetDPHolding, userid)
+        if not (isinstance(resp, dict) and resp.get("status") == "SUCCESS"):
+            # fallbacks
+            for arg in ({"clientcode": userid}, None):
+                fn = getattr(sdk, "GetDPHolding", None)
+                if callable(fn):
+                    try:
+                        resp = fn(arg) if arg is not None else fn()
+                        if isinstance(resp, dict) and resp.get("status") == "SUCCESS":
+                            break
+                    except Exception:
+                        pass
+        if isinstance(resp, dict) and resp.get("status") == "SUCCESS":
+            rows = resp.get("data", []) or []
+            if not isinstance(rows, list):
+                rows = []
+    except Exception as e:
+        logging.error("[MO] GetDPHolding error for %s: %s", name, e)
+        rows = []
+
+    invested = 0.0
+    total_pnl = 0.0
 
-        # capital from client file (fallback 0.0)
+    for h in rows:
+        symbol   = (h.get("scripname") or h.get("symbol") or "").strip()
         try:
-            capital = float(c.get("capital", 0) or c.get("base_amount", 0) or 0.0)
+            qty    = float(h.get("dpquantity", h.get("quantity", 0)) or 0)
+            buyavg = float(h.get("buyavgprice", h.get("avgprice", 0)) or 0)
         except Exception:
-            capital = 0.0
+            qty, buyavg = 0.0, 0.0
 
-        sdk = _ensure_session(c)
-        if not sdk:
-            logging.error("[MO] No session for %s (%s)", name, userid)
+        # token for NSE; your working code uses nsesymboltoken
+        scripcode = h.get("nsesymboltoken") or h.get("symboltoken") or h.get("token")
+        if not scripcode or qty <= 0:
             continue
 
-        # --- 1) HOLDINGS (DP holdings)
-        rows: List[Dict[str, Any]] = []
+        # --- 1.a) LTP per scrip (paise -> divide by 100)
+        ltp = 0.0
         try:
-            # Your working shape prefers plain userid; try that first.
-            resp = sdk.GetDPHolding(userid)
-            if not (isinstance(resp, dict) and resp.get("status") == "SUCCESS"):
-                # fallbacks
-                for arg in ({"clientcode": userid}, None):
-                    fn = getattr(sdk, "GetDPHolding", None)
-                    if callable(fn):
-                        try:
-                            resp = fn(arg) if arg is not None else fn()
-                            if isinstance(resp, dict) and resp.get("status") == "SUCCESS":
-                                break
-                        except Exception:
-                            pass
-            if isinstance(resp, dict) and resp.get("status") == "SUCCESS":
-                rows = resp.get("data", []) or []
-                if not isinstance(rows, list):
-                    rows = []
-        except Exception as e:
-            logging.error("[MO] GetDPHolding error for %s: %s", name, e)
-            rows = []
-
-        invested = 0.0
-        total_pnl = 0.0
-
-        for h in rows:
-            symbol   = (h.get("scripname") or h.get("symbol") or "").strip()
-            try:
-                qty    = float(h.get("dpquantity", h.get("quantity", 0)) or 0)
-                buyavg = float(h.get("buyavgprice", h.get("avgprice", 0)) or 0)
-            except Exception:
-                qty, buyavg = 0.0, 0.0
-
-            # token for NSE; your working code uses nsesymboltoken
-            scripcode = h.get("nsesymboltoken") or h.get("symboltoken") or h.get("token")
-            if not scripcode or qty <= 0:
-                continue
-
-            # --- 1.a) LTP per scrip (paise -> divide by 100)
+            ltp_req = {"clientcode": userid, "exchange": "NSE", "scripcode": int(scripcode)}
+            ltp_resp = _guarded(userid, sdk.GetLtp, ltp_req)
+            if isinstance(ltp_resp, dict) and ltp_resp.get("status") == "SUCCESS":
+                ltp_val = (ltp_resp.get("data") or {}).get("ltp", 0)
+                ltp = float(ltp_val or 0) / 100.0
+        except Exception:
             ltp = 0.0
-            try:
-                ltp_req = {"clientcode": userid, "exchange": "NSE", "scripcode": int(scripcode)}
-                ltp_resp = sdk.GetLtp(ltp_req)
-                if isinstance(ltp_resp, dict) and ltp_resp.get("status") == "SUCCESS":
-                    ltp_val = (ltp_resp.get("data") or {}).get("ltp", 0)
-                    ltp = float(ltp_val or 0) / 100.0
-            except Exception:
-                ltp = 0.0
 
-            pnl = round((ltp - buyavg) * qty, 2)
-            invested  += qty * buyavg
-            total_pnl += pnl
+        pnl = round((ltp - buyavg) * qty, 2)
+        invested  += qty * buyavg
+        total_pnl += pnl
 
-            holdings_rows.append({
-                "name": name,
-                "symbol": symbol,
-                "quantity": qty,
-                "buy_avg": round(buyavg, 2),
-                "ltp": round(ltp, 2),
-                "pnl": pnl
-            })
+        holdings_rows.append(Holding(name, symbol, qty, round(buyavg, 2), round(ltp, 2), pnl, "motilal", userid))
 
-        current_value = invested + total_pnl
+    current_value = invested + total_pnl
 
-        # --- 2) AVAILABLE MARGIN
-        available_margin = 0.0
-        try:
-            available_margin = _get_available_margin(sdk, userid)
-        except Exception as e:
-            logging.error("[MO] get available margin error for %s: %s", name, e)
-
-        net_gain = round((current_value + available_margin) - capital, 2)
-
-        summaries.append({
-            "name": name,
-            "capital": round(capital, 2),
-            "invested": round(invested, 2),
-            "pnl": round(total_pnl, 2),
-            "current_value": round(current_value, 2),
-            "available_margin": round(available_margin, 2),
-            "net_gain": net_gain
-        })
+    # --- 2) AVAILABLE MARGIN
+    available_margin = 0.0
+    try:
+        available_margin = _get_available_margin(sdk, userid)
+    except Exception as e:
+        logging.error("[MO] get available margin error for %s: %s", name, e)
 
-    return {"holdings": holdings_rows, "summary": summaries}
+    net_gain = round((current_value + available_margin) - capital, 2)
 
-def place_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
-    import json, threading
-    from typing import Dict, Any, List
+    return holdings_rows, Funds(name, round(capital, 2), round(invested, 2), round(total_pnl, 2),
+                                round(current_value, 2), round(available_margin, 2), net_gain, "motilal", userid)
 
-    if not isinstance(orders, list) or not orders:
-        return {"status": "empty", "order_responses": {}}
+def get_holdings() -> Dict[str, Any]:
+    """
+    Motilal holdings using GetDPHolding + per-scrip GetLtp.
+    Returns: {"holdings": [...], "summary": [...]}
 
+    holdings rows: Book_models.Holding
+    summary rows:  Book_models.Funds
+    """
+    return Book_models.merge_holdings([_holdings_for_client(c) for c in _read_clients()])
+
+def _clients_by_id() -> Dict[str, Dict[str, Any]]:
     by_id: Dict[str, Dict[str, Any]] = {}
     for c in _read_clients():
         uid = str(c.get("userid") or c.get("client_id") or "").strip()
         if uid:
             by_id[uid] = c
+    return by_id
+
+# Fields shared by every leg of one router request; compiled once per batch.
+_TEMPLATE_FIELDS = (
+    "exchange", "security_id", "action", "ordertype", "producttype",
+    "orderduration", "price", "triggerprice", "disclosedquantity", "amoorder",
+)
+
+def compile_order_template(od: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalize the common fields of a router order row into a PlaceOrder payload."""
+    return {
+        "clientcode": "",
+        "exchange": (od.get("exchange") or "NSE").upper(),
+        "symboltoken": int(od.get("security_id") or 0),
+        "buyorsell": od.get("action"),
+        "ordertype": od.get("ordertype"),
+        "producttype": od.get("producttype"),
+        "orderduration": od.get("orderduration"),
+        "price": float(od.get("price") or 0),
+        "triggerprice": float(od.get("triggerprice") or 0),
+        "quantityinlot": 0,
+        "disclosedquantity": int(od.get("disclosedquantity") or 0),
+        "amoorder": od.get("amoorder", "N"),
+        "algoid": "",
+        "goodtilldate": "",
+        "tag": "",
+    }
 
-    responses: Dict[str, Any] = {}
-    lock = threading.Lock()
-    threads: List[threading.Thread] = []
-
-    def _worker(od: Dict[str, Any]):
-        uid  = str(od.get("client_id") or "").strip()
-        name = od.get("name") or uid
-        cj   = by_id.get(uid)
-        key  = f"{od.get('tag') or ''}:{uid}"
-
-        if not cj:
-            with lock:
-                responses[key] = {"status": "ERROR", "message": "Client JSON not found"}
-                print(f"[MO] skip name={name} uid={uid} -> Client JSON not found")
-            return
+def _template_for(od: Dict[str, Any], templates: Dict[tuple, Dict[str, Any]],
+                  lock: threading.Lock) -> Dict[str, Any]:
+    key = tuple(od.get(f) for f in _TEMPLATE_FIELDS)
+    with lock:
+        tpl = templates.get(key)
+        if tpl is None:
+            tpl = templates[key] = compile_order_template(od)
+    return tpl
+
+def _place_one(od: Dict[str, Any], by_id: Dict[str, Dict[str, Any]],
+               lock: threading.Lock,
+               templates: Optional[Dict[tuple, Dict[str, Any]]] = None) -> Tuple[str, Any]:
+    """Place one router order row; returns (response key, broker response)."""
+    uid  = str(od.get("client_id") or "").strip()
+    name = od.get("name") or uid
+    cj   = by_id.get(uid)
+    key  = f"{od.get('tag') or ''}:{uid}"
+
+    if not cj:
+        audit("mo.place.skip", name=name, uid=uid, reason="Client JSON not found")
+        return key, {"status": "ERROR", "message": "Client JSON not found"}
+
+    sdk = _ensure_session(cj)
+    if not sdk:
+        audit("mo.place.skip", name=name, uid=uid, reason="Session not found")
+        return key, {"status": "ERROR", "message": "Session not found"}
+
+    if templates is None:
+        payload = compile_order_template(od)
+    else:
+        payload = dict(_template_for(od, templates, lock))
+    payload["clientcode"] = uid
+    payload["quantityinlot"] = int(od.get("qty") or 0)
+    payload["tag"] = od.get("tag") or ""
+
+    audit("mo.place", level="debug", name=name, uid=uid, payload=payload)
+
+    t0 = time.perf_counter()
+    try:
+        with span("mo.sdk.PlaceOrder"):
+            resp = _guarded(uid, sdk.PlaceOrder, payload)
+    except Exception as e:
+        resp = {"status": "ERROR", "message": str(e)}
+    _observe_call("PlaceOrder", uid, t0, resp)
+
+    if _is_auth_error(resp):
+        # token died since the last keep-alive check: one retry on a fresh login
+        audit("mo.place.auth_retry", name=name, uid=uid, message=resp.get("message"))
+        fresh = refresh_session(cj, stale=sdk)
+        if fresh is not None:
+            try:
+                resp = _guarded(uid, fresh.PlaceOrder, payload)
+            except Exception as e:
+                resp = {"status": "ERROR", "message": str(e)}
 
-        sdk = _ensure_session(cj)
-        if not sdk:
-            with lock:
-                responses[key] = {"status": "ERROR", "message": "Session not found"}
-                print(f"[MO] skip name={name} uid={uid} -> Session not found")
-            return
+    audit("mo.place.response", name=name, uid=uid, tag=payload["tag"], response=resp)
+    return key, resp
 
-        payload = {
-            "clientcode": uid,
-            "exchange": (od.get("exchange") or "NSE").upper(),
-            "symboltoken": int(od.get("security_id") or 0),
-            "buyorsell": od.get("action"),
-            "ordertype": od.get("ordertype"),
-            "producttype": od.get("producttype"),
-            "orderduration": od.get("orderduration"),
-            "price": float(od.get("price") or 0),
-            "triggerprice": float(od.get("triggerprice") or 0),
-            "quantityinlot": int(od.get("qty") or 0),
-            "disclosedquantity": int(od.get("disclosedquantity") or 0),
-            "amoorder": od.get("amoorder", "N"),
-            "algoid": "",
-            "goodtilldate": "",
-            "tag": od.get("tag") or "",
-        }
+def place_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
+    if not isinstance(orders, list) or not orders:
+        return {"status": "empty", "order_responses": {}}
 
-        with lock:
-            print(f"[MO] placing name={name} uid={uid}")
-            print("[MO] payload =>")
-            try:
-                print(json.dumps(payload, indent=2))
-            except Exception:
-                print(payload)
+    by_id = _clients_by_id()
+    templates: Dict[tuple, Dict[str, Any]] = {}
 
-        try:
-            resp = sdk.PlaceOrder(payload)
-        except Exception as e:
-            resp = {"status": "ERROR", "message": str(e)}
+    responses: Dict[str, Any] = {}
+    lock = threading.Lock()
+    threads: List[threading.Thread] = []
 
+    def _worker(od: Dict[str, Any]):
+        key, resp = _place_one(od, by_id, lock, templates)
         with lock:
-            print("[MO] response =>")
-            try:
-                print(json.dumps(resp, indent=2))
-            except Exception:
-                print(resp)
             responses[key] = resp
 
     for od in orders:
-        t = threading.Thread(target=_worker, args=(od,))
+        t = threading.Thread(target=Req_timing.bind(_worker, od))
         t.start()
         threads.append(t)
     for t in threads:
@@ -796,14 +1324,8 @@ def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
     # --------- process each order ---------
     for row in (orders or []):
         try:
-            # Debug IN row
-            try:
-                print("\n---- [MO][MODIFY] ROW (router) ----", flush=True)
-                print(json.dumps(row, indent=2, default=str), flush=True)
-            except Exception:
-                pass
-
             name = (row.get("name") or "").strip() or "<unknown>"
+            audit("mo.modify.row", level="debug", name=name, row=row)
             oid  = str(row.get("order_id") or row.get("orderId") or "").strip()
             if not oid:
                 messages.append(f"ℹ️ {name}: skipped (missing order_id)")
@@ -868,23 +1390,12 @@ def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
                 messages.append(f"❌ {name} ({oid}): SL-M requires Trigger > 0")
                 continue
 
-            # Debug OUT payload
-            try:
-                print("---- [MO][MODIFY] OUT (payload) ----", flush=True)
-                print(json.dumps(payload, indent=2, default=str), flush=True)
-                print(f"[MO][MODIFY] qty calc: shares={shares}, token={token}, min_qty={min_qty}, lots={lots}", flush=True)
-            except Exception:
-                pass
+            audit("mo.modify", level="debug", name=name, uid=uid, payload=payload,
+                  shares=shares, token=token, min_qty=min_qty, lots=lots)
 
             # Call API
-            resp = sdk.ModifyOrder(payload)
-
-            # Debug RESP
-            try:
-                print("---- [MO][MODIFY] RESP (raw) ----", flush=True)
-                print(json.dumps(resp if isinstance(resp, dict) else {"raw": resp}, indent=2, default=str), flush=True)
-            except Exception:
-                pass
+            resp = _guarded(uid, sdk.ModifyOrder, payload)
+            audit("mo.modify.response", name=name, uid=uid, order_id=oid, response=resp)
 
             # Normalize result
             ok, msg = False, ""
@@ -906,8 +1417,80 @@ def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
 
 
 
+# ---------------------------
+# async adapter
+# ---------------------------
+# Async wrappers around the blocking SDK: each per-client unit of work runs on
+# an executor (the router passes its lane executor; default _sdk_pool) and the
+# router awaits them together with asyncio.gather.
+def _observe_call(api: str, uid: str, t0: float, resp: Any) -> None:
+    client = Metrics.client_label(uid)
+    Metrics.BROKER_CALL_SECONDS.observe(time.perf_counter() - t0, "motilal", api, client)
+    if isinstance(resp, BaseException):
+        Metrics.BROKER_CALL_ERRORS.inc("motilal", api, client, "exception")
+    elif isinstance(resp, dict) and str(resp.get("status") or "").upper() != "SUCCESS":
+        Metrics.BROKER_CALL_ERRORS.inc("motilal", api, client, "auth" if _is_auth_error(resp) else "rejected")
 
-
-
-
-
+async def _run_sdk(executor, fn, *args, default: Any = None):
+    """
+    Run one per-client unit on the executor. Under a request deadline the
+    await is bounded by the time left; a unit that misses it is marked and
+    `default` is returned (its thread finishes in the background).
+    """
+    loop = asyncio.get_running_loop()
+    name = fn.__name__.strip("_")
+    c = args[0] if args and isinstance(args[0], dict) else {}
+    uid = c.get("userid") or c.get("client_id")
+    left = Req_deadline.remaining()
+    if left is not None and left <= 0:
+        Req_deadline.mark("motilal", uid, "skipped")
+        return default
+    t0, err = time.perf_counter(), None
+    with span("mo." + name):
+        try:
+            fut = loop.run_in_executor(executor or _sdk_pool, Req_timing.bind(fn, *args))
+            return await (asyncio.wait_for(fut, left) if left is not None else fut)
+        except asyncio.TimeoutError:
+            Req_deadline.mark("motilal", uid, "timed_out")
+            return default
+        except Exception as e:
+            err = e
+            raise
+        finally:
+            # _place_one records its own PlaceOrder call; the report units are timed here
+            if fn is not _place_one:
+                _observe_call(name, uid, t0, err)
+
+async def _book_clients(clients: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """The caller's cached client records, else the client files read off the loop."""
+    return clients if clients is not None else await asyncio.to_thread(_read_clients)
+
+async def get_orders_async(executor=None, clients: Optional[List[Dict[str, Any]]] = None) -> Dict[str, List[Order]]:
+    clients = await _book_clients(clients)
+    per_client = await asyncio.gather(*[_run_sdk(executor, _orders_for_client, c, default=[]) for c in clients])
+    return Book_models.bucket_orders(per_client)
+
+async def get_positions_async(executor=None, clients: Optional[List[Dict[str, Any]]] = None) -> Dict[str, List[Position]]:
+    clients = await _book_clients(clients)
+    per_client = await asyncio.gather(*[_run_sdk(executor, _positions_for_client, c, default=[]) for c in clients])
+    return Book_models.bucket_positions(per_client)
+
+async def get_holdings_async(executor=None, clients: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    clients = await _book_clients(clients)
+    per_client = await asyncio.gather(*[_run_sdk(executor, _holdings_for_client, c) for c in clients])
+    return Book_models.merge_holdings(per_client)
+
+async def place_orders_async(orders: List[Dict[str, Any]], executor=None,
+                             clients: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Async twin of place_orders(): same input/output, SDK calls run on the given executor.
+    `clients` (userid -> client json) skips reading the client files.
+    """
+    if not isinstance(orders, list) or not orders:
+        return {"status": "empty", "order_responses": {}}
+    by_id = clients if clients is not None else _clients_by_id()
+    templates: Dict[tuple, Dict[str, Any]] = {}
+    lock = threading.Lock()
+    results = await asyncio.gather(*[_run_sdk(executor, _place_one, od, by_id, lock, templates)
+                                     for od in orders])
+    return {"status": "completed", "order_responses": dict(results)}
@@ -0,0 +1,241 @@
+# Circuit_breaker.py
+"""
+Circuit breakers for broker calls, one per broker and one per client account.
+
+  closed     calls go through; consecutive failures are counted
+  open       calls fail fast with CircuitOpen until the cool-down passes
+  half_open  one trial call is let through; success closes the breaker,
+             failure re-opens it with a doubled cool-down (capped)
+
+Only failures that say something about the broker's health count: transport
+errors, timeouts and 5xx responses. Order rejections, 4xx and auth errors
+are answers, not outages.
+
+A client breaker opens after CB_FAILURES consecutive failures of that
+account; the broker breaker opens after CB_BROKER_FAILURES consecutive
+failures across all of its accounts (any success resets it), so one sick
+account trips only itself while a broker-wide outage trips everything.
+
+    Circuit_breaker.breakers.check("dhan", uid)      # raises CircuitOpen
+    ... call ...
+    Circuit_breaker.breakers.record("dhan", uid, ok=True)
+
+A call that passed check() but never got an answer (skipped for the request
+deadline, cut off by it, cancelled) says nothing either way; it calls
+breakers.release("dhan", uid) so a half-open trial slot is not held until
+the cool-down passes again.
+
+Env:
+  CB_ENABLED           0 to disable (default 1)
+  CB_FAILURES          consecutive failures that open a client breaker (default 5)
+  CB_BROKER_FAILURES   consecutive failures that open a broker breaker (default 20)
+  CB_OPEN_S            first cool-down before a trial call (default 30)
+  CB_OPEN_MAX_S        cool-down cap after repeated failed trials (default 300)
+"""
+import os, time, threading
+from typing import Any, Dict, Optional, Tuple
+
+import Metrics
+from Audit_log import audit
+
+ENABLED         = os.getenv("CB_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+CLIENT_FAILURES = int(os.getenv("CB_FAILURES", "5"))
+BROKER_FAILURES = int(os.getenv("CB_BROKER_FAILURES", "20"))
+OPEN_S          = float(os.getenv("CB_OPEN_S", "30"))
+OPEN_MAX_S      = float(os.getenv("CB_OPEN_MAX_S", "300"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+TRIPS    = Metrics.counter("circuit_trips_total", "Breakers opened.", ("broker", "scope"))
+REJECTED = Metrics.counter("circuit_rejected_total", "Calls failed fast by an open breaker.", ("broker", "scope"))
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a broker whose breaker is open."""
+
+    def __init__(self, broker: str, client: str, retry_in_s: float):
+        self.broker, self.client, self.retry_in_s = broker, client, retry_in_s
+        who = f"{broker}/{client}" if client else broker
+        super().__init__(f"circuit open: {who} (retry in {retry_in_s:.0f}s)")
+
+
+class Breaker:
+    __slots__ = ("broker", "client", "threshold", "state", "failures", "opened_at", "open_s",
+                 "probe_at", "trips", "rejected", "last_error", "_lock")
+
+    def __init__(self, broker: str, client: str, threshold: int):
+        self.broker, self.client, self.threshold = broker, client, threshold
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_s = OPEN_S
+        self.probe_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self.last_error = ""
+        self._lock = threading.Lock()
+
+    @property
+    def scope(self) -> str:
+        return "client" if self.client else "broker"
+
+    def allow(self) -> float:
+        """0 if a call may go ahead, else seconds until the next trial."""
+        if self.state == CLOSED:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN:
+                wait = self.opened_at + self.open_s - now
+                if wait > 0:
+                    self.rejected += 1
+                    return wait
+                self.state = HALF_OPEN
+                self.probe_at = now
+                return 0.0
+            if self.state == HALF_OPEN:
+                # one trial at a time; a trial that never reported is replaced
+                if now - self.probe_at < self.open_s:
+                    self.rejected += 1
+                    return max(1.0, self.probe_at + self.open_s - now)
+                self.probe_at = now
+                return 0.0
+        return 0.0
+
+    def release(self) -> None:
+        """Give back a trial slot that was granted but not used."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probe_at = 0.0
+
+    def success(self) -> None:
+        if self.state == CLOSED and not self.failures:
+            return
+        with self._lock:
+            was = self.state
+            self.state, self.failures, self.open_s = CLOSED, 0, OPEN_S
+        if was != CLOSED:
+            audit("circuit.closed", broker=self.broker, client=self.client)
+
+    def failure(self, reason: str) -> None:
+        with self._lock:
+            self.last_error = reason[:200]
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self.open_s = min(self.open_s * 2, OPEN_MAX_S)
+            elif self.state == OPEN or self.failures < self.threshold:
+                return
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.trips += 1
+            open_s = self.open_s
+        TRIPS.inc(self.broker, self.scope)
+        audit("circuit.open", broker=self.broker, client=self.client,
+              failures=self.failures, open_s=open_s, reason=self.last_error)
+
+    def stats(self) -> Dict[str, Any]:
+        out = {"state": self.state, "failures": self.failures, "trips": self.trips,
+               "rejected": self.rejected, "last_error": self.last_error}
+        if self.state != CLOSED:
+            out["retry_in_s"] = round(max(0.0, self.opened_at + self.open_s - time.monotonic()), 1)
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._brokers: Dict[str, Breaker] = {}
+        self._clients: Dict[Tuple[str, str], Breaker] = {}
+
+    def _get(self, broker: str, client: str) -> Breaker:
+        table, key = (self._clients, (broker, client)) if client else (self._brokers, broker)
+        b = table.get(key)  # type: ignore[arg-type]
+        if b is None:
+            with self._lock:
+                b = table.get(key)  # type: ignore[arg-type]
+                if b is None:
+                    b = table[key] = Breaker(broker, client, CLIENT_FAILURES if client else BROKER_FAILURES)  # type: ignore[index]
+        return b
+
+    def check(self, broker: str, client: Any = "") -> None:
+        """Raise CircuitOpen if this broker or this account is failing fast."""
+        if not ENABLED:
+            return
+        client = str(client or "")
+        cb = self._get(broker, client) if client else None
+        if cb is not None:
+            wait = cb.allow()
+            if wait:
+                REJECTED.inc(broker, "client")
+                raise CircuitOpen(broker, client, wait)
+        wait = self._get(broker, "").allow()
+        if wait:
+            if cb is not None:
+                cb.release()
+            REJECTED.inc(broker, "broker")
+            raise CircuitOpen(broker, "", wait)
+
+    def release(self, broker: str, client: Any = "") -> None:
+        """Give back the trial slots check() granted to a call that produced no answer."""
+        if not ENABLED:
+            return
+        client = str(client or "")
+        if client:
+            self._get(broker, client).release()
+        self._get(broker, "").release()
+
+    def record(self, broker: str, client: Any = "", ok: bool = True, reason: str = "") -> None:
+        if not ENABLED:
+            return
+        client = str(client or "")
+        targets = [self._get(broker, client)] if client else []
+        targets.append(self._get(broker, ""))
+        for b in targets:
+            if ok:
+                b.success()
+            else:
+                b.failure(reason)
+
+    def state(self, broker: str, client: Any = "") -> str:
+        return self._get(broker, str(client or "")).state
+
+    def reset(self, broker: Optional[str] = None, client: Optional[str] = None) -> int:
+        """Close matching breakers now (operator override); returns how many were open."""
+        with self._lock:
+            items = list(self._brokers.values()) + list(self._clients.values())
+        n = 0
+        for b in items:
+            if (broker and b.broker != broker) or (client and b.client != str(client)):
+                continue
+            if b.state != CLOSED:
+                n += 1
+            b.success()
+        return n
+
+    def stats(self, per_client: bool = False) -> Dict[str, Any]:
+        with self._lock:
+            brokers = dict(self._brokers)
+            clients = dict(self._clients)
+        out: Dict[str, Any] = {
+            "enabled": ENABLED,
+            "brokers": {k: b.stats() for k, b in brokers.items()},
+            "open_clients": sorted(f"{brk}/{uid}" for (brk, uid), b in clients.items() if b.state != CLOSED),
+        }
+        if per_client:
+            out["clients"] = {f"{brk}/{uid}": b.stats() for (brk, uid), b in clients.items()
+                              if b.state != CLOSED or b.failures or b.trips}
+        return out
+
+    def states(self) -> Dict[Tuple[str, str], int]:
+        """(broker, client) -> 0 closed / 1 half-open / 2 open; clients only when not closed."""
+        with self._lock:
+            out = {(k, ""): _STATE_VALUE[b.state] for k, b in self._brokers.items()}
+            out.update({k: _STATE_VALUE[b.state] for k, b in self._clients.items() if b.state != CLOSED})
+        return out
+
+
+breakers = Registry()
+
+Metrics.gauge("circuit_state", "Breaker state: 0 closed, 1 half-open, 2 open (client rows only when not closed).",
+              breakers.states, ("broker", "client"))
@@ -0,0 +1,566 @@
+# Copy_engine.py
+"""
+Copy-trading execution engine.
+
+Watches the master account of every enabled copy setup for new fills and
+mirrors each fill to the setup's children (qty x multiplier) through the
+router's concurrent order dispatcher.
+
+  * Motilal masters stream fills over the SDK trade-status websocket
+    (Broker_motilal.watch_trades); if that does not open and answer, or
+    closes later, the master's order book is polled here instead.
+  * Dhan masters subscribe to Broker_dhan's adaptive master poller
+    (Broker_dhan.subscribe_orders) and mirror the fill delta of each event.
+
+Setups are compiled into an in-memory routing table, master userid ->
+[Route(setup, child, broker, multiplier, client record)], so fanning out a
+fill is one dict lookup. The router updates it per setup when a setup is
+saved, enabled/disabled or deleted (upsert_setup / remove_setup) and
+re-resolves client records when clients change (refresh_clients).
+
+Mirrored legs are MARKET orders and carry a "CPY" correlation prefix / tag so
+the engine never re-copies its own child orders when a child is itself a
+master of another setup.
+
+Master-fill-to-child latency is tracked per fill:
+  detect_to_dispatch_ms  fill seen -> legs handed to the dispatcher
+  detect_to_ack_ms       fill seen -> all child acks back
+  fill_to_ack_ms         broker fill timestamp -> all child acks back (when the
+                         broker provides a parseable timestamp)
+
+Env:
+  COPY_ENGINE         0 to disable (default 1)
+  COPY_POLL_MIN_S     fastest Motilal fallback poll interval (default 0.25)
+  COPY_POLL_MAX_S     idle poll interval ceiling (default 2.0)
+  COPY_POLL_ERR_S     interval ceiling after errors (default 5.0)
+  COPY_WORKERS        threads dispatching child legs (default 8)
+"""
+import os, time, threading, importlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from Audit_log import audit
+
+ENABLED     = os.getenv("COPY_ENGINE", "1").strip().lower() not in ("0", "false", "no", "off")
+POLL_MIN_S  = float(os.getenv("COPY_POLL_MIN_S", "0.25"))
+POLL_MAX_S  = float(os.getenv("COPY_POLL_MAX_S", "2.0"))
+POLL_ERR_S  = float(os.getenv("COPY_POLL_ERR_S", "5.0"))
+WORKERS     = int(os.getenv("COPY_WORKERS", "8"))
+
+COPY_PREFIX = "CPY"
+_LATENCY_WINDOW = 2000
+
+
+def _broker_module(brk: str):
+    return importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
+
+def _parse_ts(s: Any) -> Optional[float]:
+    """Broker fill timestamps (local exchange time) -> epoch seconds."""
+    if not s:
+        return None
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%d-%b-%Y %H:%M:%S", "%d-%m-%Y %H:%M:%S", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.strptime(str(s).strip()[:19], fmt).timestamp()
+        except Exception:
+            continue
+    return None
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    vs = sorted(values)
+    return round(vs[min(len(vs) - 1, int(q * len(vs)))], 3)
+
+
+# ---------------------------
+# master watchers
+# ---------------------------
+class _PollWatcher:
+    """Adaptive order-book poller for one master (Motilal without a websocket)."""
+
+    def __init__(self, broker: str, master: str, on_fill: Callable[[Dict[str, Any]], None]):
+        self.broker = broker
+        self.master = master
+        self.on_fill = on_fill
+        self.interval = POLL_MIN_S
+        self.polls = 0
+        self.errors = 0
+        self._seen: Dict[str, int] = {}
+        self._seeded = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"copy-poll-{broker}-{master}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _poll_once(self) -> bool:
+        """Returns True when the master has open orders or new fills."""
+        mod = _broker_module(self.broker)
+        book = mod.raw_order_book(self.master)
+        if book is None:
+            raise RuntimeError("order book unavailable")
+        detected = time.time()
+        busy = False
+        for o in book:
+            snap = mod.fill_snapshot(o) if isinstance(o, dict) else None
+            if not snap:
+                continue
+            busy = busy or snap["open"]
+            prev = self._seen.get(snap["order_id"], 0)
+            if snap["filled_qty"] <= prev:
+                continue
+            self._seen[snap["order_id"]] = snap["filled_qty"]
+            if not self._seeded:
+                continue  # fills from before the engine started are not copied
+            busy = True
+            self.on_fill({
+                **snap,
+                "broker": self.broker,
+                "master": self.master,
+                "fill_id": f"{snap['order_id']}:{snap['filled_qty']}",
+                "qty": snap["filled_qty"] - prev,
+                "detected_at": detected,
+                "source": "poll",
+            })
+        self._seeded = True
+        return busy
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                busy = self._poll_once()
+                self.polls += 1
+                self.interval = POLL_MIN_S if busy else min(POLL_MAX_S, self.interval * 1.5)
+            except Exception as e:
+                self.errors += 1
+                self.interval = min(POLL_ERR_S, max(self.interval, POLL_MIN_S) * 2)
+                print(f"[copy] poll {self.broker}:{self.master} failed: {e}")
+            self._stop.wait(self.interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": "poll", "interval_s": round(self.interval, 3), "polls": self.polls,
+                "errors": self.errors, "orders_seen": len(self._seen)}
+
+
+class _DhanWatcher:
+    """Subscription to Broker_dhan's master poller; order events -> fills."""
+
+    def __init__(self, master: str, on_fill: Callable[[Dict[str, Any]], None]):
+        self.broker = "dhan"
+        self.master = master
+        self.on_fill = on_fill
+        self.events = 0
+        self._unsubscribe = None
+
+    def start(self):
+        self._unsubscribe = _broker_module("dhan").subscribe_orders(self.master, self._on_event)
+
+    def stop(self):
+        if self._unsubscribe:
+            self._unsubscribe()
+            self._unsubscribe = None
+
+    def _on_event(self, ev: Dict[str, Any]):
+        self.events += 1
+        snap = ev.get("order") or {}
+        if ev.get("fill_qty", 0) <= 0 or not snap:
+            return
+        self.on_fill({
+            **snap,
+            "broker": "dhan",
+            "master": self.master,
+            "fill_id": f"{snap['order_id']}:{snap['filled_qty']}",
+            "qty": ev["fill_qty"],
+            "detected_at": ev["detected_at"],
+            "source": "poll",
+        })
+
+    def stats(self) -> Dict[str, Any]:
+        poller = _broker_module("dhan").poller_stats().get(self.master, {})
+        return {"mode": "dhan-poller", "events": self.events, "poller": poller}
+
+
+class _StreamWatcher:
+    """Motilal trade-status websocket for one master."""
+
+    def __init__(self, master: str, on_fill: Callable[[Dict[str, Any]], None],
+                 on_lost: Optional[Callable[["_StreamWatcher"], None]] = None):
+        self.broker = "motilal"
+        self.master = master
+        self.on_fill = on_fill
+        self.on_lost = on_lost
+        self.events = 0
+        self._stream = None
+        self._stopped = False
+
+    def start(self) -> bool:
+        self._stream = _broker_module("motilal").watch_trades(self.master, self._on_trade, self._lost)
+        return self._stream is not None
+
+    def stop(self):
+        self._stopped = True
+        if self._stream is not None:
+            self._stream.close()
+
+    def _lost(self):
+        if not self._stopped and self.on_lost is not None:
+            self.on_lost(self)
+
+    def _on_trade(self, fill: Dict[str, Any]):
+        if self._stopped:
+            return
+        self.events += 1
+        self.on_fill({**fill, "broker": "motilal", "master": self.master,
+                      "detected_at": time.time(), "source": "stream"})
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": "stream", "events": self.events}
+
+
+# ---------------------------
+# routing table
+# ---------------------------
+class Route(NamedTuple):
+    setup_id: str
+    tag: str
+    child: str
+    broker: str
+    multiplier: float
+    client: Dict[str, Any]
+
+
+def _setup_id(doc: Dict[str, Any]) -> str:
+    return str(doc.get("id") or doc.get("name") or "")
+
+
+# ---------------------------
+# engine
+# ---------------------------
+class CopyEngine:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._watchers: Dict[str, Any] = {}          # master -> watcher
+        self._setups: Dict[str, Dict[str, Any]] = {}  # enabled setup id -> doc
+        self._by_master: Dict[str, set] = {}         # master -> enabled setup ids
+        self._routes: Dict[str, List[Route]] = {}    # master -> compiled routes
+        self._index: Dict[str, Dict[str, Any]] = {}
+        self._seen_fills: Dict[str, float] = {}      # fill_id -> detected_at (dedupe)
+        self._load_setups: Callable[[], List[Dict[str, Any]]] = lambda: []
+        self._client_index: Callable[[], Dict[str, Dict[str, Any]]] = lambda: {}
+        self._dispatch: Optional[Callable[[Dict[str, List[Dict[str, Any]]]], Dict[str, Any]]] = None
+        self._lot_size: Callable[[str], int] = lambda sid: 1
+        self.running = False
+        self.counters = {"fills": 0, "duplicates": 0, "ignored_own": 0, "legs": 0, "errors": 0,
+                         "below_lot": 0, "stream_lost": 0}
+        self._lat = {k: deque(maxlen=_LATENCY_WINDOW)
+                     for k in ("detect_to_dispatch_ms", "detect_to_ack_ms", "fill_to_ack_ms")}
+        self._last: List[Dict[str, Any]] = []
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._queued: Dict[str, deque] = {}          # master -> fills waiting for dispatch, in order
+
+    def configure(self, load_setups, client_index, dispatch, lot_size=None):
+        """
+        load_setups()      -> list of setup docs {id, name, master, children, multipliers, enabled}
+        client_index()     -> {userid: {"broker", "name", "json"}}
+        dispatch(by_broker)-> {broker: adapter result}; blocking, called on the engine's
+                              dispatch workers, one fill per master at a time
+        lot_size(sid)      -> shares per lot (Motilal children order in lots)
+        """
+        self._load_setups = load_setups
+        self._client_index = client_index
+        self._dispatch = dispatch
+        if lot_size:
+            self._lot_size = lot_size
+
+    # ---- lifecycle ----
+    def start(self):
+        if not ENABLED:
+            print("[copy] engine disabled (COPY_ENGINE=0)")
+            return
+        self.running = True
+        self.reload()
+
+    def stop(self):
+        self.running = False
+        with self._lock:
+            for w in self._watchers.values():
+                w.stop()
+            self._watchers.clear()
+
+    def reload(self):
+        """Rebuild the routing table from all setups and sync the watchers."""
+        try:
+            setups = [s for s in self._load_setups() if s.get("enabled")]
+            index = self._client_index()
+        except Exception as e:
+            print(f"[copy] reload failed: {e}")
+            return
+        with self._lock:
+            self._index = index
+            self._setups = {_setup_id(s): s for s in setups if _setup_id(s)}
+            self._by_master = {}
+            for sid, s in self._setups.items():
+                self._by_master.setdefault(str(s.get("master") or ""), set()).add(sid)
+            self._routes = {}
+            for m in list(self._by_master):
+                self._compile_master(m)
+            self._sync_watchers()
+
+    def upsert_setup(self, doc: Dict[str, Any]) -> None:
+        """A setup was created, edited, enabled or disabled."""
+        sid = _setup_id(doc)
+        if not sid:
+            return
+        with self._lock:
+            old = self._setups.pop(sid, None)
+            touched = set()
+            if old is not None:
+                m = str(old.get("master") or "")
+                self._by_master.get(m, set()).discard(sid)
+                touched.add(m)
+            if doc.get("enabled"):
+                m = str(doc.get("master") or "")
+                self._setups[sid] = dict(doc)
+                self._by_master.setdefault(m, set()).add(sid)
+                touched.add(m)
+            for m in touched:
+                self._compile_master(m)
+            self._sync_watchers()
+
+    def remove_setup(self, setup_id: str) -> None:
+        self.upsert_setup({"id": setup_id, "enabled": False})
+
+    def refresh_clients(self) -> None:
+        """Client records changed (add/edit/delete): re-resolve every route."""
+        try:
+            index = self._client_index()
+        except Exception as e:
+            print(f"[copy] client refresh failed: {e}")
+            return
+        with self._lock:
+            self._index = index
+            for m in list(self._by_master):
+                self._compile_master(m)
+            self._sync_watchers()
+
+    def _compile_master(self, master: str) -> None:
+        routes: List[Route] = []
+        for sid in sorted(self._by_master.get(master) or ()):
+            s = self._setups[sid]
+            mults = s.get("multipliers") or {}
+            tag = (COPY_PREFIX + sid)[:10]
+            for child in s.get("children") or []:
+                ci = self._index.get(str(child))
+                if not ci:
+                    continue
+                try:
+                    mult = float(mults.get(child, 1) or 1)
+                except Exception:
+                    mult = 1.0
+                routes.append(Route(sid, tag, str(child), ci["broker"], mult, ci))
+        if routes:
+            self._routes[master] = routes  # swapped whole; readers need no lock
+        else:
+            self._routes.pop(master, None)
+            if not self._by_master.get(master):
+                self._by_master.pop(master, None)
+
+    def routes_for(self, master: str) -> List[Route]:
+        return self._routes.get(str(master), [])
+
+    def _sync_watchers(self) -> None:
+        """Start watchers for masters with routes; stop the rest. Caller holds the lock."""
+        if not self.running:
+            return
+        masters = set(self._routes)
+        for m in list(self._watchers):
+            if m not in masters:
+                self._watchers.pop(m).stop()
+        for m in masters:
+            if m in self._watchers:
+                continue
+            ci = self._index.get(m)
+            if not ci:
+                print(f"[copy] master {m} not found among clients")
+                continue
+            try:
+                self._watchers[m] = self._watch(ci["broker"], m)
+            except Exception as e:
+                print(f"[copy] watch {m} failed: {e}")
+
+    def _watch(self, broker: str, master: str):
+        if broker == "dhan":
+            dw = _DhanWatcher(master, self.on_fill)
+            dw.start()
+            return dw
+        if broker == "motilal":
+            sw = _StreamWatcher(master, self.on_fill, self._stream_lost)
+            try:
+                if sw.start():
+                    return sw
+            except Exception as e:
+                print(f"[copy] stream for {master} failed, polling instead: {e}")
+        pw = _PollWatcher(broker, master, self.on_fill)
+        pw.start()
+        return pw
+
+    def _stream_lost(self, sw: "_StreamWatcher") -> None:
+        """A live Motilal stream closed (on its socket thread): poll that master instead."""
+        with self._lock:
+            if not self.running or self._watchers.get(sw.master) is not sw:
+                return
+            self.counters["stream_lost"] += 1
+            print(f"[copy] stream for {sw.master} closed, polling instead")
+            pw = _PollWatcher("motilal", sw.master, self.on_fill)
+            pw.start()
+            self._watchers[sw.master] = pw
+
+    # ---- mirroring ----
+    def _is_own(self, fill: Dict[str, Any]) -> bool:
+        return (str(fill.get("correlation_id") or "").startswith(COPY_PREFIX)
+                or str(fill.get("tag") or "").startswith(COPY_PREFIX))
+
+    def child_legs(self, fill: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+        """Router order legs for every enabled setup whose master made this fill."""
+        by_broker: Dict[str, List[Dict[str, Any]]] = {"dhan": [], "motilal": []}
+        below_lot: List[str] = []
+        for r in self._routes.get(str(fill["master"]), ()):
+            shares = int(round(fill["qty"] * r.multiplier))
+            qty = shares
+            if r.broker == "motilal":
+                qty = shares // max(1, int(self._lot_size(fill.get("security_id") or "") or 1))
+            if qty <= 0:
+                if shares > 0:
+                    below_lot.append(r.child)
+                continue
+            by_broker.setdefault(r.broker, []).append({
+                "client_id": r.child,
+                "name": r.client["name"],
+                "broker": r.broker,
+                "action": fill.get("action"),
+                "ordertype": "MARKET",
+                "producttype": fill.get("producttype"),
+                "orderduration": "DAY",
+                "exchange": fill.get("exchange") or "NSE",
+                "price": 0.0,
+                "triggerprice": 0.0,
+                "disclosedquantity": 0,
+                "amoorder": "N",
+                "qty": qty,
+                "tag": r.tag,
+                "correlation_id": "",
+                "symbol": fill.get("symbol") or "",
+                "security_id": str(fill.get("security_id") or ""),
+                "symboltoken": str(fill.get("security_id") or ""),
+                "stock_symbol": fill.get("symbol") or "",
+            })
+        if below_lot:
+            # a master fill smaller than one child lot: nothing to send, but say so
+            with self._lock:
+                self.counters["below_lot"] += len(below_lot)
+            audit("copy.below_lot", master=fill["master"], fill_id=fill.get("fill_id"),
+                  security_id=fill.get("security_id"), qty=fill["qty"], children=below_lot)
+        return {b: l for b, l in by_broker.items() if l}
+
+    def on_fill(self, fill: Dict[str, Any]) -> None:
+        """Called on watcher threads for every new master fill."""
+        fid = f"{fill.get('broker')}:{fill.get('master')}:{fill.get('fill_id')}"
+        with self._lock:
+            if fid in self._seen_fills:
+                self.counters["duplicates"] += 1
+                return
+            self._seen_fills[fid] = fill["detected_at"]
+            if len(self._seen_fills) > 50000:
+                for k in list(self._seen_fills)[:10000]:
+                    del self._seen_fills[k]
+            if self._is_own(fill):
+                self.counters["ignored_own"] += 1
+                return
+            self.counters["fills"] += 1
+
+        legs = self.child_legs(fill)
+        n = sum(len(l) for l in legs.values())
+        if not n or self._dispatch is None:
+            return
+        # the watcher thread (Dhan poller, Motilal socket) must not wait for
+        # broker acks; a master's fills still go out in the order they came
+        master = str(fill["master"])
+        with self._lock:
+            q = self._queued.get(master)
+            if q is not None:
+                q.append((fill, legs, n))
+                return
+            self._queued[master] = deque([(fill, legs, n)])
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="copy-dispatch")
+            pool = self._pool
+        pool.submit(self._drain, master)
+
+    def _drain(self, master: str) -> None:
+        while True:
+            with self._lock:
+                q = self._queued.get(master)
+                if not q:
+                    self._queued.pop(master, None)
+                    return
+                fill, legs, n = q.popleft()
+            try:
+                self._mirror(fill, legs, n)
+            except Exception as e:
+                print(f"[copy] mirror {master} failed: {e}")
+
+    def _mirror(self, fill: Dict[str, Any], legs: Dict[str, List[Dict[str, Any]]], n: int) -> None:
+        t_dispatch = time.time()
+        try:
+            results = self._dispatch(legs)
+        except Exception as e:
+            with self._lock:
+                self.counters["errors"] += 1
+            results = {"status": "error", "message": str(e)}
+        t_ack = time.time()
+
+        detected = fill["detected_at"]
+        lat = {
+            "detect_to_dispatch_ms": (t_dispatch - detected) * 1000,
+            "detect_to_ack_ms": (t_ack - detected) * 1000,
+        }
+        fill_ts = _parse_ts(fill.get("fill_time"))
+        if fill_ts is not None:
+            lat["fill_to_ack_ms"] = (t_ack - fill_ts) * 1000
+        with self._lock:
+            self.counters["legs"] += n
+            for k, v in lat.items():
+                self._lat[k].append(v)
+            self._last = ([{"master": fill["master"], "broker": fill["broker"], "fill_id": fill.get("fill_id"),
+                            "qty": fill["qty"], "legs": n, "source": fill.get("source"),
+                            **{k: round(v, 3) for k, v in lat.items()}, "results": results}]
+                          + self._last)[:20]
+
+    # ---- metrics ----
+    def latency_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {}
+            for k, d in self._lat.items():
+                vals = list(d)
+                out[k] = {"count": len(vals), "p50": _pct(vals, 0.50), "p95": _pct(vals, 0.95),
+                          "p99": _pct(vals, 0.99), "max": round(max(vals), 3) if vals else 0.0}
+            return out
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            watchers = {m: {"broker": w.broker, **w.stats()} for m, w in self._watchers.items()}
+            last = list(self._last)
+            counters = dict(self.counters)
+            queued = sum(len(q) for q in self._queued.values())
+        routes = {m: [{"setup": r.setup_id, "child": r.child, "broker": r.broker, "multiplier": r.multiplier}
+                      for r in rs] for m, rs in self._routes.items()}
+        return {"running": self.running, "counters": counters, "queued": queued, "routes": routes,
+                "watchers": watchers, "latency": self.latency_stats(), "recent": last}
+
+
+engine = CopyEngine()
@@ -0,0 +1,244 @@
+# Github_mirror.py
+"""
+Background replication of the router's JSON files to the GitHub repo.
+
+write()/delete() only record the latest desired state of a path and return.
+A single writer thread waits a short coalescing window, then commits every
+pending path in ONE commit through the Git Data API:
+
+    ref -> base commit -> new tree (base_tree + changed blobs) -> commit -> move ref
+
+Repeated writes to the same path before a commit collapse into one. A failed
+batch goes back to the pending set (newer writes win) and is retried with
+exponential backoff. stats() reports queue depth and replication lag (age of
+the oldest unreplicated change).
+
+Env (same repo settings as the router):
+  GITHUB_TOKEN, GITHUB_REPO_OWNER, GITHUB_REPO_NAME, GITHUB_BRANCH
+  GH_MIRROR_BATCH_MS     coalescing window before a commit (default 500)
+  GH_MIRROR_MAX_FILES    max paths per commit (default 200)
+  GH_MIRROR_BACKOFF_MAX  max seconds between retries (default 300)
+"""
+import os, time, random, threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+GITHUB_TOKEN  = os.getenv("GITHUB_TOKEN")
+GITHUB_OWNER  = os.getenv("GITHUB_REPO_OWNER") or "Pramod541988"
+GITHUB_REPO   = os.getenv("GITHUB_REPO_NAME")  or "Clients"
+GITHUB_BRANCH = os.getenv("GITHUB_BRANCH", "main")
+
+BATCH_S     = float(os.getenv("GH_MIRROR_BATCH_MS", "500")) / 1000.0
+MAX_FILES   = int(os.getenv("GH_MIRROR_MAX_FILES", "200"))
+BACKOFF_MAX = float(os.getenv("GH_MIRROR_BACKOFF_MAX", "300"))
+
+API = f"https://api.github.com/repos/{GITHUB_OWNER}/{GITHUB_REPO}"
+
+# path -> (content or None for delete, first time this change was queued)
+_pending: Dict[str, Tuple[Optional[str], float]] = {}
+# paths popped into the batch the writer is committing right now
+_inflight: set = set()
+_cv = threading.Condition()
+_state: Dict[str, Any] = {
+    "thread": None, "commits": 0, "files": 0, "coalesced": 0, "failures": 0,
+    "consecutive_failures": 0, "next_try_at": 0.0, "last_commit_at": None,
+    "last_commit_ms": None, "last_commit_sha": None, "last_error": None,
+    "inflight": 0, "inflight_since": None,
+}
+_session = requests.Session()
+
+
+def enabled() -> bool:
+    return bool(GITHUB_TOKEN and GITHUB_OWNER and GITHUB_REPO)
+
+def _headers() -> Dict[str, str]:
+    h = {"Accept": "application/vnd.github+json"}
+    if GITHUB_TOKEN:
+        h["Authorization"] = f"Bearer {GITHUB_TOKEN}"
+    return h
+
+def _norm(rel_path: str) -> str:
+    return (rel_path or "").replace("\\", "/").lstrip("/")
+
+
+# ---------------------------
+# public API
+# ---------------------------
+def write(rel_path: str, content: str) -> None:
+    """Queue <rel_path> to be created/updated with <content>. Never blocks on the network."""
+    _enqueue(rel_path, content or "")
+
+def delete(rel_path: str) -> None:
+    """Queue <rel_path> for deletion."""
+    _enqueue(rel_path, None)
+
+def pending_paths() -> List[str]:
+    """Paths with local changes not yet on GitHub: queued or in the commit being written."""
+    with _cv:
+        return list(_pending.keys() | _inflight)
+
+def flush(timeout: float = 10.0) -> bool:
+    """Commit everything pending now (ignores backoff); True if the queue drained."""
+    deadline = time.monotonic() + timeout
+    with _cv:
+        _state["next_try_at"] = 0.0
+        _cv.notify_all()
+        while _pending or _state["inflight"]:
+            left = deadline - time.monotonic()
+            if left <= 0 or _state["thread"] is None:
+                return False
+            _cv.wait(min(left, 0.1))
+    return True
+
+def stats() -> Dict[str, Any]:
+    now = time.time()
+    with _cv:
+        oldest = min([t for _, t in _pending.values()] +
+                     ([_state["inflight_since"]] if _state["inflight_since"] else []), default=None)
+        return {
+            "enabled": enabled(),
+            "branch": GITHUB_BRANCH,
+            "pending": len(_pending),
+            "inflight": _state["inflight"],
+            "lag_s": round(now - oldest, 3) if oldest else 0.0,
+            "commits": _state["commits"],
+            "files_committed": _state["files"],
+            "coalesced": _state["coalesced"],
+            "failures": _state["failures"],
+            "consecutive_failures": _state["consecutive_failures"],
+            "retry_in_s": round(max(0.0, _state["next_try_at"] - time.monotonic()), 1),
+            "last_commit_at": _state["last_commit_at"],
+            "last_commit_ms": _state["last_commit_ms"],
+            "last_commit_sha": _state["last_commit_sha"],
+            "last_error": _state["last_error"],
+        }
+
+
+# ---------------------------
+# writer thread
+# ---------------------------
+def _enqueue(rel_path: str, content: Optional[str]) -> None:
+    path = _norm(rel_path)
+    if not path or not enabled():
+        return
+    with _cv:
+        prev = _pending.get(path)
+        if prev is not None:
+            _state["coalesced"] += 1
+        _pending[path] = (content, prev[1] if prev else time.time())
+        if _state["thread"] is None:
+            t = threading.Thread(target=_writer, name="github-mirror", daemon=True)
+            _state["thread"] = t
+            t.start()
+        _cv.notify_all()
+
+def _writer() -> None:
+    while True:
+        with _cv:
+            while not _pending or time.monotonic() < _state["next_try_at"]:
+                wait = None if not _pending else _state["next_try_at"] - time.monotonic()
+                _cv.wait(wait)
+        # let a burst of saves land in the same commit
+        time.sleep(BATCH_S)
+        with _cv:
+            paths = list(_pending)[:MAX_FILES]
+            batch = {p: _pending.pop(p) for p in paths}
+            _inflight.update(batch)
+            _state["inflight"] = len(batch)
+            _state["inflight_since"] = min(t for _, t in batch.values())
+
+        t0 = time.perf_counter()
+        try:
+            sha = _commit({p: c for p, (c, _) in batch.items()})
+            err = None
+        except Exception as e:
+            sha, err = None, str(e)
+
+        with _cv:
+            _inflight.clear()
+            _state["inflight"] = 0
+            _state["inflight_since"] = None
+            if err is None:
+                _state["commits"] += 1 if sha else 0
+                _state["files"] += len(batch)
+                _state["consecutive_failures"] = 0
+                _state["next_try_at"] = 0.0
+                _state["last_commit_at"] = time.time()
+                _state["last_commit_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+                _state["last_commit_sha"] = sha or _state["last_commit_sha"]
+            else:
+                # put the batch back unless a newer write replaced it meanwhile
+                for p, item in batch.items():
+                    if p in _pending:
+                        _pending[p] = (_pending[p][0], item[1])
+                    else:
+                        _pending[p] = item
+                _state["failures"] += 1
+                _state["consecutive_failures"] += 1
+                n = _state["consecutive_failures"]
+                delay = min(BACKOFF_MAX, 2.0 ** n) * random.uniform(0.5, 1.0)
+                _state["next_try_at"] = time.monotonic() + delay
+                _state["last_error"] = err
+                print(f"[github-mirror] commit of {len(batch)} file(s) failed ({err}); retry in {delay:.1f}s")
+            _cv.notify_all()
+
+
+# ---------------------------
+# Git Data API
+# ---------------------------
+def _call(method: str, path: str, **kw) -> Any:
+    r = _session.request(method, f"{API}{path}", headers=_headers(), timeout=20, **kw)
+    if r.status_code >= 300:
+        raise RuntimeError(f"{method} {path} -> {r.status_code} {r.text[:200]}")
+    return r.json() if r.content else None
+
+def tree_listing(tree_sha: Optional[str] = None) -> Tuple[str, Dict[str, str]]:
+    """(commit sha, {path: blob sha}) for the branch head (or the given tree)."""
+    head = _call("GET", f"/git/ref/heads/{GITHUB_BRANCH}")["object"]["sha"]
+    if tree_sha is None:
+        tree_sha = _call("GET", f"/git/commits/{head}")["tree"]["sha"]
+    tree = _call("GET", f"/git/trees/{tree_sha}", params={"recursive": "1"})
+    return head, {e["path"]: e["sha"] for e in tree.get("tree") or [] if e.get("type") == "blob"}
+
+def get_blob(blob_sha: str) -> Dict[str, Any]:
+    """Blob JSON ({"content": base64, "encoding": ...}) by sha."""
+    return _call("GET", f"/git/blobs/{blob_sha}")
+
+def _commit(changes: Dict[str, Optional[str]]) -> Optional[str]:
+    """One commit with all changes; returns the new commit sha (None if nothing to do)."""
+    for attempt in range(3):
+        head = _call("GET", f"/git/ref/heads/{GITHUB_BRANCH}")["object"]["sha"]
+        base_tree = _call("GET", f"/git/commits/{head}")["tree"]["sha"]
+
+        entries: List[Dict[str, Any]] = []
+        deletes = [p for p, c in changes.items() if c is None]
+        existing: Dict[str, str] = {}
+        if deletes:
+            # deleting a path that is not in the tree fails the whole tree call
+            existing = tree_listing(base_tree)[1]
+        for p, c in changes.items():
+            if c is None:
+                if p in existing:
+                    entries.append({"path": p, "mode": "100644", "type": "blob", "sha": None})
+            else:
+                entries.append({"path": p, "mode": "100644", "type": "blob", "content": c})
+        if not entries:
+            return None
+
+        tree = _call("POST", "/git/trees", json={"base_tree": base_tree, "tree": entries})
+        names = sorted(changes)
+        msg = f"Update {names[0]}" if len(names) == 1 else f"Update {len(names)} files"
+        commit = _call("POST", "/git/commits", json={
+            "message": msg + ("" if len(names) == 1 else "\n\n" + "\n".join(names[:50])),
+            "tree": tree["sha"],
+            "parents": [head],
+        })
+        try:
+            _call("PATCH", f"/git/refs/heads/{GITHUB_BRANCH}", json={"sha": commit["sha"], "force": False})
+            return commit["sha"]
+        except RuntimeError as e:
+            # someone else moved the branch; rebuild on the new head
+            if "-> 422" not in str(e) or attempt == 2:
+                raise
+    return None
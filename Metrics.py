@@ -0,0 +1,258 @@
+# Metrics.py
+"""
+Prometheus metrics for the router and the broker adapters.
+
+Writers never take a lock: every thread updates its own shard (a plain dict
+reached through threading.local), and only the scrape walks the shards and
+adds them up. A thread touches a metric's lock once, the first time it
+writes to that metric, to register its shard. Histograms use fixed buckets
+chosen at definition time, so an observation is one bisect and two list
+increments.
+
+    REQUEST_SECONDS = Metrics.histogram("router_request_seconds", "...",
+                                        ("method", "route", "status"))
+    REQUEST_SECONDS.observe(0.012, "POST", "/place_orders", "2xx")
+
+Values that already live elsewhere (lane queue depths, session-pool size,
+journal backlog) are exposed as gauges evaluated at scrape time.
+
+render() returns the text exposition format (version 0.0.4) served by the
+router's /metrics.
+
+Env:
+  METRICS                0 to turn all writers into no-ops (default 1)
+  METRICS_CLIENT_LABEL   0 to drop the per-client label on broker call
+                         metrics for very large books (default 1)
+"""
+import os, math, bisect, threading
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+ENABLED      = os.getenv("METRICS", "1").strip().lower() not in ("0", "false", "no", "off")
+CLIENT_LABEL = os.getenv("METRICS_CLIENT_LABEL", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# seconds: 1 ms .. 30 s, dense where broker calls usually land
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25,
+                   0.5, 0.75, 1.0, 2.5, 5.0, 10.0, 30.0)
+# order legs per broker per request
+FANOUT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+def client_label(uid: Any) -> str:
+    return str(uid or "") if CLIENT_LABEL else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Tuple[threading.Thread, Dict[tuple, Any]]] = []
+        self._retired: Dict[tuple, Any] = {}
+
+    def _shard(self) -> Dict[tuple, Any]:
+        d = getattr(self._local, "d", None)
+        if d is None:
+            d = self._local.d = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), d))
+        return d
+
+    def _merge(self, into: Dict[tuple, Any], key: tuple, val: Any) -> None:
+        raise NotImplementedError
+
+    def _collect(self) -> Dict[tuple, Any]:
+        """Sum of all shards; shards of finished threads are folded into _retired."""
+        with self._lock:
+            live = []
+            for t, d in self._shards:
+                if t.is_alive():
+                    live.append((t, d))
+                else:
+                    for k, v in list(d.items()):
+                        self._merge(self._retired, k, v)
+            self._shards = live
+            out: Dict[tuple, Any] = {}
+            for k, v in list(self._retired.items()):
+                self._merge(out, k, v)
+            for _, d in live:
+                for k, v in list(d.items()):
+                    self._merge(out, k, v)
+        return out
+
+    def _labelstr(self, values: tuple, extra: str = "") -> str:
+        parts = [f'{n}="{_escape(v)}"' for n, v in zip(self.labels, values)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels: Any, by: float = 1.0) -> None:
+        if not ENABLED:
+            return
+        d = self._shard()
+        d[labels] = d.get(labels, 0.0) + by
+
+    def _merge(self, into, key, val):
+        into[key] = into.get(key, 0.0) + val
+
+    def values(self) -> Dict[tuple, float]:
+        return self._collect()
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{self._labelstr(k)} {_num(v)}" for k, v in sorted(self._collect().items(), key=lambda kv: str(kv[0]))]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: Any) -> None:
+        if not ENABLED:
+            return
+        d = self._shard()
+        row = d.get(labels)
+        if row is None:
+            # one slot per bucket, +Inf, then the sum
+            row = d[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def _merge(self, into, key, val):
+        acc = into.get(key)
+        if acc is None:
+            into[key] = list(val)
+        else:
+            for i, x in enumerate(val):
+                acc[i] += x
+
+    def render(self) -> List[str]:
+        out = []
+        for k, row in sorted(self._collect().items(), key=lambda kv: str(kv[0])):
+            running = 0
+            for le, n in zip(self.buckets, row):
+                running += n
+                out.append(f"{self.name}_bucket{self._labelstr(k, 'le=' + _quote(_num(le)))} {running}")
+            running += row[len(self.buckets)]
+            out.append(f"{self.name}_bucket{self._labelstr(k, 'le=' + _quote('+Inf'))} {running}")
+            out.append(f"{self.name}_sum{self._labelstr(k)} {_num(row[-1])}")
+            out.append(f"{self.name}_count{self._labelstr(k)} {running}")
+        return out
+
+
+class Gauge(_Metric):
+    """Read at scrape time: fn() -> number, or {label values tuple: number}."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], fn: Callable[[], Any],
+                 kind: str = "gauge"):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        # "counter" for running totals kept elsewhere (e.g. a stats() dict)
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        try:
+            val = self.fn()
+        except Exception as e:
+            print(f"[metrics] gauge {self.name} failed: {e}")
+            return []
+        if isinstance(val, dict):
+            return [f"{self.name}{self._labelstr(tuple(k) if isinstance(k, tuple) else (k,))} {_num(v)}"
+                    for k, v in sorted(val.items(), key=lambda kv: str(kv[0]))]
+        return [f"{self.name} {_num(val)}"]
+
+
+def _register(m: _Metric) -> _Metric:
+    with _registry_lock:
+        for old in _registry:
+            if old.name == m.name:
+                # module reloads re-define metrics; keep the collected values
+                return old
+        _registry.append(m)
+    return m
+
+def counter(name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+    return _register(Counter(name, help, labels))  # type: ignore[return-value]
+
+def histogram(name: str, help: str, labels: Sequence[str] = (),
+              buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, labels, buckets))  # type: ignore[return-value]
+
+def gauge(name: str, help: str, fn: Callable[[], Any], labels: Sequence[str] = (),
+          kind: str = "gauge") -> Gauge:
+    with _registry_lock:
+        for old in _registry:
+            if old.name == name and isinstance(old, Gauge):
+                old.fn = fn
+                return old
+    return _register(Gauge(name, help, labels, fn, kind))  # type: ignore[return-value]
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry)
+    lines: List[str] = []
+    for m in metrics:
+        body = m.render()
+        if not body and isinstance(m, Gauge):
+            continue
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        lines.extend(body)
+    return "\n".join(lines) + "\n"
+
+
+def _escape(v: Any) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _quote(v: str) -> str:
+    return '"' + v + '"'
+
+def _num(v: Any) -> str:
+    v = float(v)
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return str(int(v)) if v.is_integer() else repr(v)
+
+
+# ---------------------------
+# shared metrics
+# ---------------------------
+# defined here so the adapters and the router write the same series without
+# importing each other
+BROKER_CALL_SECONDS = histogram(
+    "broker_call_seconds", "Latency of one broker API call.", ("broker", "api", "client"))
+BROKER_CALL_ERRORS = counter(
+    "broker_call_errors_total", "Broker API calls that failed or were rejected.",
+    ("broker", "api", "client", "reason"))
+LOGIN_SECONDS = histogram(
+    "broker_login_seconds", "Duration of a broker login (including session rehydrate).",
+    ("broker", "result"))
+CACHE_LOOKUPS = counter(
+    "cache_lookups_total", "Cache lookups by cache and result (hit/miss).", ("cache", "result"))
+
+
+def cache_hit(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.inc(cache, "hit" if hit else "miss")
+
+def _cache_ratios() -> Dict[str, float]:
+    seen: Dict[str, List[float]] = {}
+    for (cache, result), n in CACHE_LOOKUPS.values().items():
+        row = seen.setdefault(cache, [0.0, 0.0])
+        row[0 if result == "hit" else 1] += n
+    return {cache: round(h / (h + m), 4) for cache, (h, m) in seen.items() if h + m}
+
+gauge("cache_hit_ratio", "Hits / lookups since start, per cache.", _cache_ratios, ("cache",))
@@ -0,0 +1,292 @@
+# Mock_brokers.py
+"""
+Local stand-in for the Dhan v2 REST API and the Motilal OpenAPI REST paths.
+
+Lets the router be exercised and benchmarked without live accounts: point the
+adapters at it with
+
+    DHAN_API=http://127.0.0.1:<port>/v2
+    MO_BASE_URL=http://127.0.0.1:<port>
+
+Dhan  : GET/POST /v2/orders, PUT/DELETE /v2/orders/{id}, GET /v2/positions,
+        /v2/holdings, /v2/fundlimit, /v2/profile
+Motilal (paths from MOFSLOPENAPI.GetUrl): login, logout, getprofile,
+        getorderbook, gettradebook, getposition, getdpholding, placeorder,
+        modifyorder, cancelorder, getorderdetailbyuniqueorderid and the
+        report endpoints (empty data)
+
+Orders are kept in memory per access token (Dhan) / clientcode (Motilal), so
+order books reflect what was placed. Every request first sleeps
+latency_ms + U(0, jitter_ms), then fails with 429 at rate_429 and with 500 at
+error_rate. Each served request's completion time (time.perf_counter) is
+recorded so an in-process benchmark can measure per-leg latency.
+
+Run standalone:  python Mock_brokers.py --port 9100 --latency-ms 20 --jitter-ms 10
+"""
+import json, time, random, threading, itertools
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+
+CONFIG: Dict[str, float] = {"latency_ms": 0.0, "jitter_ms": 0.0, "rate_429": 0.0, "error_rate": 0.0}
+
+_lock = threading.Lock()
+_ids = itertools.count(1)
+_dhan_orders: Dict[str, List[Dict[str, Any]]] = {}   # access token -> orders
+_mo_orders: Dict[str, List[Dict[str, Any]]] = {}     # clientcode -> orders
+_mo_tokens: Dict[str, str] = {}                      # AuthToken -> clientcode
+_stats: Dict[str, Any] = {"requests": 0, "throttled": 0, "errors": 0, "by_path": {}}
+# (perf_counter at completion, path, key) of every served order placement
+placements: List[Tuple[float, str, str]] = []
+
+
+def configure(**kw: float) -> Dict[str, float]:
+    for k, v in kw.items():
+        if k not in CONFIG:
+            raise KeyError(k)
+        CONFIG[k] = float(v)
+    return dict(CONFIG)
+
+def reset() -> None:
+    with _lock:
+        _dhan_orders.clear()
+        _mo_orders.clear()
+        _mo_tokens.clear()
+        placements.clear()
+        _stats.update({"requests": 0, "throttled": 0, "errors": 0, "by_path": {}})
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        return {**_stats, "by_path": dict(_stats["by_path"]), "config": dict(CONFIG)}
+
+def _next_id() -> str:
+    return str(next(_ids)).rjust(10, "0")
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+# ---------------------------
+# Dhan v2
+# ---------------------------
+def _dhan(method: str, path: str, token: str, body: Dict[str, Any]) -> Tuple[int, Any]:
+    if not token:
+        return 401, {"errorType": "Invalid_Authentication", "errorCode": "DH-901",
+                     "errorMessage": "Client ID or user generated access token is invalid or expired."}
+    parts = path.strip("/").split("/")[1:]          # drop "v2"
+    head = parts[0] if parts else ""
+    if head == "orders":
+        book = _dhan_orders.setdefault(token, [])
+        if method == "GET" and len(parts) == 1:
+            return 200, [dict(o) for o in book]
+        if method == "POST" and len(parts) == 1:
+            o = {
+                "orderId": _next_id(), "orderStatus": "PENDING" if body.get("orderType") == "LIMIT" else "TRADED",
+                "correlationId": body.get("correlationId", ""), "transactionType": body.get("transactionType"),
+                "exchangeSegment": body.get("exchangeSegment"), "productType": body.get("productType"),
+                "orderType": body.get("orderType"), "securityId": body.get("securityId"),
+                "tradingSymbol": body.get("tradingSymbol") or body.get("securityId"),
+                "quantity": body.get("quantity"), "price": body.get("price", 0),
+                "filledQty": 0 if body.get("orderType") == "LIMIT" else body.get("quantity"),
+                "createTime": _now(), "updateTime": _now(),
+            }
+            book.append(o)
+            return 200, {"orderId": o["orderId"], "orderStatus": "TRANSIT"}
+        if len(parts) == 2:
+            o = next((x for x in book if x["orderId"] == parts[1]), None)
+            if o is None:
+                return 404, {"errorType": "Order_Error", "errorCode": "DH-906", "errorMessage": "Order not found"}
+            if method == "DELETE":
+                o["orderStatus"] = "CANCELLED"
+            elif method == "PUT":
+                for k in ("quantity", "price", "orderType", "triggerPrice"):
+                    if k in body:
+                        o[k] = body[k]
+            return 200, {"orderId": o["orderId"], "orderStatus": "TRANSIT" if method == "PUT" else "CANCELLED"}
+    if method == "GET" and head == "positions":
+        return 200, [{"tradingSymbol": o["tradingSymbol"], "securityId": o["securityId"],
+                      "exchangeSegment": o["exchangeSegment"], "productType": o["productType"],
+                      "netQty": o["filledQty"] if o["transactionType"] == "BUY" else -o["filledQty"],
+                      "buyAvg": o["price"], "sellAvg": 0, "realizedProfit": 0, "unrealizedProfit": 0}
+                     for o in _dhan_orders.get(token, []) if o.get("filledQty")]
+    if method == "GET" and head == "holdings":
+        return 200, [{"tradingSymbol": "PNB", "securityId": "10666", "availableQty": 10,
+                      "totalQty": 10, "avgCostPrice": 100.0, "lastTradedPrice": 101.5}]
+    if method == "GET" and head == "fundlimit":
+        return 200, {"availabelBalance": 100000.0, "sodLimit": 100000.0, "utilizedAmount": 0.0}
+    if method == "GET" and head == "profile":
+        valid = (datetime.now() + timedelta(days=20)).strftime("%d/%m/%Y %H:%M")
+        return 200, {"dhanClientId": token[:10], "tokenValidity": valid, "activeSegment": "Equity"}
+    return 404, {"errorType": "Not_Found", "errorMessage": path}
+
+
+# ---------------------------
+# Motilal OpenAPI
+# ---------------------------
+_MO_EMPTY = ("getreportmargin", "getreportmarginsummary", "getreportmargindetail", "getltpdata",
+             "getscripsbyexchangename", "getbrokeragedetail", "getbroadcastmaxlimit",
+             "positionconversion", "resendotp", "verifyotp")
+
+def _mo(path: str, auth: str, body: Dict[str, Any]) -> Tuple[int, Any]:
+    op = path.rstrip("/").rsplit("/", 1)[-1].lower()
+    ok = {"status": "SUCCESS", "message": "", "errorcode": ""}
+    if op == "authdirectapi":
+        uid = str(body.get("userid") or "")
+        tok = "MOCK" + _next_id()
+        _mo_tokens[tok] = uid
+        return 200, {**ok, "AuthToken": tok}
+    uid = _mo_tokens.get(auth)
+    if uid is None:
+        return 200, {"status": "FAILED", "message": "Invalid Session", "errorcode": "MO8050"}
+    if op == "logout":
+        _mo_tokens.pop(auth, None)
+        return 200, ok
+    if op == "getprofile":
+        return 200, {**ok, "data": {"clientcode": uid, "name": uid}}
+    book = _mo_orders.setdefault(str(body.get("clientcode") or uid), [])
+    if op == "placeorder":
+        oid = _next_id()
+        book.append({
+            "uniqueorderid": oid, "clientid": uid, "symboltoken": body.get("symboltoken"),
+            "exchange": body.get("exchange"), "buyorsell": body.get("buyorsell"),
+            "ordertype": body.get("ordertype"), "producttype": body.get("producttype"),
+            "orderqty": body.get("quantityinlot"), "qtytradedtoday": body.get("quantityinlot"),
+            "price": body.get("price", 0), "tag": body.get("tag", ""),
+            "orderstatus": "Confirm" if body.get("ordertype") == "LIMIT" else "Traded",
+            "symbol": str(body.get("symboltoken") or ""), "recordinserttime": _now(),
+        })
+        return 200, {**ok, "uniqueorderid": oid}
+    if op in ("modifyorder", "cancelorder"):
+        o = next((x for x in book if x["uniqueorderid"] == str(body.get("uniqueorderid"))), None)
+        if o is None:
+            return 200, {"status": "FAILED", "message": "Order not found", "errorcode": "MO5002"}
+        if op == "cancelorder":
+            o["orderstatus"] = "Cancel"
+        return 200, {**ok, "uniqueorderid": o["uniqueorderid"]}
+    if op == "getorderbook":
+        return 200, {**ok, "data": [dict(o) for o in book]}
+    if op == "gettradebook":
+        return 200, {**ok, "data": [dict(o) for o in book if o["orderstatus"] == "Traded"]}
+    if op == "getorderdetailbyuniqueorderid":
+        return 200, {**ok, "data": [dict(o) for o in book if o["uniqueorderid"] == str(body.get("uniqueorderid"))]}
+    if op == "getposition":
+        return 200, {**ok, "data": [{"symbol": o["symbol"], "symboltoken": o["symboltoken"],
+                                     "exchange": o["exchange"], "productname": o["producttype"],
+                                     "buyquantity": o["orderqty"] if o["buyorsell"] == "BUY" else 0,
+                                     "sellquantity": o["orderqty"] if o["buyorsell"] == "SELL" else 0,
+                                     "buyamount": 0, "sellamount": 0, "LTP": o["price"],
+                                     "marktomarket": 0, "bookedprofitloss": 0}
+                                    for o in book if o["orderstatus"] == "Traded"]}
+    if op == "getdpholding":
+        return 200, {**ok, "data": [{"scripname": "PNB", "scripcode": "10666", "dpquantity": 10,
+                                     "buyavgprice": 100.0, "nsesymboltoken": "10666"}]}
+    if op in _MO_EMPTY:
+        return 200, {**ok, "data": []}
+    return 404, {"status": "FAILED", "message": f"unknown path {path}", "errorcode": ""}
+
+
+# ---------------------------
+# HTTP server
+# ---------------------------
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *a):
+        pass
+
+    def _reply(self, code: int, body: Any) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # the caller gave up (timeout / request deadline)
+            pass
+
+    def _handle(self, method: str) -> None:
+        n = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(n) if n else b""
+        try:
+            body = json.loads(raw) if raw else {}
+        except Exception:
+            body = {}
+        path = self.path.split("?", 1)[0]
+
+        delay = CONFIG["latency_ms"] + random.uniform(0, CONFIG["jitter_ms"])
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+        is_dhan = path.startswith("/v2/")
+        with _lock:
+            _stats["requests"] += 1
+            _stats["by_path"][f"{method} {path if is_dhan else path.rsplit('/', 1)[-1]}"] = \
+                _stats["by_path"].get(f"{method} {path if is_dhan else path.rsplit('/', 1)[-1]}", 0) + 1
+            roll = random.random()
+            if roll < CONFIG["rate_429"]:
+                _stats["throttled"] += 1
+                code, resp = 429, ({"errorType": "Rate_Limit", "errorCode": "DH-904",
+                                    "errorMessage": "Too many requests"} if is_dhan else
+                                   {"status": "FAILED", "message": "Too many requests", "errorcode": "429"})
+            elif roll < CONFIG["rate_429"] + CONFIG["error_rate"]:
+                _stats["errors"] += 1
+                code, resp = 500, ({"errorType": "Internal", "errorMessage": "mock error"} if is_dhan else
+                                   {"status": "FAILED", "message": "mock error", "errorcode": "500"})
+            elif is_dhan:
+                code, resp = _dhan(method, path, self.headers.get("access-token") or "", body)
+            elif path.startswith("/rest/"):
+                code, resp = _mo(path, self.headers.get("Authorization") or "", body)
+            else:
+                code, resp = 404, {"message": "not found"}
+        self._reply(code, resp)
+        if code == 200 and ((is_dhan and method == "POST" and path.rstrip("/").endswith("/orders"))
+                            or path.endswith("/placeorder")):
+            placements.append((time.perf_counter(), path,
+                               str(body.get("dhanClientId") or body.get("clientcode") or "")))
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def start(host: str = "127.0.0.1", port: int = 0, **config: float) -> Tuple[ThreadingHTTPServer, str]:
+    """Start the mock on a daemon thread; returns (server, base url without /v2)."""
+    configure(**config)
+    srv = _Server((host, port), _Handler)
+    threading.Thread(target=srv.serve_forever, name="mock-brokers", daemon=True).start()
+    return srv, f"http://{host}:{srv.server_address[1]}"
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Mock Dhan v2 / Motilal OpenAPI server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9100)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--rate-429", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    a = ap.parse_args()
+    srv, url = start(a.host, a.port, latency_ms=a.latency_ms, jitter_ms=a.jitter_ms,
+                     rate_429=a.rate_429, error_rate=a.error_rate)
+    print(f"mock brokers on {url}  (DHAN_API={url}/v2  MO_BASE_URL={url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()
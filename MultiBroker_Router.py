@@ -1,22 +1,46 @@
 # MultiBroker_Router.py
-import os, json, importlib, base64
-from typing import Any, Dict, List,Optional
-from fastapi import FastAPI, Body, BackgroundTasks, HTTPException
+import os, json, importlib, base64, asyncio
+from typing import Any, Dict, List,Optional, Tuple
+from fastapi import FastAPI, Body, BackgroundTasks, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from collections import OrderedDict
 import importlib, os, time
 import threading
-import os, sqlite3, threading, requests
+import os, sqlite3, threading, requests, csv
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import Audit_log
+from Audit_log import audit
+import Order_journal
+import Copy_engine
+import Github_mirror
+import Session_keepalive
+import Req_timing
+from Req_timing import span
+import Req_deadline
+import Metrics
+import Profiler
+import Circuit_breaker
+import Read_hedge
+import Rate_limiter
+import Book_models
+import Response_codec
+import hmac
+import uuid
 from fastapi import Query
 import pandas as pd
 
 
 STAT_KEYS = ["pending", "traded", "rejected", "cancelled", "others"]
-summary_data_global: Dict[str, Dict[str, Any]] = {}
+summary_data_global: Dict[str, Book_models.Funds] = {}
 SYMBOL_DB_PATH = os.path.join(os.path.abspath(os.environ.get("DATA_DIR", "./data")), "symbols.db")
 SYMBOL_TABLE   = "symbols"
 SYMBOL_CSV_URL = "https://raw.githubusercontent.com/Pramod541988/Stock_List/main/security_id.csv"
 _symbol_db_lock = threading.Lock()
+# typeahead repeats the same prefixes; results only change when the DB is rebuilt
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "512"))
+_search_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
 
 
 # --- GitHub global config (single source of truth) ---
@@ -60,6 +84,102 @@ app.add_middleware(
 )
 
 
+# --- Priority lanes ---
+# Order entry (/place_orders, /cancel_order, /modify_order, /close_positions)
+# and reporting (/get_orders, /get_positions, /get_holdings, /clients) run on
+# separate executors, so a burst of book refreshes can never occupy the
+# workers an order needs. Dhan async calls get a matching per-lane HTTP pool.
+class _Lane(ThreadPoolExecutor):
+    """ThreadPoolExecutor with its own worker cap and queue-depth counters."""
+
+    def __init__(self, name: str, workers: int):
+        super().__init__(max_workers=workers, thread_name_prefix=f"lane-{name}")
+        self.name = name
+        self.workers = workers
+        self._stats_lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.max_queued = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def submit(self, fn, /, *args, **kwargs):
+        enqueued = time.perf_counter()
+        with self._stats_lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+        def _run():
+            waited = time.perf_counter() - enqueued
+            with self._stats_lock:
+                self.queued -= 1
+                self.running += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._stats_lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        return super().submit(_run)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            started = self.completed + self.running
+            return {
+                "workers": self.workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "max_queued": self.max_queued,
+                "avg_wait_ms": round(1000 * self.wait_total / started, 3) if started else 0.0,
+                "max_wait_ms": round(1000 * self.wait_max, 3),
+            }
+
+ORDER_LANE  = _Lane("orders",  int(os.getenv("ORDER_LANE_WORKERS", "32")))
+REPORT_LANE = _Lane("reports", int(os.getenv("REPORT_LANE_WORKERS", "8")))
+
+async def _run_in_lane(lane: _Lane, fn, *args):
+    """Run a blocking callable on a lane and await its result."""
+    loop = asyncio.get_running_loop()
+    # bind: spans recorded on the lane thread still belong to this request
+    return await loop.run_in_executor(lane, Req_timing.bind(fn, *args))
+
+
+# --- Request timing ---
+# Every request gets a Req_timing context; its sub-spans (client index, lot
+# lookups, per-broker dispatch, per-client broker calls, GitHub mirroring)
+# come back as a Server-Timing header, and requests slower than
+# SLOW_REQUEST_MS are written to the audit log with the full breakdown.
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+
+REQUEST_SECONDS = Metrics.histogram(
+    "router_request_seconds", "HTTP request latency per route.", ("method", "route", "status"))
+FANOUT_LEGS = Metrics.histogram(
+    "router_fanout_legs", "Order legs dispatched to one broker by one request.",
+    ("broker",), buckets=Metrics.FANOUT_BUCKETS)
+
+@app.middleware("http")
+async def _request_timing(request, call_next):
+    t = Req_timing.begin()
+    # GET routes run under a time budget (header or route default); see Req_deadline
+    Req_deadline.begin(Req_deadline.budget_for(request.method, request.url.path,
+                                               request.headers.get(Req_deadline.HEADER)))
+    response = await call_next(request)
+    total = t.elapsed_ms()
+    # route template, not the raw path, so ids in URLs don't explode the series
+    route = getattr(request.scope.get("route"), "path", None) or "unmatched"
+    REQUEST_SECONDS.observe(total / 1000, request.method, route, f"{response.status_code // 100}xx")
+    response.headers["Server-Timing"] = t.server_timing(total)
+    if total >= SLOW_REQUEST_MS:
+        audit("router.slow_request", method=request.method, path=request.url.path,
+              status=response.status_code, total_ms=round(total, 1), spans=t.as_dict())
+    return response
+
+
 # --- Groups storage (simple) ---
 GROUPS_ROOT = os.path.join(BASE_DIR, "groups")
 os.makedirs(GROUPS_ROOT, exist_ok=True)
@@ -133,80 +253,106 @@ def _github_sync_dir(rel_dir: str):
             pass
 
 
-def _github_sync_down_all():
-    for rel in ("clients/dhan", "clients/motilal", "groups", "copy_setups"):
-        _github_sync_dir(rel)
+_SYNC_DIRS = ("clients/dhan", "clients/motilal", "groups", "copy_setups")
+GH_SYNC_WORKERS = int(os.getenv("GH_SYNC_WORKERS", "8"))
+_sync_state: Dict[str, Any] = {"running": False, "started_at": None, "finished_at": None,
+                               "remote": 0, "downloaded": 0, "unchanged": 0, "errors": 0,
+                               "mode": None, "error": None}
 
+def _git_blob_sha(path: str) -> Optional[str]:
+    """Git blob sha of a local file (what GitHub's tree listing reports), None if absent."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def _github_sync_one(rel_path: str, blob_sha: str) -> None:
+    j = Github_mirror.get_blob(blob_sha)
+    content = base64.b64decode(j.get("content") or "")
+    local_path = os.path.join(BASE_DIR, rel_path.replace("/", os.sep))
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    tmp = local_path + ".sync"
+    with open(tmp, "wb") as f:
+        f.write(content)
+    os.replace(tmp, local_path)
 
-# === GitHub persistence helpers ===
-def _github_file_write(rel_path: str, content: str) -> None:
+def _github_sync_down_all():
     """
-    Create or update a file in GitHub at <rel_path> on GITHUB_BRANCH.
-    Uses global config (GITHUB_*). No-op if config incomplete.
+    Pull the client/group/setup JSON files from GitHub.
+    One recursive tree listing; only files whose blob sha differs from the
+    local copy are downloaded, in parallel. Paths with local changes still
+    waiting to be mirrored up are left alone.
     """
-    if not (GITHUB_OWNER and GITHUB_REPO and rel_path):
-        return  # missing config or bad path
-
-    url = GH_CONTENTS_URL(rel_path)
-
-    # Try to get current sha (use ?ref=branch for correct head)
-    sha = None
+    _sync_state.update({"running": True, "started_at": time.time(), "finished_at": None,
+                        "remote": 0, "downloaded": 0, "unchanged": 0, "errors": 0, "error": None})
     try:
-        resp = requests.get(f"{url}?ref={GITHUB_BRANCH}", headers=GH_HEADERS(), timeout=15)
-        if resp.status_code == 200:
-            sha = (resp.json() or {}).get("sha")
-    except Exception:
-        pass
-
-    try:
-        b64 = base64.b64encode((content or "").encode("utf-8")).decode("utf-8")
-    except Exception:
-        return
-
-    payload = {
-        "message": f"Update {rel_path}",
-        "content": b64,
-        "branch": GITHUB_BRANCH,
-    }
-    if sha:
-        payload["sha"] = sha
+        if not (GITHUB_OWNER and GITHUB_REPO):
+            return
+        try:
+            _, blobs = Github_mirror.tree_listing()
+        except Exception as e:
+            # tree API unavailable: old per-directory walk
+            _sync_state.update({"mode": "contents", "error": str(e)})
+            for rel in _SYNC_DIRS:
+                try:
+                    _github_sync_dir(rel)
+                except Exception as e2:
+                    _sync_state["errors"] += 1
+                    print(f"[github-sync] {rel} failed: {e2}")
+            return
 
-    try:
-        requests.put(url, headers=GH_HEADERS(), json=payload, timeout=20)
-    except Exception:
-        pass
+        _sync_state["mode"] = "tree"
+        local_pending = set(Github_mirror.pending_paths())
+        todo = []
+        for rel_path, sha in blobs.items():
+            d, _, name = rel_path.rpartition("/")
+            if d not in _SYNC_DIRS or not name.lower().endswith(".json"):
+                continue
+            _sync_state["remote"] += 1
+            if rel_path in local_pending:
+                continue
+            if _git_blob_sha(os.path.join(BASE_DIR, rel_path.replace("/", os.sep))) == sha:
+                _sync_state["unchanged"] += 1
+                continue
+            todo.append((rel_path, sha))
 
+        if todo:
+            with ThreadPoolExecutor(max_workers=GH_SYNC_WORKERS, thread_name_prefix="gh-sync") as ex:
+                futs = {ex.submit(_github_sync_one, p, sha): p for p, sha in todo}
+                for fut, rel_path in futs.items():
+                    try:
+                        fut.result()
+                        _sync_state["downloaded"] += 1
+                    except Exception as e:
+                        _sync_state["errors"] += 1
+                        print(f"[github-sync] {rel_path} failed: {e}")
+    finally:
+        _refresh_cache()
+        if _sync_state["downloaded"] or _sync_state["mode"] == "contents":
+            Copy_engine.engine.reload()
+        _sync_state.update({"running": False, "finished_at": time.time()})
+        print(f"[github-sync] done: {_sync_state}")
+
+def github_sync_stats() -> Dict[str, Any]:
+    st = dict(_sync_state)
+    if st["started_at"]:
+        st["elapsed_s"] = round((st["finished_at"] or time.time()) - st["started_at"], 3)
+    return st
 
-def _github_file_delete(rel_path: str) -> None:
-    """
-    Delete a file in GitHub at <rel_path> on GITHUB_BRANCH.
-    Uses global config (GITHUB_*). No-op if config incomplete or file missing.
-    """
-    if not (GITHUB_OWNER and GITHUB_REPO and rel_path):
-        return
 
-    url = GH_CONTENTS_URL(rel_path)
+# === GitHub persistence helpers ===
+# Writes are replicated in the background (Github_mirror): saves return as soon
+# as the local file is written, and bursts of saves go out as one commit.
+def _github_file_write(rel_path: str, content: str) -> None:
+    """Queue <rel_path> for create/update on GITHUB_BRANCH. No-op if config incomplete."""
+    Github_mirror.write(rel_path, content)
 
-    # Need current sha for delete
-    sha = None
-    try:
-        r = requests.get(f"{url}?ref={GITHUB_BRANCH}", headers=GH_HEADERS(), timeout=15)
-        if r.status_code == 200:
-            sha = (r.json() or {}).get("sha")
-    except Exception:
-        pass
-    if not sha:
-        return
 
-    payload = {
-        "message": f"Delete {rel_path}",
-        "sha": sha,
-        "branch": GITHUB_BRANCH,
-    }
-    try:
-        requests.delete(url, headers=GH_HEADERS(), json=payload, timeout=20)
-    except Exception:
-        pass
+def _github_file_delete(rel_path: str) -> None:
+    """Queue <rel_path> for deletion on GITHUB_BRANCH. No-op if config incomplete."""
+    Github_mirror.delete(rel_path)
 
 
 def refresh_symbol_db_from_github() -> str:
@@ -226,6 +372,7 @@ def refresh_symbol_db_from_github() -> str:
     with _symbol_db_lock:
         conn = sqlite3.connect(SYMBOL_DB_PATH)
         try:
+            _search_cache.clear()
             df.to_sql(SYMBOL_TABLE, conn, index=False, if_exists="replace")
             # indexes (ignore failures if columns already indexed / absent)
             try:
@@ -285,6 +432,16 @@ def router_search_symbols(q: str = Query(""), exchange: str = Query("")):
     if not words:
         return {"results": []}
 
+    ckey = (raw, exch)
+    hit = _search_cache.get(ckey)
+    Metrics.cache_hit("symbol_search", hit is not None)
+    if hit is not None:
+        try:
+            _search_cache.move_to_end(ckey)
+        except KeyError:
+            pass
+        return hit
+
     where_sql, where_params = [], []
     for w in words:
         where_sql.append('LOWER([Stock Symbol]) LIKE ?')
@@ -325,7 +482,15 @@ def router_search_symbols(q: str = Query(""), exchange: str = Query("")):
         {"id": f"{r[0]}|{r[1]}|{r[2]}", "text": f"{r[0]} | {r[1]}"}
         for r in rows
     ]
-    return {"results": results}
+    out = {"results": results}
+    if SEARCH_CACHE_SIZE > 0:
+        _search_cache[ckey] = out
+        while len(_search_cache) > SEARCH_CACHE_SIZE:
+            try:
+                _search_cache.popitem(last=False)
+            except KeyError:
+                break
+    return out
 
 
 @app.on_event("startup")
@@ -362,12 +527,14 @@ def _save(path: str, data: Dict[str, Any]):
     # write to local file
     with open(path, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=4)
+    _invalidate_for_path(path)
     # replicate to GitHub
     try:
         rel_path = os.path.relpath(path, BASE_DIR)
         # Normalise path separators for GitHub
         rel_path = rel_path.replace("\\", "/")
-        _github_file_write(rel_path, json.dumps(data, indent=4))
+        with span("github.mirror"):
+            _github_file_write(rel_path, json.dumps(data, indent=4))
     except Exception:
         # Fail silently if GitHub upload fails
         pass
@@ -482,6 +649,7 @@ def _update_minimal(broker: str, payload: Dict[str, Any]) -> str:
         try:
             if os.path.exists(old_path):
                 os.remove(old_path)
+                _invalidate_for_path(old_path)
         except Exception:
             pass
 
@@ -498,6 +666,18 @@ def _has_required_for_login(broker: str, c: Dict[str, Any]) -> bool:
         (c.get("totpkey") or "").strip()
     ))
 
+def _login_client(broker: str, client: Dict[str, Any]):
+    """Run the adapter's login for one client -> (ok, raw result)."""
+    mod_name = "Broker_dhan" if broker == "dhan" else "Broker_motilal"
+    mod = importlib.import_module(mod_name)
+    login_fn = getattr(mod, "login", None)
+    if not callable(login_fn):
+        raise RuntimeError(f"{mod_name}.login() not found")
+    result = login_fn(client)
+    # Dhan login returns a dict with token info, Motilal a bool
+    ok = bool(result if not isinstance(result, dict) else result.get("ok", True))
+    return ok, result
+
 def _dispatch_login(broker: str, path: str):
     try:
         client = _load(path)
@@ -506,17 +686,7 @@ def _dispatch_login(broker: str, path: str):
             print(f"[router] skip login ({broker}/{client.get('userid')}): missing fields")
             return
 
-        mod_name = "Broker_dhan" if broker == "dhan" else "Broker_motilal"
-        mod = importlib.import_module(mod_name)
-        login_fn = getattr(mod, "login", None)
-        if not callable(login_fn):
-            print(f"[router] {mod_name}.login() not found")
-            return
-
-        result = login_fn(client)
-
-        # NEW: handle dict returned by upgraded Dhan login
-        ok = bool(result if not isinstance(result, dict) else result.get("ok", True))
+        ok, result = _login_client(broker, client)
 
         if isinstance(result, dict):
             # persist token info so UI/endpoints can show it
@@ -544,6 +714,77 @@ def _dispatch_login(broker: str, path: str):
         print(f"[router] login error ({broker}): {e}")
 
 
+# --- Startup login warm-up ---
+# Every client saved with session_active is logged in (Motilal) or validated
+# (Dhan) once the startup GitHub sync-down has finished, a few at a time, so
+# the first order of the day finds a warm session instead of paying for TOTP
+# login on the trade path.
+LOGIN_WARMUP_CONCURRENCY = int(os.getenv("LOGIN_WARMUP_CONCURRENCY", "8"))
+_warmup: Dict[str, Any] = {"state": "pending", "started_at": None, "finished_at": None,
+                           "total": 0, "done": 0, "ok": 0, "failed": 0, "clients": {}}
+_warmup_lock = threading.Lock()
+
+def _warm_one(uid: str, rec: Dict[str, Any]) -> None:
+    t0 = time.perf_counter()
+    err = None
+    try:
+        ok, result = _login_client(rec["broker"], rec["json"])
+        if not ok and isinstance(result, dict):
+            err = result.get("message") or None
+    except Exception as e:
+        ok, err = False, str(e)
+    ms = round((time.perf_counter() - t0) * 1000, 1)
+    with _warmup_lock:
+        _warmup["clients"][uid] = {"broker": rec["broker"], "ok": ok, "login_ms": ms, "error": err}
+        _warmup["done"] += 1
+        _warmup["ok" if ok else "failed"] += 1
+    audit("router.login_warmup", uid=uid, broker=rec["broker"], ok=ok, login_ms=ms, error=err)
+
+def _session_targets() -> List[tuple]:
+    """(userid, broker, client json) for every client that should hold a live session."""
+    return [(uid, rec["broker"], rec["json"]) for uid, rec in _index_clients().items()
+            if rec["json"].get("session_active") and _has_required_for_login(rec["broker"], rec["json"])]
+
+def _login_warmup() -> None:
+    targets = [(uid, {"broker": brk, "json": cj}) for uid, brk, cj in _session_targets()]
+    with _warmup_lock:
+        _warmup.update({"state": "running", "started_at": time.time(), "finished_at": None,
+                        "total": len(targets), "done": 0, "ok": 0, "failed": 0, "clients": {}})
+    try:
+        if targets:
+            with ThreadPoolExecutor(max_workers=LOGIN_WARMUP_CONCURRENCY,
+                                    thread_name_prefix="login-warmup") as ex:
+                list(ex.map(lambda t: _warm_one(*t), targets))
+    finally:
+        with _warmup_lock:
+            _warmup.update({"state": "done", "finished_at": time.time()})
+        print(f"[router] login warm-up: {_warmup['ok']}/{_warmup['total']} ok, {_warmup['failed']} failed")
+        # from here on sessions are kept alive in the background
+        Session_keepalive.keepalive.configure(_session_targets)
+        Session_keepalive.keepalive.start()
+
+def _sync_then_warmup() -> None:
+    """Warm-up only after sync-down, so a fresh disk logs in the clients it pulled."""
+    try:
+        _github_sync_down_all()
+    finally:
+        _login_warmup()
+
+def login_warmup_stats(per_client: bool = False) -> Dict[str, Any]:
+    with _warmup_lock:
+        st = {k: v for k, v in _warmup.items() if k != "clients"}
+        lat = sorted(c["login_ms"] for c in _warmup["clients"].values())
+        if per_client:
+            st["clients"] = dict(_warmup["clients"])
+    st["ready"] = st["state"] == "done"
+    if lat:
+        st["login_ms_p50"] = lat[len(lat) // 2]
+        st["login_ms_max"] = lat[-1]
+    if st["started_at"]:
+        st["elapsed_s"] = round((st["finished_at"] or time.time()) - st["started_at"], 3)
+    return st
+
+
 def _delete_client_file(broker: str, userid: str) -> bool:
     """Remove a single client's JSON file. Returns True if deleted, False if it didn't exist."""
     broker = (broker or "").lower()
@@ -552,6 +793,7 @@ def _delete_client_file(broker: str, userid: str) -> bool:
     path = _path_for(broker, userid)
     try:
         os.remove(path)
+        _invalidate_for_path(path)
         # Remove from GitHub as well
         try:
             rel_path = os.path.relpath(path, BASE_DIR).replace("\\", "/")
@@ -567,6 +809,10 @@ def _delete_client_file(broker: str, userid: str) -> bool:
     
 
 def _list_groups() -> list[dict]:
+    """Saved groups (sanitized docs) from the group cache, sorted by name."""
+    return [dict(g["doc"]) for g in _group_cache()["list"]]
+
+def _scan_groups() -> list[dict]:
     items = []
     try:
         for fn in os.listdir(GROUPS_ROOT):
@@ -579,6 +825,7 @@ def _list_groups() -> list[dict]:
                 doc["name"] = doc.get("name") or doc["id"]
                 doc["multiplier"] = float(doc.get("multiplier", 1))
                 doc["members"] = doc.get("members") or []
+                doc["_path"] = os.path.join(GROUPS_ROOT, fn)
                 items.append(doc)
     except FileNotFoundError:
         pass
@@ -588,6 +835,9 @@ def _list_groups() -> list[dict]:
 
 def _find_group_path(id_or_name: str) -> str | None:
     """Find a group's json path by id or name (case-insensitive)."""
+    g = _group_lookup(id_or_name)
+    if g:
+        return g["path"]
     key = _safe(id_or_name)
     # direct filename hit
     p = os.path.join(GROUPS_ROOT, f"{key}.json")
@@ -655,6 +905,7 @@ def _set_copy_enabled(payload: Dict[str, Any], value: bool):
         # ensure id field is present/stable
         doc["id"] = doc.get("id") or os.path.splitext(os.path.basename(p))[0]
         _save(p, doc)
+        Copy_engine.engine.upsert_setup(doc)
         changed.append(doc["id"])
 
     return {"success": True, "changed": changed, "enabled": value}
@@ -705,7 +956,22 @@ def _build_multipliers(children: list[str], rawm) -> dict[str, float]:
 @app.on_event("startup")
 def _symbols_startup():
     _lazy_init_symbol_db()
-    _github_sync_down_all()  # <- add this line
+    # GitHub sync-down runs in the background; requests are served from the
+    # local files meanwhile and the caches are rebuilt when it finishes
+    threading.Thread(target=_sync_then_warmup, name="github-sync", daemon=True).start()
+    # flag legs a previous process journaled but never saw acked
+    threading.Thread(target=_journal_reconcile, name="journal-reconcile", daemon=True).start()
+
+@app.on_event("shutdown")
+async def _brokers_shutdown():
+    try:
+        await importlib.import_module("Broker_dhan").aclose()
+    except Exception:
+        pass
+    Session_keepalive.keepalive.stop()
+    Order_journal.flush()
+    Github_mirror.flush()
+    Audit_log.shutdown()
 
 @app.get("/health")
 def health():
@@ -718,7 +984,40 @@ def health():
             status[key] = "missing"
         except Exception as e:
             status[key] = f"error: {e}"
-    return {"ok": True, "brokers": status}
+    warmup = login_warmup_stats()
+    return {"ok": True, "ready": warmup["ready"], "brokers": status, "login_warmup": warmup,
+            "lanes": lanes(), "order_overhead": order_overhead_stats(),
+            "sessions": Session_keepalive.keepalive.stats(),
+            "circuits": Circuit_breaker.breakers.stats(),
+            "read_hedge": Read_hedge.stats(),
+            "rate_limit": Rate_limiter.stats(),
+            "github_mirror": Github_mirror.stats(), "github_sync": github_sync_stats()}
+
+@app.get("/circuits")
+def route_circuits():
+    """Broker and per-account circuit breakers (accounts listed once they have failed)."""
+    return Circuit_breaker.breakers.stats(per_client=True)
+
+@app.post("/circuits/reset")
+def route_circuits_reset(payload: Dict[str, Any] = Body(default={})):
+    """Close breakers now: all, one broker ({"broker"}) or one account ({"client_id"})."""
+    payload = payload or {}
+    broker = (_pick(payload.get("broker")) or "").lower() or None
+    client = _pick(payload.get("client_id"), payload.get("userid")) or None
+    n = Circuit_breaker.breakers.reset(broker, client)
+    audit("router.circuits.reset", broker=broker, client=client, reopened=n)
+    return {"closed": n, **Circuit_breaker.breakers.stats()}
+
+@app.get("/lanes")
+def lanes():
+    """Concurrency and queue-depth counters for the order and reporting lanes."""
+    out = {"orders": ORDER_LANE.stats(), "reports": REPORT_LANE.stats()}
+    try:
+        for lane, st in importlib.import_module("Broker_dhan").lane_stats().items():
+            out.setdefault(lane, {})["dhan_http"] = st
+    except Exception:
+        pass
+    return out
 
 @app.post("/add_client")
 def add_client(background_tasks: BackgroundTasks, payload: Dict[str, Any] = Body(...)):
@@ -747,6 +1046,9 @@ def edit_client(background_tasks: BackgroundTasks, payload: Dict[str, Any] = Bod
 
 
 @app.get("/clients")
+async def route_clients():
+    return await _run_in_lane(REPORT_LANE, clients_rows)
+
 def clients_rows():
     rows: List[Dict[str, Any]] = []
     for brk, folder in (("dhan", DHAN_DIR), ("motilal", MO_DIR)):
@@ -767,8 +1069,8 @@ def clients_rows():
     return rows
 
 @app.get("/get_clients")
-def get_clients_legacy():
-    rows = clients_rows()
+async def get_clients_legacy():
+    rows = await _run_in_lane(REPORT_LANE, clients_rows)
     return {"clients": [
         {"name": r["name"], "client_id": r["client_id"], "capital": r["capital"],
          "session": "Logged in" if r["session_active"] else "Logged out"}
@@ -951,6 +1253,7 @@ def delete_group(payload: Dict[str, Any] = Body(...)):
         if p and os.path.exists(p):
             try:
                 os.remove(p)
+                _invalidate_for_path(p)
                 # replicate delete to GitHub
                 try:
                     rel_path = os.path.relpath(p, BASE_DIR).replace("\\", "/")
@@ -1067,6 +1370,7 @@ def save_copytrading_setup(payload: Dict[str, Any] = Body(...)):
         path = _copy_path(setup_id)
 
     _save(path, doc)
+    Copy_engine.engine.upsert_setup(doc)
     return {"success": True, "mode": mode, "setup": doc}
 
 @app.post("/delete_copy_setup")
@@ -1090,6 +1394,7 @@ def delete_copy_setup(payload: Dict[str, Any] = Body(...)):
         if p and os.path.exists(p):
             try:
                 os.remove(p)
+                _invalidate_for_path(p)
                 try:
                     rel_path = os.path.relpath(p, BASE_DIR).replace("\\", "/")
                     _github_file_delete(rel_path)
@@ -1099,6 +1404,8 @@ def delete_copy_setup(payload: Dict[str, Any] = Body(...)):
             except Exception:
                 pass
 
+    for sid in deleted:
+        Copy_engine.engine.remove_setup(sid)
     return {"success": True, "deleted": deleted}
 
 # Optional compatibility alias if your UI ever calls this older name
@@ -1109,10 +1416,14 @@ def delete_copytrading_setup(payload: Dict[str, Any] = Body(...)):
 # put this helper near your other helpers
 def _guess_broker_from_order(order: Dict[str, Any]) -> str | None:
     """
-    Decide broker using order_id shape first (safest), then fall back to name.
+    Decide broker from the row's own `broker` (every book row carries it),
+    else order_id shape, then fall back to name.
     - Dhan orderId: digits only
     - Motilal uniqueorderid: alphanumeric (letters present)
     """
+    brk = _row_broker(order)
+    if brk:
+        return brk
     oid = str((order or {}).get("order_id", "")).strip()
     if oid.isdigit():
         return "dhan"
@@ -1122,6 +1433,11 @@ def _guess_broker_from_order(order: Dict[str, Any]) -> str | None:
     return _broker_by_client_name((order or {}).get("name"))
 
 
+def _row_broker(row: Dict[str, Any]) -> str | None:
+    """`broker` of a book row echoed back by the UI, if it names one we route to."""
+    brk = str((row or {}).get("broker") or "").strip().lower()
+    return brk if brk in ("dhan", "motilal") else None
+
 # ---- helper to locate which broker a name belongs to
 def _broker_by_client_name(name: str) -> str | None:
     if not name:
@@ -1144,27 +1460,58 @@ def _broker_by_client_name(name: str) -> str | None:
             pass
     return None
 
-@app.get('/get_orders')
-def route_get_orders():
-    from collections import OrderedDict
-    buckets = OrderedDict({k: [] for k in STAT_KEYS})
-    for brk in ('dhan','motilal'):
+def _broker_module(brk: str):
+    return importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
+
+def _with_incomplete(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Attach the clients that were skipped, timed out or failed fast, if any."""
+    rep = Req_deadline.report()
+    if rep:
+        body["incomplete"] = rep
+    return body
+
+async def _gather_brokers(fn_name: str, lane: _Lane) -> Dict[str, Any]:
+    """
+    Await <fn_name>() on both broker adapters concurrently.
+    Motilal runs its SDK calls on the given lane's executor; Dhan is pure async
+    and picks its own per-lane connection pool.
+    Returns {broker: result | Exception}; adapters without the coroutine are skipped.
+    Adapters get the cached client records, so no poll reads client files on the loop.
+    """
+    index = _cache["clients"]
+    if index is None:
+        index = await _run_in_lane(lane, _index_clients)
+    calls: Dict[str, Any] = {}
+    for brk in ("dhan", "motilal"):
         try:
-            mod = importlib.import_module('Broker_dhan' if brk=='dhan' else 'Broker_motilal')
-            fn = getattr(mod, 'get_orders', None)
+            fn = getattr(_broker_module(brk), fn_name, None)
             if callable(fn):
-                data = fn()
-                if isinstance(data, dict):
-                    for k in STAT_KEYS:
-                        buckets[k].extend(data.get(k, []) or [])
+                clients = [ci["json"] for ci in index.values() if ci["broker"] == brk]
+                calls[brk] = fn(executor=lane, clients=clients) if brk == "motilal" else fn(clients=clients)
         except Exception as e:
-            print(f"[router] get_orders error for {brk}: {e}")
-    return buckets
+            calls[brk] = e
+    keys = list(calls)
+    coros = [c for c in calls.values() if not isinstance(c, Exception)]
+    done = iter(await asyncio.gather(*coros, return_exceptions=True))
+    return {k: (calls[k] if isinstance(calls[k], Exception) else next(done)) for k in keys}
+
+@app.get('/get_orders')
+async def route_get_orders(request: Request):
+    buckets = OrderedDict({k: [] for k in STAT_KEYS})
+    for brk, data in (await _gather_brokers("get_orders_async", REPORT_LANE)).items():
+        if isinstance(data, Exception):
+            print(f"[router] get_orders error for {brk}: {data}")
+            continue
+        Book_models.merge_into(buckets, data)
+    return Response_codec.book(request, _with_incomplete(buckets), "order_book")
 
 
 
 @app.post("/cancel_order")
-def route_cancel_order(payload: Dict[str, Any] = Body(...)):
+async def route_cancel_order(payload: Dict[str, Any] = Body(...)):
+    return await _run_in_lane(ORDER_LANE, _cancel_order, payload)
+
+def _cancel_order(payload: Dict[str, Any]):
     orders = payload.get("orders", [])
     if not isinstance(orders, list) or not orders:
         raise HTTPException(status_code=400, detail="❌ No orders received for cancellation.")
@@ -1174,7 +1521,7 @@ def route_cancel_order(payload: Dict[str, Any] = Body(...)):
     unknown: List[str] = []
     for od in orders:
         name = (od or {}).get("name", "")
-        brk = _broker_by_client_name(name)
+        brk = _row_broker(od) or _broker_by_client_name(name)
         if brk in by_broker:
             by_broker[brk].append(od)
         else:
@@ -1282,24 +1629,21 @@ def route_cancel_order(payload: Dict[str, Any] = Body(...)):
 
 
 @app.get("/get_positions")
-def route_get_positions():
+async def route_get_positions(request: Request):
     """Merge positions from both brokers into {open:[...], closed:[...]}"""
     buckets = {"open": [], "closed": []}
-    for brk in ("dhan", "motilal"):
-        try:
-            mod = importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
-            fn  = getattr(mod, "get_positions", None)
-            if callable(fn):
-                res = fn()
-                if isinstance(res, dict):
-                    buckets["open"].extend(res.get("open", []) or [])
-                    buckets["closed"].extend(res.get("closed", []) or [])
-        except Exception as e:
-            print(f"[router] get_positions error for {brk}: {e}")
-    return buckets
+    for brk, res in (await _gather_brokers("get_positions_async", REPORT_LANE)).items():
+        if isinstance(res, Exception):
+            print(f"[router] get_positions error for {brk}: {res}")
+            continue
+        Book_models.merge_into(buckets, res)
+    return Response_codec.book(request, _with_incomplete(buckets), "positions")
 
 @app.post("/close_positions")
-def route_close_positions(payload: Dict[str, Any] = Body(...)):
+async def route_close_positions(payload: Dict[str, Any] = Body(...)):
+    return await _run_in_lane(ORDER_LANE, _close_positions, payload)
+
+def _close_positions(payload: Dict[str, Any]):
     """payload: { positions: [{ name, symbol }, ...] }"""
     items = payload.get("positions")
     if not isinstance(items, list):
@@ -1324,7 +1668,7 @@ def route_close_positions(payload: Dict[str, Any] = Body(...)):
 
     buckets = {"dhan": [], "motilal": []}
     for it in items:
-        brk = _which_broker((it or {}).get("name"))
+        brk = _row_broker(it) or _which_broker((it or {}).get("name"))
         if brk in buckets:
             buckets[brk].append(it)
 
@@ -1345,32 +1689,25 @@ def route_close_positions(payload: Dict[str, Any] = Body(...)):
 
     return {"message": messages}
 @app.get("/get_holdings")
-def route_get_holdings():
+async def route_get_holdings(request: Request):
     buckets = {"holdings": [], "summary": []}
-    for brk in ("dhan", "motilal"):
-        try:
-            mod = importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
-            fn  = getattr(mod, "get_holdings", None)
-            if callable(fn):
-                res = fn()
-                if isinstance(res, dict):
-                    buckets["holdings"].extend(res.get("holdings", []) or [])
-                    buckets["summary"].extend(res.get("summary", []) or [])
-        except Exception as e:
-            print(f"[router] get_holdings error for {brk}: {e}")
+    for brk, res in (await _gather_brokers("get_holdings_async", REPORT_LANE)).items():
+        if isinstance(res, Exception):
+            print(f"[router] get_holdings error for {brk}: {res}")
+            continue
+        Book_models.merge_into(buckets, res)
 
     # <-- keep your existing return, but also cache for /get_summary
     global summary_data_global
     # key by client name so get_summary can do .values()
-    summary_data_global = { (s.get("name") or f"client_{i}"): s
-                            for i, s in enumerate(buckets["summary"])
-                            if isinstance(s, dict) }
+    summary_data_global = { (s.name or f"client_{i}"): s
+                            for i, s in enumerate(buckets["summary"]) }
 
-    return buckets
+    return Response_codec.book(request, _with_incomplete(buckets), "holdings")
 
 @app.get("/get_summary")
 def get_summary():
-    return {"summary": list(summary_data_global.values())}
+    return {"summary": Book_models.dump(list(summary_data_global.values()))}
 
 def _safe_int(val, default=0):
     try:
@@ -1405,11 +1742,559 @@ def _pick_qty_for_client(ci: dict, per_client_qty: dict, default_qty: int) -> in
     return default_qty
 
 
+# --- Order journal acks ---
+def _journal_acks(request_id: str, dispatch: Dict[str, List[Dict[str, Any]]],
+                  results: Dict[str, Any]) -> None:
+    """Match each dispatched leg to its broker response and journal the ack."""
+    acks: List[Dict[str, Any]] = []
+    for brk, lst in dispatch.items():
+        res = results.get(brk) or {}
+        responses = res.get("order_responses") if isinstance(res, dict) else None
+        for od in lst:
+            uid, tag = od.get("client_id"), od.get("tag") or ""
+            resp = None
+            if isinstance(responses, dict):
+                resp = responses.get(f"{tag}:{uid}", responses.get(uid))
+            if resp is None:
+                resp = res  # whole-broker failure: the error is the ack
+            order_id = None
+            if isinstance(resp, dict):
+                order_id = (resp.get("orderId") or resp.get("uniqueorderid")
+                            or resp.get("UniqueOrderID") or resp.get("order_id"))
+            acks.append({
+                "cid": od.get("correlation_id"), "broker": brk, "uid": uid,
+                "ok": bool(order_id), "order_id": order_id, "response": resp,
+            })
+    Order_journal.record_acks(request_id, acks)
+
+def _journal_intent(request_id: str, legs: List[Dict[str, Any]]) -> Optional[bool]:
+    for od in legs:
+        if od.get("broker") == "motilal":
+            # Motilal legs carry lots; the journal needs the lot size to match shares
+            od["lot_size"] = _min_qty_for(od.get("security_id") or "")
+    return Order_journal.record_intent(request_id, legs)
+
+def _journal_order_book(brk: str, client_id: str):
+    return _broker_module(brk).raw_order_book(client_id)
+
+def _journal_reconcile() -> None:
+    try:
+        rep = Order_journal.reconcile(_journal_order_book)
+        audit("router.journal.reconcile", summary=rep.get("summary"))
+    except Exception as e:
+        print(f"[router] journal reconcile failed: {e}")
+
+@app.get("/journal")
+def route_journal():
+    return {"stats": Order_journal.stats(), "reconcile": Order_journal.last_reconcile()}
+
+@app.post("/journal/reconcile")
+async def route_journal_reconcile():
+    await _run_in_lane(REPORT_LANE, _journal_reconcile)
+    return Order_journal.last_reconcile()
+
+@app.get("/login_warmup")
+def route_login_warmup():
+    """Startup warm-up progress with per-client login latency."""
+    st = login_warmup_stats(per_client=True)
+    try:
+        st["motilal_session_store"] = importlib.import_module("Broker_motilal").session_store_stats()
+    except Exception:
+        pass
+    return st
+
+@app.get("/sessions")
+def route_sessions():
+    """Keep-alive health per client: last check, action taken, token expiry, relogins."""
+    out = Session_keepalive.keepalive.stats(per_client=True)
+    try:
+        out["motilal_sessions"] = importlib.import_module("Broker_motilal").session_stats()
+    except Exception:
+        pass
+    return out
+
+@app.post("/sessions/check")
+def route_sessions_check(payload: Dict[str, Any] = Body(...)):
+    """Run the keep-alive check for one client now: { client_id }."""
+    uid = str(payload.get("client_id") or "").strip()
+    rec = _index_clients().get(uid)
+    if not rec:
+        raise HTTPException(status_code=404, detail="client not found")
+    return Session_keepalive.keepalive.check(uid, rec["broker"], rec["json"])
+
+@app.get("/github_mirror")
+def route_github_mirror():
+    """Replication queue for client/group/setup files: pending paths, lag, retry state."""
+    return {**Github_mirror.stats(), "paths": Github_mirror.pending_paths()}
+
+
+# --- Order building helpers (shared by /place_orders and the copy engine) ---
+# --- Client / group cache ---
+# Order paths never touch the client or group files: both are loaded once and
+# rebuilt eagerly whenever the router writes or deletes one of those files
+# (_save, deletes, GitHub sync-down all go through _invalidate_for_path).
+# Groups are kept pre-expanded to resolved client records.
+_cache_lock = threading.RLock()
+_cache: Dict[str, Any] = {"clients": None, "groups": None}
+
+def _scan_clients() -> Dict[str, Dict[str, Any]]:
+    idx: Dict[str, Dict[str, Any]] = {}
+    for brk, folder in (("dhan", os.path.join(BASE_DIR, "clients", "dhan")),
+                        ("motilal", os.path.join(BASE_DIR, "clients", "motilal"))):
+        try:
+            for fn in os.listdir(folder):
+                if not fn.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(folder, fn), "r", encoding="utf-8") as f:
+                        cj = json.load(f)
+                except Exception:
+                    continue
+                uid = str(cj.get("userid") or cj.get("client_id") or "").strip()
+                if uid:
+                    idx[uid] = {
+                        "broker": brk,
+                        "json": cj,
+                        "name": cj.get("name") or cj.get("display_name") or uid,
+                    }
+        except FileNotFoundError:
+            continue
+    return idx
+
+def _member_ids(doc: Dict[str, Any]) -> List[str]:
+    out: List[str] = []
+    raw = (doc.get("members") or doc.get("clients") or [])
+    for m in raw:
+        if isinstance(m, dict):
+            uid = str(m.get("userid") or m.get("client_id") or m.get("id") or "").strip()
+        else:
+            uid = str(m).strip()
+        if uid and uid not in out:
+            out.append(uid)
+    return out
+
+def _build_group_model(clients: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    by_key: Dict[str, Dict[str, Any]] = {}
+    items: List[Dict[str, Any]] = []
+    for doc in _scan_groups():
+        path = doc.pop("_path")
+        multiplier = doc.get("multiplier", 1) or 1
+        g = {
+            "id": doc["id"],
+            "name": doc["name"],
+            "path": path,
+            "doc": doc,
+            "lot_multiplier": int(multiplier),
+            # (userid, client record or None) in member order
+            "members": [(uid, clients.get(uid)) for uid in _member_ids(doc)],
+        }
+        items.append(g)
+        for k in (doc["id"], _safe(doc["id"]), os.path.splitext(os.path.basename(path))[0], doc["name"]):
+            by_key.setdefault(str(k).strip().lower(), g)
+    return {"list": items, "by_key": by_key}
+
+def _index_clients() -> Dict[str, Dict[str, Any]]:
+    """userid -> {broker, json, name} for every saved client (cached)."""
+    idx = _cache["clients"]
+    Metrics.cache_hit("clients", idx is not None)
+    if idx is None:
+        with _cache_lock:
+            if _cache["clients"] is None:
+                _cache["clients"] = _scan_clients()
+            idx = _cache["clients"]
+    return idx
+
+def _group_cache() -> Dict[str, Any]:
+    model = _cache["groups"]
+    Metrics.cache_hit("groups", model is not None)
+    if model is None:
+        with _cache_lock:
+            if _cache["groups"] is None:
+                _cache["groups"] = _build_group_model(_index_clients())
+            model = _cache["groups"]
+    return model
+
+def _group_lookup(id_or_name: str) -> Optional[Dict[str, Any]]:
+    """Pre-expanded group by id, file name or name (case-insensitive)."""
+    by_key = _group_cache()["by_key"]
+    key = str(id_or_name or "").strip()
+    return (by_key.get(key.lower()) or by_key.get(_safe(key).lower())
+            or by_key.get(key.replace(" ", "_").lower()))
+
+def _invalidate_for_path(path: str) -> None:
+    """Rebuild whatever cache a written/deleted file belongs to."""
+    rel = os.path.relpath(os.path.abspath(path), BASE_DIR).replace("\\", "/")
+    if rel.startswith("clients/"):
+        _refresh_cache(clients=True)
+    elif rel.startswith("groups/"):
+        _refresh_cache(clients=False)
+
+def _refresh_cache(clients: bool = True) -> None:
+    with _cache_lock:
+        if clients or _cache["clients"] is None:
+            _cache["clients"] = _scan_clients()
+        _cache["groups"] = _build_group_model(_cache["clients"])
+    if clients:
+        Copy_engine.engine.refresh_clients()
+
+def _normalize_col(name: str) -> str:
+    # "Security ID" -> "securityid", "Min qty" -> "minqty"
+    return "".join(ch for ch in str(name).lower() if ch.isalnum())
+
+def _get_min_qty_map() -> Dict[str, int]:
+    """Cache CSV -> {security_id: min_qty} on first call. Robust to header variants."""
+    if hasattr(_get_min_qty_map, "_cache"):
+        Metrics.cache_hit("min_qty", True)
+        return _get_min_qty_map._cache  # type: ignore[attr-defined]
+    Metrics.cache_hit("min_qty", False)
+
+    cache: Dict[str, int] = {}
+
+    masters  = os.path.join(BASE_DIR, "masters")
+    candidates = [
+        os.environ.get("SECURITY_MIN_QTY_CSV"),
+        os.path.join(masters, "security_id_min_qty.csv"),
+        os.path.join(masters, "security_id.csv"),
+        os.path.join(BASE_DIR, "security_id_min_qty.csv"),
+        os.path.join(BASE_DIR, "security_id.csv"),
+        os.path.join(BASE_DIR, "security_master.csv"),
+        os.path.join(BASE_DIR, "security_ids.csv"),
+    ]
+    candidates = [p for p in candidates if p]
+
+    for path in candidates:
+        try:
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                rdr = csv.DictReader(f)
+                for row in rdr:
+                    nrow = { _normalize_col(k): v for k, v in row.items() }
+                    sid = (
+                        nrow.get("securityid") or nrow.get("security_id")
+                        or nrow.get("id") or nrow.get("token")
+                        or nrow.get("symboltoken") or ""
+                    )
+                    sid = str(sid).strip()
+                    if not sid:
+                        continue
+                    raw_mq = (
+                        nrow.get("minqty") or nrow.get("minquantity")
+                        or nrow.get("lotsize") or nrow.get("tradinglot")
+                        or nrow.get("marketlot") or nrow.get("minorderqty")
+                        or "1"
+                    )
+                    try:
+                        cache[sid] = max(1, int(float(str(raw_mq).strip())))
+                    except Exception:
+                        cache[sid] = 1
+            break
+        except Exception:
+            continue
+
+    _get_min_qty_map._cache = cache  # type: ignore[attr-defined]
+    return cache
+
+def _min_qty_for(security_id_val: str) -> int:
+    """Try user-provided helpers first, then CSV map, default=1."""
+    if not security_id_val:
+        return 1
+    for fname in ("_lookup_min_qty_sqlite", "_lookup_min_qty", "_lookup_min_qty_csv"):
+        fn = globals().get(fname)
+        if callable(fn):
+            try:
+                v = fn(str(security_id_val))
+                if v:
+                    return max(1, int(v))
+            except Exception:
+                pass
+    return int(_get_min_qty_map().get(str(security_id_val), 1))
+
+
+# --- Router overhead per order ---
+# Time spent in route_place_orders from request entry to broker dispatch
+# (parsing, client lookup, template build), divided by the legs dispatched.
+_order_overhead_lock = threading.Lock()
+_order_overhead = {"requests": 0, "orders": 0, "total_us": 0.0, "last_us_per_order": 0.0, "max_us_per_order": 0.0}
+
+def _record_order_overhead(elapsed_s: float, n_orders: int) -> None:
+    if n_orders <= 0:
+        return
+    per_order = elapsed_s * 1e6 / n_orders
+    with _order_overhead_lock:
+        st = _order_overhead
+        st["requests"] += 1
+        st["orders"] += n_orders
+        st["total_us"] += elapsed_s * 1e6
+        st["last_us_per_order"] = per_order
+        st["max_us_per_order"] = max(st["max_us_per_order"], per_order)
+
+def order_overhead_stats() -> Dict[str, Any]:
+    with _order_overhead_lock:
+        st = dict(_order_overhead)
+    st["avg_us_per_order"] = round(st["total_us"] / st["orders"], 1) if st["orders"] else 0.0
+    st["total_us"] = round(st["total_us"], 1)
+    st["last_us_per_order"] = round(st["last_us_per_order"], 1)
+    st["max_us_per_order"] = round(st["max_us_per_order"], 1)
+    return st
+
+@app.get("/audit")
+def route_audit_stats():
+    return Audit_log.stats()
+
+
+# --- Prometheus metrics ---
+# Counters and histograms are written inline (Metrics, lock-free per-thread
+# shards); everything below is read from existing stats at scrape time.
+def _lane_gauges(field: str) -> Dict[str, Any]:
+    return {"orders": ORDER_LANE.stats()[field], "reports": REPORT_LANE.stats()[field]}
+
+def _mo_sessions() -> Dict[str, Any]:
+    return importlib.import_module("Broker_motilal")._sessions.stats()
+
+def _mo_sdk_queue() -> int:
+    return importlib.import_module("Broker_motilal")._sdk_pool._work_queue.qsize()
+
+def _dhan_inflight() -> Dict[str, Any]:
+    return {lane: st["inflight"] for lane, st in importlib.import_module("Broker_dhan").lane_stats().items()}
+
+Metrics.gauge("router_lane_queued", "Tasks waiting for a lane worker.", lambda: _lane_gauges("queued"), ("lane",))
+Metrics.gauge("router_lane_running", "Tasks running on a lane.", lambda: _lane_gauges("running"), ("lane",))
+Metrics.gauge("router_lane_workers", "Worker cap per lane.", lambda: _lane_gauges("workers"), ("lane",))
+Metrics.gauge("dhan_http_inflight", "In-flight Dhan HTTP requests per lane.", _dhan_inflight, ("lane",))
+Metrics.gauge("motilal_sdk_queue_depth", "Calls waiting for the Motilal SDK pool.", _mo_sdk_queue)
+Metrics.gauge("motilal_session_pool_size", "Live Motilal SDK sessions.", lambda: _mo_sessions()["size"])
+Metrics.gauge("motilal_session_pool_max", "Motilal session pool cap.", lambda: _mo_sessions()["max_size"])
+Metrics.gauge("motilal_session_events_total", "Motilal session pool lookups, logins and evictions.",
+              lambda: {k: v for k, v in _mo_sessions().items()
+                       if k in ("hits", "misses", "logins", "login_failures", "deduplicated",
+                                "evicted_lru", "evicted_idle")}, ("event",), kind="counter")
+Metrics.gauge("audit_queue_depth", "Audit events waiting for the writer.", lambda: Audit_log.stats()["queued"])
+Metrics.gauge("journal_queue_depth", "Journal records waiting for a commit.", lambda: Order_journal.stats()["pending"])
+Metrics.gauge("github_mirror_pending", "Files waiting to be mirrored to GitHub.", lambda: Github_mirror.stats()["pending"])
+Metrics.gauge("clients_cached", "Client records in the router cache.", lambda: len(_cache["clients"] or {}))
+Metrics.gauge("symbol_search_cache_size", "Cached symbol search results.", lambda: len(_search_cache))
+
+@app.get("/metrics")
+def route_metrics():
+    return PlainTextResponse(Metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# --- Admin diagnostics (profiling, memory, threads) ---
+# Disabled unless ADMIN_TOKEN is set; callers send it as X-Admin-Token.
+# Every profile is time-boxed (Profiler.PROFILE_MAX_S) and only one runs at
+# a time, so these are safe to hit on the live router.
+ADMIN_TOKEN = (os.getenv("ADMIN_TOKEN") or "").strip()
+
+def _require_admin(token: Optional[str]) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="admin endpoints disabled (ADMIN_TOKEN not set)")
+    if not token or not hmac.compare_digest(token.strip(), ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="bad admin token")
+
+@app.get("/debug/profile")
+async def route_debug_profile(seconds: float = Query(5.0), mode: str = Query("sample"),
+                              interval_ms: float = Query(5.0), top: int = Query(30),
+                              sort: str = Query("cumulative"),
+                              x_admin_token: Optional[str] = Header(None)):
+    """
+    mode=sample   : stack sampler over every thread (lanes, SDK pool, loop)
+    mode=cprofile : deterministic cProfile of the event-loop thread
+    """
+    _require_admin(x_admin_token)
+    audit("router.debug.profile", mode=mode, seconds=seconds)
+    try:
+        if mode == "cprofile":
+            prof = Profiler.CpuProfile()
+            prof.start()
+            try:
+                await asyncio.sleep(min(max(0.1, seconds), Profiler.PROFILE_MAX_S))
+            finally:
+                out = prof.stop(top=top, sort=sort)
+            return out
+        return await asyncio.to_thread(Profiler.sample, seconds, interval_ms, top)
+    except Profiler.Busy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/debug/memory")
+def route_debug_memory(x_admin_token: Optional[str] = Header(None)):
+    _require_admin(x_admin_token)
+    return Profiler.memory_status()
+
+@app.post("/debug/memory/start")
+def route_debug_memory_start(payload: Dict[str, Any] = Body(default={}),
+                             x_admin_token: Optional[str] = Header(None)):
+    _require_admin(x_admin_token)
+    payload = payload or {}
+    audit("router.debug.memory_start", **payload)
+    return Profiler.memory_start(int(payload.get("nframes") or 10), float(payload.get("stop_after_s") or 600))
+
+@app.get("/debug/memory/snapshot")
+def route_debug_memory_snapshot(top: int = Query(25), group_by: str = Query("lineno"),
+                                x_admin_token: Optional[str] = Header(None)):
+    """Top allocation sites; after the first call also the growth since the previous one."""
+    _require_admin(x_admin_token)
+    return Profiler.memory_snapshot(top=top, group_by=group_by)
+
+@app.post("/debug/memory/stop")
+def route_debug_memory_stop(x_admin_token: Optional[str] = Header(None)):
+    _require_admin(x_admin_token)
+    return Profiler.memory_stop()
+
+@app.get("/debug/threads")
+def route_debug_threads(collapse: bool = Query(True), x_admin_token: Optional[str] = Header(None)):
+    _require_admin(x_admin_token)
+    return Profiler.threads(collapse=collapse)
+
+@app.post("/audit/level")
+def route_audit_level(payload: Dict[str, Any] = Body(...)):
+    try:
+        return {"level": Audit_log.set_level(str((payload or {}).get("level") or ""))}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/order_overhead")
+def route_order_overhead():
+    return order_overhead_stats()
+
+
+async def _dispatch_legs(by_broker: Dict[str, List[Dict[str, Any]]], correlation_id: str = "",
+                         t_start: Optional[float] = None,
+                         label: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Journal and fan out router order legs to both brokers concurrently.
+    Returns {broker: adapter result} for every broker that had legs.
+    """
+    # every leg gets its own correlation id so the journal (and Dhan's order
+    # book) can tell legs apart; the caller's id, if any, is the common prefix
+    dispatch = {brk: lst for brk, lst in by_broker.items() if lst}
+    request_id = Order_journal.new_request_id(correlation_id)
+    legs = [od for lst in dispatch.values() for od in lst]
+    for i, od in enumerate(legs):
+        od["correlation_id"] = Order_journal.leg_id(request_id, i)
+    with span("journal.intent"):
+        committed = not legs or await _run_in_lane(ORDER_LANE, _journal_intent, request_id, legs)
+    if committed is None:
+        audit("router.journal.slow", req=request_id, legs=len(legs))
+    elif not committed:
+        # no durable intent means no crash recovery for these legs: don't send them
+        audit("router.journal.failed", level="error", req=request_id, legs=len(legs))
+        msg = "order journal write failed; orders not sent"
+        return {brk: {"status": "error", "message": msg} for brk in dispatch}
+
+    for brk, lst in dispatch.items():
+        FANOUT_LEGS.observe(len(lst), brk)
+        audit("router.place_orders.dispatch", req=request_id, broker=brk, count=len(lst), **(label or {}))
+        if Audit_log.enabled("debug"):
+            audit("router.place_orders.batch", level="debug", broker=brk, orders=lst)
+
+    if t_start is not None:
+        _record_order_overhead(time.perf_counter() - t_start, len(legs))
+
+    # hand the adapters the cached client records so nothing is read from disk
+    index = _index_clients()
+
+    async def _place(brk: str, lst: List[Dict[str, Any]]):
+        try:
+            fn = getattr(_broker_module(brk), "place_orders_async", None)
+            if not callable(fn):
+                return {"status": "error", "message": "place_orders not implemented"}
+            clients = {od["client_id"]: index[od["client_id"]]["json"]
+                       for od in lst if od.get("client_id") in index}
+            with span(f"{brk}.dispatch"):
+                if brk == "motilal":
+                    return await fn(lst, executor=ORDER_LANE, clients=clients)
+                return await fn(lst, clients=clients)
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    # both brokers fan out at the same time; no module reload here, it would
+    # drop the adapters' warm sessions and connection pools on every order
+    placed = await asyncio.gather(*[_place(brk, lst) for brk, lst in dispatch.items()])
+    results: Dict[str, Any] = dict(zip(dispatch.keys(), placed))
+    _journal_acks(request_id, dispatch, results)
+    return results
+
+
+# --- Copy-trading engine wiring ---
+_copy_loop: Dict[str, Any] = {"loop": None}
+
+def _copy_setups() -> List[Dict[str, Any]]:
+    return list_copytrading_setups()["setups"]
+
+def _copy_dispatch(by_broker: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """Called on copy-engine threads: run the dispatcher on the server loop and wait."""
+    loop = _copy_loop["loop"]
+    if loop is None:
+        raise RuntimeError("server loop not ready")
+    cid = Copy_engine.COPY_PREFIX + uuid.uuid4().hex[:10]
+    fut = asyncio.run_coroutine_threadsafe(
+        _dispatch_legs(by_broker, cid, label={"copy": True}), loop)
+    return fut.result(timeout=60)
+
+@app.on_event("startup")
+async def _copy_engine_startup():
+    _copy_loop["loop"] = asyncio.get_running_loop()
+    Copy_engine.engine.configure(_copy_setups, _index_clients, _copy_dispatch, _min_qty_for)
+    # watcher start-up touches broker sessions; keep it off the loop
+    await _run_in_lane(REPORT_LANE, Copy_engine.engine.start)
+
+@app.on_event("shutdown")
+def _copy_engine_shutdown():
+    Copy_engine.engine.stop()
+
+@app.get("/copy/stats")
+def route_copy_stats():
+    return Copy_engine.engine.stats()
+
+@app.get("/stream/master_orders")
+async def stream_master_orders(client_id: str = Query(...)):
+    """Server-sent events for new/changed orders of a Dhan account (master poller)."""
+    ci = _index_clients().get(str(client_id).strip())
+    if not ci or ci["broker"] != "dhan":
+        raise HTTPException(status_code=400, detail="client_id must be a Dhan client")
+
+    loop = asyncio.get_running_loop()
+    q: asyncio.Queue = asyncio.Queue(maxsize=1000)
+
+    def _offer(ev):
+        if not q.full():
+            q.put_nowait(ev)
+
+    unsubscribe = _broker_module("dhan").subscribe_orders(
+        client_id, lambda ev: loop.call_soon_threadsafe(_offer, ev))
+
+    async def _events():
+        try:
+            while True:
+                try:
+                    ev = await asyncio.wait_for(q.get(), timeout=15)
+                    yield f"data: {json.dumps(ev, default=str)}\n\n"
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            unsubscribe()
+
+    return StreamingResponse(_events(), media_type="text/event-stream")
+
+@app.get("/stream/pollers")
+def stream_pollers():
+    return _broker_module("dhan").poller_stats()
+
+
 @app.post("/place_orders")
-def route_place_orders(payload: Dict[str, Any] = Body(...)):
-    import importlib, os, json, csv
-    from typing import Optional, Dict, Any, List
+async def route_place_orders(payload: Dict[str, Any] = Body(...)):
+    t_start = time.perf_counter()
+    # master lookups, client files and lot sizes block: build the legs on the
+    # order lane and keep only the broker fan-out on the loop
+    by_broker, skipped, correlation_id, label = await _run_in_lane(ORDER_LANE, _build_place_legs, payload)
+    results = await _dispatch_legs(by_broker, correlation_id, t_start=t_start, label=label)
+    results = {"skipped": skipped, **results}
+    return {"status": "completed", "result": results}
 
+def _build_place_legs(payload: Dict[str, Any]) -> Tuple[Dict[str, List[Dict[str, Any]]], List[Dict[str, Any]],
+                                                        str, Dict[str, Any]]:
+    """Expand one /place_orders payload into (legs by broker, skipped, correlation id, audit label)."""
     data = payload or {}
 
     # ------------------- robust symbol parsing -------------------
@@ -1475,170 +2360,59 @@ def route_place_orders(payload: Dict[str, Any] = Body(...)):
         raise HTTPException(status_code=400, detail="Trigger price is required for SL/SL-M orders.")
 
     # ------------------- client index (userid -> broker/name/json) -------------------
-    BASE_DIR   = os.path.abspath(os.environ.get("DATA_DIR", "./data"))
-    DHAN_DIR   = os.path.join(BASE_DIR, "clients", "dhan")
-    MO_DIR     = os.path.join(BASE_DIR, "clients", "motilal")
-    GROUPS_DIR = os.path.join(BASE_DIR, "groups")
-
-    def _index_clients() -> Dict[str, Dict[str, Any]]:
-        idx: Dict[str, Dict[str, Any]] = {}
-        for brk, folder in (("dhan", DHAN_DIR), ("motilal", MO_DIR)):
-            try:
-                for fn in os.listdir(folder):
-                    if not fn.endswith(".json"):
-                        continue
-                    with open(os.path.join(folder, fn), "r", encoding="utf-8") as f:
-                        cj = json.load(f)
-                    uid = str(cj.get("userid") or cj.get("client_id") or "").strip()
-                    if uid:
-                        idx[uid] = {
-                            "broker": brk,
-                            "json": cj,
-                            "name": cj.get("name") or cj.get("display_name") or uid,
-                        }
-            except FileNotFoundError:
-                continue
-        return idx
-
-    client_index = _index_clients()
+    with span("clients.index"):
+        client_index = _index_clients()
 
     # ------------------- qty calc helper -------------------
     def _auto_qty_fallback(_client_id: str, _price: float) -> int:
         return quantityinlot
 
-    # ------------------- min-qty lookup helpers (CSV + optional globals) -------------------
-    def _normalize_col(name: str) -> str:
-        # "Security ID" -> "securityid", "Min qty" -> "minqty"
-        return "".join(ch for ch in str(name).lower() if ch.isalnum())
-
-    def _get_min_qty_map() -> Dict[str, int]:
-        """Cache CSV -> {security_id: min_qty} on first call. Robust to header variants."""
-        if hasattr(_get_min_qty_map, "_cache"):
-            return _get_min_qty_map._cache  # type: ignore[attr-defined]
-
-        cache: Dict[str, int] = {}
-
-        masters  = os.path.join(BASE_DIR, "masters")
-        candidates = [
-            os.environ.get("SECURITY_MIN_QTY_CSV"),
-            os.path.join(masters, "security_id_min_qty.csv"),
-            os.path.join(masters, "security_id.csv"),
-            os.path.join(BASE_DIR, "security_id_min_qty.csv"),
-            os.path.join(BASE_DIR, "security_id.csv"),
-            os.path.join(BASE_DIR, "security_master.csv"),
-            os.path.join(BASE_DIR, "security_ids.csv"),
-        ]
-        candidates = [p for p in candidates if p]
-
-        for path in candidates:
-            try:
-                if not os.path.exists(path):
-                    continue
-                with open(path, "r", encoding="utf-8") as f:
-                    rdr = csv.DictReader(f)
-                    for row in rdr:
-                        nrow = { _normalize_col(k): v for k, v in row.items() }
-                        sid = (
-                            nrow.get("securityid") or nrow.get("security_id")
-                            or nrow.get("id") or nrow.get("token")
-                            or nrow.get("symboltoken") or ""
-                        )
-                        sid = str(sid).strip()
-                        if not sid:
-                            continue
-                        raw_mq = (
-                            nrow.get("minqty") or nrow.get("minquantity")
-                            or nrow.get("lotsize") or nrow.get("tradinglot")
-                            or nrow.get("marketlot") or nrow.get("minorderqty")
-                            or "1"
-                        )
-                        try:
-                            cache[sid] = max(1, int(float(str(raw_mq).strip())))
-                        except Exception:
-                            cache[sid] = 1
-                break
-            except Exception:
-                continue
-
-        _get_min_qty_map._cache = cache  # type: ignore[attr-defined]
-        return cache
-
-    def _min_qty_for(security_id_val: str) -> int:
-        """Try user-provided helpers first, then CSV map, default=1."""
-        if not security_id_val:
-            return 1
-        for fname in ("_lookup_min_qty_sqlite", "_lookup_min_qty", "_lookup_min_qty_csv"):
-            fn = globals().get(fname)
-            if callable(fn):
-                try:
-                    v = fn(str(security_id_val))
-                    if v:
-                        return max(1, int(v))
-                except Exception:
-                    pass
-        return int(_get_min_qty_map().get(str(security_id_val), 1))
-
     # ------------------- make one order row -------------------
+    # Common fields are normalized once per request; each leg only stamps
+    # its client id, name, broker, qty and tag onto a copy.
+    common: Dict[str, Any] = {
+        "action": action,
+        "ordertype": ordertype,
+        "producttype": producttype,
+        "orderduration": orderduration,
+        "exchange": exchange_val,
+        "price": price,
+        "triggerprice": triggerprice,
+        "disclosedquantity": disclosedqty,
+        "amoorder": amoorder,
+        "correlation_id": correlation_id,
+        "symbol": raw_symbol,
+        "security_id": str(security_id or ""),   # Dhan
+        "symboltoken": str(symboltoken or ""),   # Motilal
+        "stock_symbol": stock_symbol,
+    }
+
     def _build_order(client_id: str, qty: int, tag: Optional[str]) -> Dict[str, Any]:
         ci = client_index.get(str(client_id))
         if not ci:
             return {"_skip": True, "reason": "client_not_found", "client_id": client_id}
-        return {
-            "client_id": str(client_id),
-            "name": ci["name"],
-            "broker": ci["broker"],
-            "action": action,
-            "ordertype": ordertype,
-            "producttype": producttype,
-            "orderduration": orderduration,
-            "exchange": exchange_val,
-            "price": price,
-            "triggerprice": triggerprice,
-            "disclosedquantity": disclosedqty,
-            "amoorder": amoorder,
-            "qty": int(qty),  # front-end qty
-            "tag": tag or "",
-            "correlation_id": correlation_id,
-            "symbol": raw_symbol,
-            "security_id": str(security_id or ""),   # Dhan
-            "symboltoken": str(symboltoken or ""),   # Motilal
-            "stock_symbol": stock_symbol,
-        }
+        od = dict(common)
+        od["client_id"] = str(client_id)
+        od["name"] = ci["name"]
+        od["broker"] = ci["broker"]
+        od["qty"] = int(qty)  # front-end qty
+        od["tag"] = tag or ""
+        return od
 
     # ------------------- expand to per-client orders -------------------
     per_client_orders: List[Dict[str, Any]] = []
 
     if groupacc:
-        def _member_ids(doc: Dict[str, Any]) -> List[str]:
-            out: List[str] = []
-            raw = (doc.get("members") or doc.get("clients") or [])
-            for m in raw:
-                if isinstance(m, dict):
-                    uid = (m.get("userid") or m.get("client_id") or m.get("id") or "").strip()
-                else:
-                    uid = str(m).strip()
-                if uid and uid not in out:
-                    out.append(uid)
-            return out
-
         for gsel in groups:
-            gp = (globals().get("_find_group_path")(gsel)
-                  or os.path.join(GROUPS_DIR, f"{str(gsel).replace(' ', '_')}.json"))
-            if not gp or not os.path.exists(gp):
+            g = _group_lookup(gsel)
+            if not g:
                 per_client_orders.append({"_skip": True, "reason": f"group_file_missing:{gsel}"})
                 continue
 
-            try:
-                with open(gp, "r", encoding="utf-8") as f:
-                    gdoc = json.load(f) or {}
-            except Exception:
-                per_client_orders.append({"_skip": True, "reason": f"group_file_bad:{gsel}"})
-                continue
-
-            gname = gdoc.get("name") or gdoc.get("id") or str(gsel)
-            gkey  = gdoc.get("id") or gname
-            members = _member_ids(gdoc)
-            group_multiplier = int(gdoc.get("multiplier", 1) or 1)
+            gname = g["name"] or g["id"] or str(gsel)
+            gkey  = g["id"] or gname
+            members = [uid for uid, _ in g["members"]]
+            group_multiplier = g["lot_multiplier"]
 
             for client_id in members:
                 if qtySelection == "auto":
@@ -1673,56 +2447,33 @@ def route_place_orders(payload: Dict[str, Any] = Body(...)):
 
     # ------------------- DHAN: multiply qty by min_qty -------------------
     if by_broker.get("dhan"):
-        for od in by_broker["dhan"]:
-            try:
-                sid = od.get("security_id") or ""
-                minq = _min_qty_for(sid) if sid else 1
-                old_q = int(od.get("qty", 0))
-                new_q = old_q * max(1, int(minq))
-                od["qty"] = new_q
-                print(f"[router] DHAN lot-size applied: sid={sid} min_qty={minq} qty:{old_q} -> {new_q}")
-            except Exception:
-                od["qty"] = int(od.get("qty", 0))
-
-    # ------------------- print & dispatch -------------------
-    try:
-        if by_broker.get("dhan"):
-            print(f"[router] DHAN orders ({len(by_broker['dhan'])}) ->")
-            print(json.dumps(by_broker["dhan"], indent=2))
-        if by_broker.get("motilal"):
-            print(f"[router] MOTILAL orders ({len(by_broker['motilal'])}) ->")
-            print(json.dumps(by_broker["motilal"], indent=2))
-    except Exception:
-        pass
-
-    results: Dict[str, Any] = {"skipped": skipped}
-    for brk in ("dhan", "motilal"):
-        lst = by_broker.get(brk, [])
-        if not lst:
-            continue
-        try:
-            print(f"[router] dispatching {len(lst)} orders to {brk}...")
-            modname = "Broker_dhan" if brk == "dhan" else "Broker_motilal"
-            mod = importlib.import_module(modname)
-            try:
-                mod = importlib.reload(mod)
-            except Exception:
-                pass
-            fn = getattr(mod, "place_orders", None)
-            res = fn(lst) if callable(fn) else {"status": "error", "message": "place_orders not implemented"}
-        except Exception as e:
-            res = {"status": "error", "message": str(e)}
-        results[brk] = res
+        with span("symbols.lot"):
+            for od in by_broker["dhan"]:
+                try:
+                    sid = od.get("security_id") or ""
+                    minq = _min_qty_for(sid) if sid else 1
+                    old_q = int(od.get("qty", 0))
+                    new_q = old_q * max(1, int(minq))
+                    od["qty"] = new_q
+                    audit("router.lot_size", level="debug", uid=od.get("client_id"), sid=sid,
+                          min_qty=minq, qty_in=old_q, qty_out=new_q)
+                except Exception:
+                    od["qty"] = int(od.get("qty", 0))
 
-    return {"status": "completed", "result": results}
+    if skipped:
+        audit("router.place_orders.skipped", skipped=skipped)
+    return by_broker, skipped, correlation_id, {"symbol": raw_symbol, "action": action, "ordertype": ordertype}
 
 # Backward-compatibility for UIs posting to /place_order
 @app.post("/place_order")
-def route_place_order_compat(payload: Dict[str, Any] = Body(...)):
-    return route_place_orders(payload)
+async def route_place_order_compat(payload: Dict[str, Any] = Body(...)):
+    return await route_place_orders(payload)
 
 @app.post("/modify_order")
-def route_modify_order(payload: Dict[str, Any] = Body(...)):
+async def route_modify_order(payload: Dict[str, Any] = Body(...)):
+    return await _run_in_lane(ORDER_LANE, _modify_order, payload)
+
+def _modify_order(payload: Dict[str, Any]):
     """
     Modify pending orders (Dhan + Motilal).
 
@@ -1777,45 +2528,32 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
         return "MARKET"
 
     def _guess_broker_from_order(od: Dict[str, Any]) -> str | None:
+        brk = _row_broker(od)
+        if brk: return brk
         oid = str((od or {}).get("order_id") or (od or {}).get("orderId") or "").strip()
         if oid.isdigit(): return "dhan"
         if any(c.isalpha() for c in oid): return "motilal"
         return _broker_by_client_name((od or {}).get("name"))
 
     # ----- try to fetch current order snapshot from broker (for quantity/defaults)
-    def _fetch_dhan_order_snapshot(order_id: str) -> dict | None:
+    def _fetch_dhan_order_snapshot(order_id: str) -> Book_models.Order | None:
         try:
             dh = importlib.import_module("Broker_dhan")
             fn = getattr(dh, "get_orders", None)
             if not callable(fn):
                 return None
             data = fn() or {}
-            for key in ("pending", "traded", "rejected", "cancelled", "others"):
-                for row in (data.get(key) or []):
-                    if str(row.get("order_id") or row.get("orderId") or "") == str(order_id):
+            for rows in data.values():
+                for row in rows:
+                    if str(row.order_id) == str(order_id):
                         return row
         except Exception:
             return None
         return None
 
-    def _snap_qty(s: dict | None) -> int | None:
-        if not isinstance(s, dict): return None
-        for k in ("quantity", "qty", "order_qty", "orderQty", "orderQuantity", "quantityPlaced"):
-            v = s.get(k)
-            iv = _to_int_or_none(v)
-            if iv and iv > 0: return iv
-        # very last resort: pending + traded
-        p = _to_int_or_none(s.get("pendingQuantity"))
-        t = _to_int_or_none(s.get("tradedQuantity"))
-        if p or t:
-            total = (p or 0) + (t or 0)
-            return total if total > 0 else None
-        return None
-
-    def _snap_validity(s: dict | None) -> str | None:
-        if not isinstance(s, dict): return None
-        v = (s.get("validity") or s.get("timeForce") or "").upper()
-        return v or None
+    def _snap_qty(s: Book_models.Order | None) -> int | None:
+        iv = _to_int_or_none(s.quantity) if s is not None else None
+        return iv if iv and iv > 0 else None
 
     # ---------- normalize input ----------
     orders = payload.get("orders")
@@ -1855,17 +2593,11 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
         ot_dhan  = _map_ui_to_dhan(ot_ui)
         ot_final = ot_dhan or _guess_from_values(p, trg)
 
-        # fetch snapshot for dhan if we miss critical fields
-        snap = None
-        if brk == "dhan" and (q is None or not validity_in or ot_ui in ("", "NO_CHANGE")):
-            snap = _fetch_dhan_order_snapshot(oid)
-
+        # fetch the book row for dhan if the quantity is missing
         if q is None and brk == "dhan":
-            q = _snap_qty(snap)
-        if not validity_in and brk == "dhan":
-            validity = _snap_validity(snap) or "DAY"
-        else:
-            validity = validity_in or "DAY"
+            q = _snap_qty(_fetch_dhan_order_snapshot(oid))
+        # book rows carry no validity: an unset one means DAY
+        validity = validity_in or "DAY"
 
         # explicit validations (only for explicit changes)
         if ot_dhan:
@@ -1925,19 +2657,10 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
             row_mo = {**row_common, "orderType": ot_ui or "NO_CHANGE"}
             by_broker["motilal"].append(row_mo)
 
-    # ---------- logs ----------
-    try:
-        print("\n[/modify_order] INBOUND =>")
-        print(json.dumps(payload, indent=2, default=str))
-        print("\n[/modify_order] DHAN bucket =>")
-        print(json.dumps(by_broker["dhan"], indent=2, default=str))
-        print("\n[/modify_order] MOTILAL bucket =>")
-        print(json.dumps(by_broker["motilal"], indent=2, default=str))
-        if skipped:
-            print("\n[/modify_order] SKIPPED =>")
-            print(json.dumps(skipped, indent=2, default=str))
-    except Exception:
-        pass
+    # ---------- audit ----------
+    audit("router.modify_order", level="debug", inbound=payload)
+    audit("router.modify_order.buckets", dhan=by_broker["dhan"], motilal=by_broker["motilal"],
+          skipped=skipped)
 
     # ---------- dispatch ----------
     messages: List[str] = []
@@ -1956,11 +2679,7 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
             else:
                 messages.append("❌ Broker_dhan.modify_orders not implemented")
 
-            try:
-                print("\n[/modify_order] DHAN RESP =>")
-                print(json.dumps(res, indent=2, default=str))
-            except Exception:
-                pass
+            audit("router.modify_order.response", broker="dhan", response=res)
 
             if isinstance(res, dict) and isinstance(res.get("message"), list):
                 messages.extend([str(x) for x in res["message"]])
@@ -1975,11 +2694,7 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
             mo = importlib.import_module("Broker_motilal")
             if hasattr(mo, "modify_orders") and callable(getattr(mo, "modify_orders")):
                 res = mo.modify_orders(by_broker["motilal"])
-                try:
-                    print("\n[/modify_order] MOTILAL RESP =>")
-                    print(json.dumps(res, indent=2, default=str))
-                except Exception:
-                    pass
+                audit("router.modify_order.response", broker="motilal", response=res)
                 if isinstance(res, dict) and isinstance(res.get("message"), list):
                     messages.extend([str(x) for x in res["message"]])
                 else:
@@ -1989,12 +2704,7 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
         except Exception as e:
             messages.append(f"❌ motilal modify failed: {e}")
 
-    try:
-        print("\n[/modify_order] OUT MESSAGES =>")
-        print(json.dumps(messages, indent=2, default=str))
-    except Exception:
-        print(messages)
-
+    audit("router.modify_order.out", messages=messages)
     return {"message": messages}
 
 if __name__ == "__main__":
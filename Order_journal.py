@@ -0,0 +1,333 @@
+# Order_journal.py
+"""
+Durable, append-only journal of every order leg the router sends.
+
+Each /place_orders request writes one "intent" record per leg before the
+fan-out and one "ack" record per leg after the broker answers. Both are keyed
+by the leg's correlation id. Records are compact JSON lines in
+DATA_DIR/journal/orders-YYYYMMDD.jsonl.
+
+Writes are group-committed: callers enqueue records, one writer thread
+appends everything pending and issues a single fsync. record_intent() waits
+for that fsync, so a leg is on disk before it is dispatched, and concurrent
+requests share the cost of one flush. A failed write is reported back to
+every caller in the batch; the router does not send those legs.
+
+reconcile() replays the journal, finds intents with no ack (the process died
+mid fan-out) and looks each one up in the broker's order book. Run it at
+startup or from the command line:  python Order_journal.py reconcile
+
+Env:
+  JOURNAL_FSYNC        0 to skip fsync (page-cache durability only; default 1)
+  JOURNAL_WAIT_S       max seconds record_intent() waits for the commit (default 2)
+  JOURNAL_RECON_DAYS   how many daily files reconcile() scans (default 2)
+"""
+import os, json, time, uuid, queue, threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+BASE_DIR    = os.path.abspath(os.environ.get("DATA_DIR", "./data"))
+JOURNAL_DIR = os.path.join(BASE_DIR, "journal")
+
+FSYNC      = os.getenv("JOURNAL_FSYNC", "1").strip().lower() not in ("0", "false", "no", "off")
+WAIT_S     = float(os.getenv("JOURNAL_WAIT_S", "2"))
+RECON_DAYS = int(os.getenv("JOURNAL_RECON_DAYS", "2"))
+
+# Dhan accepts up to 25 characters for correlationId
+_CID_MAX = 25
+
+_q: "queue.Queue" = queue.Queue()
+_state: Dict[str, Any] = {
+    "thread": None, "records": 0, "commits": 0, "errors": 0,
+    "commit_us_total": 0.0, "commit_us_max": 0.0,
+}
+_start_lock = threading.Lock()
+_last_recon: Dict[str, Any] = {"ran_at": None, "unacked": [], "summary": {}}
+
+
+# ---------------------------
+# correlation ids
+# ---------------------------
+def new_request_id(requested: str = "") -> str:
+    """
+    Base id for one request: the caller's correlation id (as a prefix, when
+    usable) plus a random suffix. Callers reuse ids (UI retries, fixed tags),
+    and replay() folds records by leg id, so every request's must be unique.
+    Leaves room for leg_id's "-<index>".
+    """
+    base = "".join(ch for ch in str(requested or "") if ch.isalnum() or ch in "-_")
+    if not base:
+        return "R" + uuid.uuid4().hex[:12]
+    return f"{base[:_CID_MAX - 14]}-{uuid.uuid4().hex[:8]}"
+
+def leg_id(request_id: str, index: int) -> str:
+    return f"{request_id}-{index}"[-_CID_MAX:]
+
+
+# ---------------------------
+# writing
+# ---------------------------
+def _path_for(ts: float) -> str:
+    return os.path.join(JOURNAL_DIR, f"orders-{datetime.fromtimestamp(ts).strftime('%Y%m%d')}.jsonl")
+
+def _start() -> None:
+    with _start_lock:
+        if _state["thread"] is not None:
+            return
+        t = threading.Thread(target=_writer, name="order-journal", daemon=True)
+        _state["thread"] = t
+        t.start()
+
+class _Commit:
+    """Handed to the writer with a batch; `ok` is set before `event`."""
+    __slots__ = ("event", "ok")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.ok = True
+
+def _submit(records: List[Dict[str, Any]], wait: bool) -> Optional[bool]:
+    if not records:
+        return True
+    if _state["thread"] is None:
+        _start()
+    done = _Commit() if wait else None
+    _q.put((records, done))
+    if done is None:
+        return True
+    if not done.event.wait(WAIT_S):
+        return None
+    return done.ok
+
+def record_intent(request_id: str, legs: List[Dict[str, Any]]) -> Optional[bool]:
+    """
+    Journal the legs of one request before dispatch; blocks until they are
+    committed (or JOURNAL_WAIT_S passes). Returns True once they are on disk,
+    False if the write failed and None if it did not complete in time.
+
+    `qty` is what the adapter sends (lots for Motilal); `lot` is the lot size,
+    so reconcile can compare qty * lot with the order book's share quantity.
+    """
+    now = time.time()
+    recs = [{
+        "t": now, "k": "intent", "req": request_id,
+        "cid": od.get("correlation_id"), "broker": od.get("broker"),
+        "uid": od.get("client_id"), "name": od.get("name"), "tag": od.get("tag") or "",
+        "sid": od.get("security_id"), "action": od.get("action"), "qty": od.get("qty"),
+        "lot": od.get("lot_size") or 1, "ordertype": od.get("ordertype"), "price": od.get("price"),
+    } for od in legs]
+    return _submit(recs, wait=True)
+
+def record_acks(request_id: str, acks: List[Dict[str, Any]]) -> None:
+    """Journal broker acks; each item has cid, broker, uid, ok, order_id, response."""
+    now = time.time()
+    _submit([{"t": now, "k": "ack", "req": request_id, **a} for a in acks], wait=False)
+
+def flush(timeout: float = 5.0) -> bool:
+    if _state["thread"] is None:
+        return True
+    done = _Commit()
+    _q.put(([], done))
+    return done.event.wait(timeout)
+
+def _writer() -> None:
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    fh = None
+    path = ""
+    while True:
+        batch = [_q.get()]
+        while True:
+            try:
+                batch.append(_q.get_nowait())
+            except queue.Empty:
+                break
+
+        t0 = time.perf_counter()
+        lines: Dict[str, List[str]] = {}
+        waiters: List[_Commit] = []
+        for records, done in batch:
+            for r in records:
+                try:
+                    lines.setdefault(_path_for(r["t"]), []).append(
+                        json.dumps(r, separators=(",", ":"), ensure_ascii=False, default=str))
+                except Exception:
+                    _state["errors"] += 1
+                    if done is not None:
+                        done.ok = False
+            if done is not None:
+                waiters.append(done)
+
+        ok = True
+        try:
+            for p, chunk in lines.items():
+                if p != path:
+                    if fh is not None:
+                        fh.close()
+                    fh = open(p, "a", encoding="utf-8")
+                    path = p
+                fh.write("\n".join(chunk) + "\n")
+                fh.flush()
+                if FSYNC:
+                    os.fsync(fh.fileno())
+                _state["records"] += len(chunk)
+        except Exception as e:
+            # the whole batch counts as not durable; the next one reopens the file
+            ok = False
+            _state["errors"] += 1
+            print(f"[journal] write failed: {e}")
+            try:
+                if fh is not None:
+                    fh.close()
+            except Exception:
+                pass
+            fh, path = None, ""
+
+        if lines:
+            us = (time.perf_counter() - t0) * 1e6
+            _state["commits"] += 1
+            _state["commit_us_total"] += us
+            _state["commit_us_max"] = max(_state["commit_us_max"], us)
+        for w in waiters:
+            w.ok = w.ok and ok
+            w.event.set()
+
+def stats() -> Dict[str, Any]:
+    commits = _state["commits"]
+    return {
+        "dir": JOURNAL_DIR,
+        "fsync": FSYNC,
+        "records": _state["records"],
+        "commits": commits,
+        "errors": _state["errors"],
+        "pending": _q.qsize(),
+        "avg_commit_us": round(_state["commit_us_total"] / commits, 1) if commits else 0.0,
+        "max_commit_us": round(_state["commit_us_max"], 1),
+        "records_per_commit": round(_state["records"] / commits, 2) if commits else 0.0,
+    }
+
+
+# ---------------------------
+# replay / reconcile
+# ---------------------------
+def replay(days: int = RECON_DAYS) -> Dict[str, Dict[str, Any]]:
+    """Fold the last `days` journal files into {cid: {"intent": rec, "ack": rec|None}}."""
+    legs: Dict[str, Dict[str, Any]] = {}
+    today = datetime.now()
+    for d in range(days - 1, -1, -1):
+        p = os.path.join(JOURNAL_DIR, f"orders-{(today - timedelta(days=d)).strftime('%Y%m%d')}.jsonl")
+        if not os.path.exists(p):
+            continue
+        with open(p, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except Exception:
+                    continue  # torn last line after a crash
+                cid = r.get("cid")
+                if not cid:
+                    continue
+                leg = legs.setdefault(cid, {"intent": None, "ack": None, "recon": None})
+                if r.get("k") in leg:
+                    leg[r["k"]] = r
+    return legs
+
+def _order_id(o: Dict[str, Any]) -> str:
+    return str(o.get("orderId") or o.get("uniqueorderid") or "")
+
+def _matches(intent: Dict[str, Any], o: Dict[str, Any]) -> bool:
+    if intent.get("broker") == "dhan":
+        return str(o.get("correlationId") or "") == str(intent.get("cid"))
+    # Motilal has no correlation id on the order; match the leg's shape. The
+    # leg was sent in lots, the order book reports shares.
+    try:
+        shares = int(intent.get("qty") or 0) * int(intent.get("lot") or 1)
+        return (str(o.get("symboltoken") or "") == str(intent.get("sid") or "")
+                and str(o.get("buyorsell") or "").upper() == str(intent.get("action") or "").upper()
+                and int(float(o.get("orderqty") or 0)) == shares
+                and str(o.get("tag") or "") == str(intent.get("tag") or ""))
+    except Exception:
+        return False
+
+def _is_today(ts: Any) -> bool:
+    try:
+        return datetime.fromtimestamp(float(ts)).date() == datetime.now().date()
+    except Exception:
+        return False
+
+def reconcile(order_book: Callable[[str, str], Optional[List[Dict[str, Any]]]]) -> Dict[str, Any]:
+    """
+    Compare unacknowledged journal legs with the brokers' order books.
+    order_book(broker, client_id) returns that client's raw order book or None.
+    Every unacked leg gets a "recon" record: found (with order id/status),
+    missing, or unknown (order book not available, or the leg is from an
+    earlier day: broker order books only hold today's orders).
+
+    Orders already claimed by an ack, or matched to an earlier unacked leg,
+    are taken out of the candidates, so legs of the same shape (Motilal is
+    matched by shape) each need an order of their own.
+    """
+    legs = replay()
+    unacked = [l["intent"] for l in legs.values()
+               if l["intent"] is not None and l["ack"] is None and l["recon"] is None]
+    claimed = {(l["ack"].get("broker"), str(l["ack"].get("uid")), str(l["ack"].get("order_id")))
+               for l in legs.values() if l["ack"] is not None and l["ack"].get("order_id")}
+
+    books: Dict[tuple, Optional[List[Dict[str, Any]]]] = {}
+    out: List[Dict[str, Any]] = []
+    for it in sorted(unacked, key=lambda r: r.get("t") or 0):
+        key = (it.get("broker"), str(it.get("uid")))
+        if not _is_today(it.get("t")):
+            book = None
+        elif key not in books:
+            try:
+                raw = order_book(*key)
+                books[key] = None if raw is None else [
+                    o for o in raw if isinstance(o, dict) and (key + (_order_id(o),)) not in claimed]
+            except Exception as e:
+                print(f"[journal] order book failed for {key}: {e}")
+                books[key] = None
+            book = books[key]
+        else:
+            book = books[key]
+        if book is None:
+            state, hit = "unknown", None
+        else:
+            hit = next((o for o in book if _matches(it, o)), None)
+            state = "found" if hit else "missing"
+            if hit is not None:
+                book.remove(hit)
+        out.append({
+            "cid": it.get("cid"), "req": it.get("req"), "broker": it.get("broker"),
+            "uid": it.get("uid"), "name": it.get("name"), "state": state,
+            "order_id": (hit or {}).get("orderId") or (hit or {}).get("uniqueorderid"),
+            "order_status": (hit or {}).get("orderStatus") or (hit or {}).get("orderstatus"),
+            "intent_t": it.get("t"),
+        })
+
+    now = time.time()
+    _submit([{"t": now, "k": "recon", **r} for r in out if r["state"] != "unknown"], wait=False)
+    summary = {s: sum(1 for r in out if r["state"] == s) for s in ("found", "missing", "unknown")}
+    _last_recon.update({"ran_at": now, "unacked": out, "summary": summary})
+    for r in out:
+        if r["state"] != "found":
+            print(f"[journal] UNACKED leg cid={r['cid']} broker={r['broker']} uid={r['uid']} -> {r['state']}")
+    return dict(_last_recon)
+
+def last_reconcile() -> Dict[str, Any]:
+    return dict(_last_recon)
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "reconcile":
+        import importlib
+        def _book(brk: str, uid: str):
+            mod = importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
+            return mod.raw_order_book(uid)
+        rep = reconcile(_book)
+        flush()
+        print(json.dumps(rep, indent=2, default=str))
+    else:
+        legs = replay()
+        pending = [cid for cid, l in legs.items() if l["intent"] and not l["ack"]]
+        print(json.dumps({"legs": len(legs), "unacked": pending}, indent=2))
@@ -0,0 +1,277 @@
+# Profiler.py
+"""
+On-demand diagnostics for the running router: CPU profiles, memory
+snapshots and thread stacks. Nothing here runs until an admin endpoint asks
+for it, and everything it starts stops by itself.
+
+  sample(duration_s, interval_ms)   statistical sampler over ALL threads
+                                    (sys._current_frames every interval);
+                                    top functions by self and inclusive samples
+  CpuProfile                        cProfile of the calling thread (the
+                                    router uses it on the event-loop thread)
+  memory_start / memory_snapshot / memory_stop
+                                    tracemalloc, with a diff against the
+                                    previous snapshot; tracing switches itself
+                                    off after stop_after_s
+  threads(collapse)                 every live thread with its target and
+                                    current stack; identical stacks can be
+                                    collapsed (idle pool workers)
+
+Only one CPU profile runs at a time; durations are capped so a forgotten
+request can't leave a profiler attached.
+
+Env:
+  PROFILE_MAX_S          longest allowed CPU profile (default 30)
+  TRACEMALLOC_MAX_S      longest allowed tracemalloc session (default 1800)
+"""
+import os, io, sys, time, pstats, cProfile, threading, traceback, tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+PROFILE_MAX_S     = float(os.getenv("PROFILE_MAX_S", "30"))
+TRACEMALLOC_MAX_S = float(os.getenv("TRACEMALLOC_MAX_S", "1800"))
+
+# one CPU profile (sampler or cProfile) at a time
+_busy = threading.Lock()
+
+_mem: Dict[str, Any] = {"snapshot": None, "started_at": None, "timer": None, "taken": 0}
+_mem_lock = threading.Lock()
+
+
+class Busy(RuntimeError):
+    """Another profile is already running."""
+
+
+# innermost frames of a thread that is parked, not working; such samples are
+# counted as idle and kept out of the top lists
+_IDLE_LEAVES = {"wait", "select", "poll", "accept", "readinto", "recv", "recv_into", "get", "_wait_for_tstate_lock", "sleep"}
+# thread plumbing present in every stack
+_PLUMBING = {"threading.py", "thread.py"}
+
+def _clamp_duration(duration_s: float) -> float:
+    return max(0.1, min(float(duration_s or 0), PROFILE_MAX_S))
+
+def _where(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+# ---------------------------
+# statistical sampler
+# ---------------------------
+def sample(duration_s: float = 5.0, interval_ms: float = 5.0, top: int = 30) -> Dict[str, Any]:
+    """Sample every thread's stack for duration_s; blocking, run it off the event loop."""
+    duration_s = _clamp_duration(duration_s)
+    interval = max(1.0, float(interval_ms or 0)) / 1000.0
+    if not _busy.acquire(blocking=False):
+        raise Busy("a profile is already running")
+    try:
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        own: Counter = Counter()
+        incl: Counter = Counter()
+        by_thread: Counter = Counter()
+        samples = idle = 0
+        t0 = time.perf_counter()
+        deadline = t0 + duration_s
+        while time.perf_counter() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                samples += 1
+                if frame.f_code.co_name in _IDLE_LEAVES:
+                    idle += 1
+                    continue
+                by_thread[names.get(ident, str(ident))] += 1
+                own[_where(frame.f_code)] += 1
+                seen = set()
+                f = frame
+                while f is not None:
+                    if os.path.basename(f.f_code.co_filename) not in _PLUMBING:
+                        w = _where(f.f_code)
+                        if w not in seen:
+                            seen.add(w)
+                            incl[w] += 1
+                    f = f.f_back
+            time.sleep(interval)
+        took = time.perf_counter() - t0
+    finally:
+        _busy.release()
+
+    busy = samples - idle
+
+    def _rows(c: Counter) -> List[Dict[str, Any]]:
+        return [{"function": fn, "samples": n, "pct": round(100.0 * n / busy, 2) if busy else 0.0}
+                for fn, n in c.most_common(top)]
+
+    # pct is of busy samples: where working threads spend their time
+    return {
+        "mode": "sample",
+        "duration_s": round(took, 3),
+        "interval_ms": interval * 1000,
+        "samples": samples,
+        "idle_samples": idle,
+        "busy_threads": dict(by_thread.most_common()),
+        "top_self": _rows(own),
+        "top_inclusive": _rows(incl),
+    }
+
+
+# ---------------------------
+# cProfile
+# ---------------------------
+class CpuProfile:
+    """cProfile of the current thread between start() and stop()."""
+
+    def __init__(self):
+        self._prof: Optional[cProfile.Profile] = None
+        self._t0 = 0.0
+
+    def start(self) -> None:
+        if not _busy.acquire(blocking=False):
+            raise Busy("a profile is already running")
+        try:
+            self._prof = cProfile.Profile()
+            self._t0 = time.perf_counter()
+            self._prof.enable()
+        except Exception:
+            self._prof = None
+            _busy.release()
+            raise
+
+    def stop(self, top: int = 30, sort: str = "cumulative") -> Dict[str, Any]:
+        prof, self._prof = self._prof, None
+        if prof is None:
+            return {}
+        try:
+            prof.disable()
+        finally:
+            _busy.release()
+        took = time.perf_counter() - self._t0
+        st = pstats.Stats(prof, stream=io.StringIO())
+        if sort not in ("cumulative", "tottime", "ncalls"):
+            sort = "cumulative"
+        st.sort_stats(sort)
+        rows = []
+        for func in st.fcn_list[:top]:  # type: ignore[attr-defined]
+            cc, nc, tt, ct, _ = st.stats[func]  # type: ignore[attr-defined]
+            filename, line, name = func
+            rows.append({
+                "function": f"{name} ({os.path.basename(filename)}:{line})",
+                "calls": nc,
+                "tottime_ms": round(tt * 1000, 3),
+                "cumtime_ms": round(ct * 1000, 3),
+            })
+        return {"mode": "cprofile", "duration_s": round(took, 3), "sort": sort,
+                "total_calls": st.total_calls, "top": rows}  # type: ignore[attr-defined]
+
+
+# ---------------------------
+# tracemalloc
+# ---------------------------
+def memory_start(nframes: int = 10, stop_after_s: float = 600) -> Dict[str, Any]:
+    stop_after_s = max(1.0, min(float(stop_after_s or 0), TRACEMALLOC_MAX_S))
+    with _mem_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(max(1, min(int(nframes or 1), 50)))
+            _mem.update(snapshot=None, started_at=time.time(), taken=0)
+        if _mem["timer"] is not None:
+            _mem["timer"].cancel()
+        # tracing slows every allocation; never leave it on
+        t = threading.Timer(stop_after_s, memory_stop)
+        t.daemon = True
+        t.name = "tracemalloc-stop"
+        t.start()
+        _mem["timer"] = t
+    return {**memory_status(), "stops_in_s": stop_after_s}
+
+def memory_stop() -> Dict[str, Any]:
+    with _mem_lock:
+        if _mem["timer"] is not None:
+            _mem["timer"].cancel()
+            _mem["timer"] = None
+        was = tracemalloc.is_tracing()
+        if was:
+            tracemalloc.stop()
+        _mem.update(snapshot=None, started_at=None)
+    return {"tracing": False, "was_tracing": was}
+
+def memory_status() -> Dict[str, Any]:
+    out: Dict[str, Any] = {"tracing": tracemalloc.is_tracing(), "snapshots": _mem["taken"]}
+    if out["tracing"]:
+        cur, peak = tracemalloc.get_traced_memory()
+        out.update(started_at=_mem["started_at"], traced_kb=round(cur / 1024, 1),
+                   peak_kb=round(peak / 1024, 1), overhead_kb=round(tracemalloc.get_tracemalloc_memory() / 1024, 1))
+    return out
+
+def _stat_row(s) -> Dict[str, Any]:
+    frame = s.traceback[0]
+    row = {"where": f"{os.path.basename(frame.filename)}:{frame.lineno}",
+           "size_kb": round(s.size / 1024, 1), "count": s.count}
+    if hasattr(s, "size_diff"):
+        row.update(size_diff_kb=round(s.size_diff / 1024, 1), count_diff=s.count_diff)
+    return row
+
+def memory_snapshot(top: int = 25, group_by: str = "lineno") -> Dict[str, Any]:
+    """Top allocation sites now, and the growth since the previous snapshot."""
+    if group_by not in ("lineno", "filename", "traceback"):
+        group_by = "lineno"
+    with _mem_lock:
+        if not tracemalloc.is_tracing():
+            return {**memory_status(), "error": "tracemalloc is not running; start it first"}
+        snap = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        prev, _mem["snapshot"] = _mem["snapshot"], snap
+        _mem["taken"] += 1
+    out = {**memory_status(), "group_by": group_by,
+           "top": [_stat_row(s) for s in snap.statistics(group_by)[:top]]}
+    if prev is not None:
+        out["diff"] = [_stat_row(s) for s in snap.compare_to(prev, group_by)[:top]]
+    return out
+
+
+# ---------------------------
+# threads
+# ---------------------------
+def _target_of(t: threading.Thread) -> str:
+    fn = getattr(t, "_target", None)
+    if fn is None:
+        return type(t).__qualname__
+    mod = getattr(fn, "__module__", "") or ""
+    return f"{mod}.{getattr(fn, '__qualname__', repr(fn))}".lstrip(".")
+
+def threads(collapse: bool = True, limit: int = 40) -> Dict[str, Any]:
+    """Live threads with their targets and stacks; collapse merges identical stacks."""
+    frames = sys._current_frames()
+    rows = []
+    for t in threading.enumerate():
+        f = frames.get(t.ident)
+        stack = []
+        if f is not None:
+            # innermost `limit` frames, outermost first; no source lookups
+            summary = traceback.StackSummary.extract(traceback.walk_stack(f), limit=limit, lookup_lines=False)
+            stack = [f"{os.path.basename(fs.filename)}:{fs.lineno} {fs.name}" for fs in reversed(summary)]
+        rows.append({"name": t.name, "ident": t.ident, "daemon": t.daemon,
+                     "target": _target_of(t), "stack": stack})
+
+    by_target = Counter(r["target"] for r in rows)
+    # MOFSLOPENAPI starts websocket, AutoReloginTimer and heartbeat threads per
+    # SDK instance and never joins them; count them so leaks stand out
+    sdk = sum(n for tgt, n in by_target.items() if tgt.startswith("MOFSLOPENAPI"))
+    out: Dict[str, Any] = {"count": len(rows), "sdk_threads": sdk, "by_target": dict(by_target.most_common())}
+    if not collapse:
+        out["threads"] = rows
+        return out
+    groups: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+    for r in rows:
+        key = (r["target"],) + tuple(r["stack"])
+        g = groups.get(key)
+        if g is None:
+            g = groups[key] = {"target": r["target"], "count": 0, "names": [], "stack": r["stack"]}
+        g["count"] += 1
+        if len(g["names"]) < 10:
+            g["names"].append(r["name"])
+    out["groups"] = sorted(groups.values(), key=lambda g: -g["count"])
+    return out
@@ -0,0 +1,268 @@
+# Rate_limiter.py
+"""
+Adaptive send-rate limits per broker and account token.
+
+Every (broker, client) gets a budget of requests per second shared by its
+orders and its reads. The budget starts at the broker's configured rate and
+adapts to what the broker says:
+
+  throttled   a 429 or a rate-limit error code halves the rate (at most once
+              per second, so one burst of 429s counts once) and pauses the
+              account for Retry-After, or one send interval without it
+  recovering  every RATE_RECOVER_S without a throttle gives back a tenth of
+              the configured rate, until it is reached again
+
+Slots are scheduled GCRA-style (a theoretical arrival time plus a burst
+tolerance), so nothing runs in the background.
+
+Orders book the next free slot, however far ahead, and sleep until it comes:
+a burst queues instead of failing. Reads only take a slot that is free now
+and no order is waiting for, so when both compete for one token's budget
+orders go first. A read that would wait past its request deadline gives up
+(marked "throttled"); an order that would wait longer than RATE_QUEUE_MAX_S
+fails with Throttled.
+
+    lim = Rate_limiter.limiter("dhan", uid)
+    await lim.wait(Rate_limiter.ORDER)        # or lim.wait_sync(...) on threads
+    ... send ...
+    lim.throttled(retry_after) if throttled else lim.ok()
+
+Env:
+  RATE_LIMIT          0 to disable (default 1)
+  DHAN_RATE_PER_S     requests per second per Dhan account (default 10)
+  MO_RATE_PER_S       requests per second per Motilal account (default 10)
+  RATE_BURST          requests allowed back to back at the full rate (default 5)
+  RATE_MIN_PER_S      floor the rate never drops below (default 0.5)
+  RATE_RECOVER_S      quiet seconds per recovery step (default 5)
+  RATE_QUEUE_MAX_S    longest an order may queue for a slot (default 30)
+  THROTTLE_RETRIES    times a throttled order is re-queued and resent (default 5)
+"""
+import os, time, asyncio, threading
+from typing import Any, Dict, Optional, Tuple
+
+import Metrics
+import Req_deadline
+from Req_deadline import DeadlineExceeded
+from Audit_log import audit
+
+ENABLED       = os.getenv("RATE_LIMIT", "1").strip().lower() not in ("0", "false", "no", "off")
+BURST         = max(1.0, float(os.getenv("RATE_BURST", "5")))
+MIN_RATE      = float(os.getenv("RATE_MIN_PER_S", "0.5"))
+RECOVER_S     = float(os.getenv("RATE_RECOVER_S", "5"))
+QUEUE_MAX_S   = float(os.getenv("RATE_QUEUE_MAX_S", "30"))
+RETRIES       = int(os.getenv("THROTTLE_RETRIES", "5"))
+
+RATES = {
+    "dhan":    float(os.getenv("DHAN_RATE_PER_S", "10")),
+    "motilal": float(os.getenv("MO_RATE_PER_S", "10")),
+}
+
+ORDER, READ = "order", "read"
+_CUT_WINDOW_S = 1.0
+
+THROTTLES = Metrics.counter("rate_limit_throttled_total", "Throttle answers (429 / rate-limit codes) seen.", ("broker",))
+REQUEUED  = Metrics.counter("rate_limit_requeued_total", "Throttled orders queued again and resent.", ("broker",))
+WAITS     = Metrics.histogram("rate_limit_wait_seconds", "Time a call waited for its rate-limit slot.",
+                              ("broker", "priority"))
+
+
+class Throttled(Exception):
+    """No send slot within the allowed wait."""
+
+
+class Limiter:
+    __slots__ = ("broker", "client", "max_rate", "rate", "interval", "tau", "tat", "orders_waiting",
+                 "cut_at", "changed_at", "throttles", "cuts", "_lock")
+
+    def __init__(self, broker: str, client: str, rate: float):
+        self.broker, self.client = broker, client
+        self.max_rate = max(rate, MIN_RATE)
+        self.tat = 0.0              # theoretical arrival time of the next request
+        self.orders_waiting = 0
+        self.cut_at = 0.0
+        self.changed_at = 0.0
+        self.throttles = 0
+        self.cuts = 0
+        self._lock = threading.Lock()
+        self._set_rate(self.max_rate)
+
+    def _set_rate(self, rate: float) -> None:
+        self.rate = rate
+        self.interval = 1.0 / rate
+        # the burst shrinks with the rate: a throttled account gets no burst
+        self.tau = max(0.0, BURST * rate / self.max_rate - 1.0) * self.interval
+
+    # -- slots --
+    def _book_order(self) -> float:
+        now = time.monotonic()
+        with self._lock:
+            wait = max(0.0, self.tat - self.tau - now)
+            if wait > QUEUE_MAX_S:
+                raise Throttled(f"{self.broker}/{self.client}: no send slot within {QUEUE_MAX_S:.0f}s")
+            self.tat = max(self.tat, now) + self.interval
+            if wait:
+                self.orders_waiting += 1
+            return wait
+
+    def _try_read(self) -> float:
+        """0 when a slot was taken, else seconds before asking again."""
+        now = time.monotonic()
+        with self._lock:
+            if self.orders_waiting:
+                return self.interval
+            ready = self.tat - self.tau
+            if now >= ready:
+                self.tat = max(self.tat, now) + self.interval
+                return 0.0
+            return ready - now
+
+    def _order_done(self) -> None:
+        with self._lock:
+            self.orders_waiting -= 1
+
+    def _read_wait_left(self, waited: float) -> float:
+        left = Req_deadline.remaining()
+        cap = QUEUE_MAX_S - waited
+        return cap if left is None else min(cap, left)
+
+    def _give_up(self) -> None:
+        Req_deadline.mark(self.broker, self.client, "throttled")
+        raise DeadlineExceeded(f"{self.broker}/{self.client}: rate limited past the request deadline")
+
+    async def wait(self, priority: str) -> None:
+        if priority == ORDER:
+            delay = self._book_order()
+            if delay:
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self._order_done()
+            WAITS.observe(delay, self.broker, priority)
+            return
+        waited = 0.0
+        while True:
+            delay = self._try_read()
+            if not delay:
+                WAITS.observe(waited, self.broker, priority)
+                return
+            if delay > self._read_wait_left(waited):
+                self._give_up()
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def wait_sync(self, priority: str) -> None:
+        if priority == ORDER:
+            delay = self._book_order()
+            if delay:
+                try:
+                    time.sleep(delay)
+                finally:
+                    self._order_done()
+            WAITS.observe(delay, self.broker, priority)
+            return
+        waited = 0.0
+        while True:
+            delay = self._try_read()
+            if not delay:
+                WAITS.observe(waited, self.broker, priority)
+                return
+            if delay > self._read_wait_left(waited):
+                self._give_up()
+            time.sleep(delay)
+            waited += delay
+
+    # -- feedback --
+    def throttled(self, retry_after: Optional[float] = None) -> None:
+        now = time.monotonic()
+        THROTTLES.inc(self.broker)
+        with self._lock:
+            self.throttles += 1
+            cut = now - self.cut_at >= _CUT_WINDOW_S
+            if cut:
+                self._set_rate(max(MIN_RATE, self.rate * 0.5))
+                self.cut_at = self.changed_at = now
+                self.cuts += 1
+            pause = min(retry_after or self.interval, QUEUE_MAX_S)
+            self.tat = max(self.tat, now + pause + self.tau)
+            rate = self.rate
+        if cut:
+            audit("ratelimit.cut", broker=self.broker, client=self.client,
+                  rate=round(rate, 2), retry_after=retry_after)
+
+    def ok(self) -> None:
+        if self.rate >= self.max_rate:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self.rate >= self.max_rate or now - self.changed_at < RECOVER_S:
+                return
+            self._set_rate(min(self.max_rate, self.rate + self.max_rate * 0.1))
+            self.changed_at = now
+
+    def stats(self) -> Dict[str, Any]:
+        return {"rate": round(self.rate, 2), "max_rate": self.max_rate, "throttles": self.throttles,
+                "cuts": self.cuts, "orders_waiting": self.orders_waiting}
+
+
+class _Off:
+    """Stand-in when RATE_LIMIT=0."""
+    async def wait(self, priority: str) -> None:
+        return None
+
+    def wait_sync(self, priority: str) -> None:
+        return None
+
+    def throttled(self, retry_after: Optional[float] = None) -> None:
+        return None
+
+    def ok(self) -> None:
+        return None
+
+
+_OFF = _Off()
+_limiters: Dict[Tuple[str, str], Limiter] = {}
+_lock = threading.Lock()
+
+def limiter(broker: str, client: Any) -> Any:
+    if not ENABLED:
+        return _OFF
+    key = (broker, str(client or ""))
+    lim = _limiters.get(key)
+    if lim is None:
+        with _lock:
+            lim = _limiters.get(key)
+            if lim is None:
+                lim = _limiters[key] = Limiter(broker, key[1], RATES.get(broker, 10.0))
+    return lim
+
+def retry_after_s(headers: Any) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds form only)."""
+    try:
+        v = headers.get("Retry-After") if headers is not None else None
+        return max(0.0, float(v)) if v not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        items = list(_limiters.items())
+    return {
+        "enabled": ENABLED,
+        "rates": RATES,
+        # only accounts that have been throttled since start
+        "throttled": {f"{b}/{c}": lim.stats() for (b, c), lim in items if lim.throttles},
+    }
+
+def _rates() -> Dict[Tuple[str, str], float]:
+    with _lock:
+        items = list(_limiters.items())
+    out: Dict[Tuple[str, str], float] = {}
+    for (b, c), lim in items:
+        if lim.rate < lim.max_rate:
+            # without client labels, the slowest account per broker
+            key = (b, Metrics.client_label(c))
+            out[key] = min(out.get(key, lim.rate), round(lim.rate, 3))
+    return out
+
+Metrics.gauge("rate_limit_rate", "Current send rate of accounts running below their configured rate.",
+              _rates, ("broker", "client"))
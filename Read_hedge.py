@@ -0,0 +1,254 @@
+# Read_hedge.py
+"""
+Hedged and retried idempotent broker reads (order books, positions,
+holdings, funds).
+
+Hedging: when a read has not answered after the p95 latency observed for
+that (broker, api), a duplicate request is fired and whichever answers
+first wins; the other is cancelled (async) or ignored (threads). Hedges are
+capped at HEDGE_MAX_RATIO of all reads, so a broker that is slow across the
+board sees at most that much extra load.
+
+Retries: a transient failure (transport error, 5xx) is retried up to
+READ_RETRIES times after a full-jitter backoff, as long as the request's
+deadline leaves room. Open circuit breakers and spent deadlines are never
+retried.
+
+Only the adapters' read helpers call into this module. Order placement,
+modification and cancellation never go through it: a duplicate mutation is
+a duplicate order.
+
+    rows = await Read_hedge.call(("dhan", "GET /orders"), lambda: _asend(...), transient)
+    resp = Read_hedge.call_sync(("motilal", "GetOrderBook"), once)
+
+Env:
+  READ_HEDGE           1 to enable hedging (default 0)
+  HEDGE_MAX_RATIO      hedges allowed per read (default 0.1)
+  HEDGE_MIN_MS         lower bound on the hedge delay (default 50)
+  HEDGE_DEFAULT_MS     delay until 20 samples exist (default 500)
+  HEDGE_WORKERS        threads for hedged SDK reads (default 32)
+  READ_RETRIES         retries on transient errors (default 1)
+  READ_RETRY_BASE_MS   backoff base, doubled per retry, full jitter (default 100)
+"""
+import os, time, random, asyncio, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+import Metrics
+import Req_timing
+import Req_deadline
+from Req_deadline import DeadlineExceeded
+from Circuit_breaker import CircuitOpen
+
+HEDGE_ENABLED   = os.getenv("READ_HEDGE", "0").strip().lower() in ("1", "true", "yes", "on")
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))
+HEDGE_MIN_MS    = float(os.getenv("HEDGE_MIN_MS", "50"))
+HEDGE_DEFAULT_MS = float(os.getenv("HEDGE_DEFAULT_MS", "500"))
+HEDGE_WORKERS   = int(os.getenv("HEDGE_WORKERS", "32"))
+RETRIES         = int(os.getenv("READ_RETRIES", "1"))
+RETRY_BASE_MS   = float(os.getenv("READ_RETRY_BASE_MS", "100"))
+
+_MIN_SAMPLES = 20
+_NO_RETRY = (CircuitOpen, DeadlineExceeded)
+
+HEDGES  = Metrics.counter("read_hedges_total", "Duplicate reads fired, and how often the duplicate won.",
+                          ("broker", "api", "outcome"))
+RETRIED = Metrics.counter("read_retries_total", "Reads retried after a transient failure.", ("broker", "api"))
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+class _Latency:
+    """Recent latencies of one (broker, api); p95 recomputed every 32 samples."""
+    __slots__ = ("samples", "p95_ms", "since", "reads", "hedges")
+
+    def __init__(self):
+        self.samples: Deque[float] = deque(maxlen=256)
+        self.p95_ms = 0.0
+        self.since = 0
+        self.reads = 0
+        self.hedges = 0
+
+    def add(self, ms: float) -> None:
+        self.samples.append(ms)
+        self.since += 1
+        if self.since >= 32 or (self.p95_ms == 0.0 and len(self.samples) >= _MIN_SAMPLES):
+            v = sorted(self.samples)
+            self.p95_ms = v[min(len(v) - 1, int(len(v) * 0.95))]
+            self.since = 0
+
+    def delay_s(self) -> float:
+        ms = self.p95_ms if len(self.samples) >= _MIN_SAMPLES else HEDGE_DEFAULT_MS
+        return max(ms, HEDGE_MIN_MS) / 1000.0
+
+    def may_hedge(self) -> bool:
+        # small fixed burst, then at most HEDGE_MAX_RATIO of reads
+        return self.hedges < HEDGE_MAX_RATIO * self.reads + 5
+
+
+_stats: Dict[Tuple[str, str], _Latency] = {}
+
+def _lat(key: Tuple[str, str]) -> _Latency:
+    s = _stats.get(key)
+    if s is None:
+        s = _stats.setdefault(key, _Latency())
+    return s
+
+def _backoff_s(attempt: int) -> Optional[float]:
+    """Jittered wait before retry `attempt` (1-based), None if the deadline leaves no room."""
+    wait_s = random.uniform(0, RETRY_BASE_MS * (2 ** (attempt - 1))) / 1000.0
+    left = Req_deadline.remaining()
+    if left is not None and left <= wait_s:
+        return None
+    return wait_s
+
+def _default_transient(result: Any, exc: Optional[BaseException]) -> bool:
+    return exc is not None and not isinstance(exc, _NO_RETRY)
+
+def _hedge_window(lat: _Latency) -> Optional[float]:
+    """Seconds to wait before hedging, None when this read must not be hedged."""
+    if not HEDGE_ENABLED or not lat.may_hedge():
+        return None
+    delay = lat.delay_s()
+    left = Req_deadline.remaining()
+    if left is not None and left <= delay:
+        return None
+    return delay
+
+
+# ---------------------------
+# async (Dhan, httpx)
+# ---------------------------
+async def _timed(lat: _Latency, fn: Callable[[], Awaitable[Any]]) -> Any:
+    t0 = time.perf_counter()
+    res = await fn()
+    lat.add((time.perf_counter() - t0) * 1000)
+    return res
+
+async def _hedged_once(key: Tuple[str, str], fn: Callable[[], Awaitable[Any]]) -> Any:
+    lat = _lat(key)
+    lat.reads += 1
+    delay = _hedge_window(lat)
+    if delay is None:
+        return await _timed(lat, fn)
+    first = asyncio.ensure_future(_timed(lat, fn))
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+    lat.hedges += 1
+    HEDGES.inc(key[0], key[1], "sent")
+    second = asyncio.ensure_future(_timed(lat, fn))
+    pending = {first, second}
+    try:
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # first successful answer; an error only once both have failed
+            ok = [t for t in done if t.exception() is None]
+            if ok or not pending:
+                winner = ok[0] if ok else done.pop()
+                if winner is second:
+                    HEDGES.inc(key[0], key[1], "won")
+                return winner.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def call(key: Tuple[str, str], fn: Callable[[], Awaitable[Any]],
+               transient: Callable[[Any, Optional[BaseException]], bool] = _default_transient) -> Any:
+    """Await an idempotent read with hedging and jittered retries; fn() makes one attempt."""
+    attempt = 0
+    while True:
+        try:
+            res, exc = await _hedged_once(key, fn), None
+        except Exception as e:
+            res, exc = None, e
+        if attempt >= RETRIES or not transient(res, exc):
+            if exc is not None:
+                raise exc
+            return res
+        attempt += 1
+        wait_s = _backoff_s(attempt)
+        if wait_s is None:
+            if exc is not None:
+                raise exc
+            return res
+        RETRIED.inc(key[0], key[1])
+        await asyncio.sleep(wait_s)
+
+
+# ---------------------------
+# threads (Motilal SDK)
+# ---------------------------
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="read-hedge")
+    return _pool
+
+def _timed_sync(lat: _Latency, fn: Callable[[], Any]) -> Any:
+    t0 = time.perf_counter()
+    res = fn()
+    lat.add((time.perf_counter() - t0) * 1000)
+    return res
+
+def _hedged_once_sync(key: Tuple[str, str], fn: Callable[[], Any]) -> Any:
+    lat = _lat(key)
+    lat.reads += 1
+    delay = _hedge_window(lat)
+    if delay is None:
+        return _timed_sync(lat, fn)
+    # both attempts run on the hedge pool; this thread only waits for the first answer
+    pool = _executor()
+    first = pool.submit(Req_timing.bind(_timed_sync, lat, fn))
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+    lat.hedges += 1
+    HEDGES.inc(key[0], key[1], "sent")
+    second = pool.submit(Req_timing.bind(_timed_sync, lat, fn))
+    pending = {first, second}
+    while True:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        ok = [f for f in done if f.exception() is None]
+        if ok or not pending:
+            winner = ok[0] if ok else done.pop()
+            if winner is second:
+                HEDGES.inc(key[0], key[1], "won")
+            # the loser keeps running on its pool thread; its answer is dropped
+            return winner.result()
+
+def call_sync(key: Tuple[str, str], fn: Callable[[], Any],
+              transient: Callable[[Any, Optional[BaseException]], bool] = _default_transient) -> Any:
+    """Blocking twin of call() for SDK reads running on executor threads."""
+    attempt = 0
+    while True:
+        try:
+            res, exc = _hedged_once_sync(key, fn), None
+        except Exception as e:
+            res, exc = None, e
+        if attempt >= RETRIES or not transient(res, exc):
+            if exc is not None:
+                raise exc
+            return res
+        attempt += 1
+        wait_s = _backoff_s(attempt)
+        if wait_s is None:
+            if exc is not None:
+                raise exc
+            return res
+        RETRIED.inc(key[0], key[1])
+        time.sleep(wait_s)
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "hedging": HEDGE_ENABLED,
+        "retries": RETRIES,
+        "apis": {f"{b}:{a}": {"reads": s.reads, "hedges": s.hedges, "p95_ms": round(s.p95_ms, 1),
+                              "delay_ms": round(s.delay_s() * 1000, 1), "samples": len(s.samples)}
+                 for (b, a), s in list(_stats.items())},
+    }
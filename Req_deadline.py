@@ -0,0 +1,107 @@
+# Req_deadline.py
+"""
+Per-request time budgets for the read endpoints.
+
+The router's middleware opens a Deadline for every request. GET requests get
+a budget from the X-Request-Timeout-Ms header or, failing that, the route's
+default (ROUTE_DEADLINES); order entry never gets one, since a deadline
+can't take back an order that was already sent.
+
+Broker adapters ask for their per-call timeout through
+
+    t, bound = Req_deadline.bounded(15)    # min(own timeout, time left)
+
+and skip the call when nothing is left. Each client that was skipped, timed
+out on the budget, failed fast on an open circuit breaker, or could not get
+a rate-limit slot in time is marked, and
+the router reports the marks with the response so partial books are
+visible as partial.
+
+Like Req_timing, the Deadline lives in a context variable: executor threads
+see it only when started through Req_timing.bind().
+
+Env:
+  DEADLINE_MAX_MS   cap on a client-supplied budget (default 60000)
+  ROUTE_DEADLINES   per-route defaults in ms, "/get_orders=8000,/get_holdings=15000"
+"""
+import os, time, contextvars
+from typing import Any, Dict, Optional, Tuple
+
+DEADLINE_MAX_MS = float(os.getenv("DEADLINE_MAX_MS", "60000"))
+HEADER = "x-request-timeout-ms"
+
+def _parse_routes(spec: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in (spec or "").split(","):
+        path, _, ms = part.partition("=")
+        try:
+            if path.strip():
+                out[path.strip()] = float(ms)
+        except ValueError:
+            print(f"[deadline] bad ROUTE_DEADLINES entry: {part!r}")
+    return out
+
+ROUTE_DEADLINES = {"/get_orders": 8000.0, "/get_positions": 8000.0, "/get_holdings": 15000.0,
+                   **_parse_routes(os.getenv("ROUTE_DEADLINES", ""))}
+
+_current: "contextvars.ContextVar[Optional[Deadline]]" = contextvars.ContextVar("req_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request's budget ran out before this call started."""
+
+
+class Deadline:
+    __slots__ = ("at", "budget_ms", "marks")
+
+    def __init__(self, budget_ms: Optional[float]):
+        self.budget_ms = budget_ms
+        self.at = time.monotonic() + budget_ms / 1000.0 if budget_ms else None
+        # "broker/client" -> timed_out | skipped | circuit_open | throttled
+        self.marks: Dict[str, str] = {}
+
+
+def budget_for(method: str, path: str, header: Optional[str]) -> Optional[float]:
+    """Budget in ms for a request, None for no deadline."""
+    if method != "GET":
+        return None
+    if header:
+        try:
+            return max(1.0, min(float(header), DEADLINE_MAX_MS))
+        except ValueError:
+            pass
+    return ROUTE_DEADLINES.get(path)
+
+def begin(budget_ms: Optional[float]) -> Deadline:
+    d = Deadline(budget_ms)
+    _current.set(d)
+    return d
+
+def remaining() -> Optional[float]:
+    """Seconds left, None when the request has no deadline."""
+    d = _current.get()
+    if d is None or d.at is None:
+        return None
+    return d.at - time.monotonic()
+
+def bounded(own_timeout: float) -> Tuple[float, bool]:
+    """(timeout to use, True if the budget rather than own_timeout is the limit)."""
+    left = remaining()
+    if left is None or left >= own_timeout:
+        return own_timeout, False
+    return max(0.0, left), True
+
+def mark(broker: str, client: Any, reason: str) -> None:
+    d = _current.get()
+    if d is not None:
+        d.marks.setdefault(f"{broker}/{client}" if client else broker, reason)
+
+def report() -> Optional[Dict[str, Any]]:
+    """What to attach to a response: None when every client answered in time."""
+    d = _current.get()
+    if d is None or not d.marks:
+        return None
+    out: Dict[str, Any] = {"clients": dict(d.marks)}
+    if d.budget_ms:
+        out["budget_ms"] = d.budget_ms
+    return out
@@ -0,0 +1,91 @@
+# Req_timing.py
+"""
+Per-request timing spans.
+
+The router's middleware opens a Timing for every HTTP request and keeps it
+in a context variable. Any code running for that request (router helpers,
+broker adapters, executor threads started through bind()) can record a
+sub-span with
+
+    with span("dhan.http"):
+        ...
+
+Outside a request span() costs one context-variable lookup and records
+nothing. Spans with the same name are aggregated (count, total, max) since a
+fan-out records one per client. The result is rendered as a Server-Timing
+header and, for slow requests, as a structured audit event.
+
+Executor threads do not inherit context variables; wrap the callable with
+bind() (run_in_executor) or start threads through it.
+"""
+import time, contextvars, functools
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+_current: "contextvars.ContextVar[Optional[Timing]]" = contextvars.ContextVar("req_timing", default=None)
+
+
+class Timing:
+    __slots__ = ("t0", "spans")
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        # name -> [count, total_ms, max_ms]; list ops are atomic enough under the GIL
+        self.spans: Dict[str, List[float]] = {}
+
+    def add(self, name: str, ms: float) -> None:
+        s = self.spans.get(name)
+        if s is None:
+            s = self.spans.setdefault(name, [0, 0.0, 0.0])
+        s[0] += 1
+        s[1] += ms
+        if ms > s[2]:
+            s[2] = ms
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.t0) * 1000
+
+    def server_timing(self, total_ms: float) -> str:
+        """Server-Timing value: dur is the longest single span, desc the count/sum for fan-outs."""
+        parts = [f"total;dur={total_ms:.1f}"]
+        for name, (n, tot, mx) in self.spans.items():
+            if n > 1:
+                parts.append(f'{name};dur={mx:.1f};desc="n={int(n)} sum={tot:.1f}"')
+            else:
+                parts.append(f"{name};dur={mx:.1f}")
+        return ", ".join(parts)
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        return {name: {"n": int(n), "sum_ms": round(tot, 2), "max_ms": round(mx, 2)}
+                for name, (n, tot, mx) in self.spans.items()}
+
+
+def begin() -> Timing:
+    t = Timing()
+    _current.set(t)
+    return t
+
+def current() -> Optional[Timing]:
+    return _current.get()
+
+@contextmanager
+def span(name: str):
+    t = _current.get()
+    if t is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        t.add(name, (time.perf_counter() - t0) * 1000)
+
+def record(name: str, ms: float) -> None:
+    t = _current.get()
+    if t is not None:
+        t.add(name, ms)
+
+def bind(fn: Callable, *args: Any, **kw: Any) -> Callable:
+    """fn(*args, **kw) bound to a copy of the caller's context (for executors and threads)."""
+    ctx = contextvars.copy_context()
+    return functools.partial(ctx.run, fn, *args, **kw)
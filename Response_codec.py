@@ -0,0 +1,134 @@
+# Response_codec.py
+"""
+Encoding for the large book responses (/get_orders, /get_positions,
+/get_holdings), which the UI polls for every account at once.
+
+  encode    the body is serialized once, straight from the Book_models
+            records: orjson with a to_dict() hook when installed, else the
+            stdlib json over Book_models.dump(). FastAPI's jsonable_encoder
+            pass is skipped entirely.
+  ETag      a weak ETag over the encoded body. A poll whose If-None-Match
+            still matches gets 304 with no body, and counts as a hit of the
+            book's cache in cache_hit_ratio.
+  compress  bodies of COMPRESS_MIN_BYTES and up are sent br (when the
+            brotli package is installed) or gzip, whichever the client
+            accepts. The last compressed body per book is kept, so tabs
+            that poll without an ETag don't recompress an unchanged book.
+
+    return Response_codec.book(request, body, "order_book")
+
+Env:
+  RESPONSE_ETAG        0 to disable ETag / 304 (default 1)
+  COMPRESS_MIN_BYTES   smallest body worth compressing (default 1024)
+  GZIP_LEVEL           gzip level (default 5)
+  BROTLI_QUALITY       brotli quality (default 4)
+"""
+import os, gzip, json, hashlib
+from typing import Any, Dict, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+import Metrics
+import Book_models
+
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+try:
+    import brotli
+except Exception:
+    brotli = None
+
+ETAG_ENABLED   = os.getenv("RESPONSE_ETAG", "1").strip().lower() not in ("0", "false", "no", "off")
+COMPRESS_MIN   = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL     = int(os.getenv("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+BYTES = Metrics.counter("book_response_bytes_total",
+                        "Book response bytes before (raw) and after (sent) compression; 304s send none.",
+                        ("book", "stage"))
+
+# book -> (etag, encoding, compressed body) of the last compressed response
+_last: Dict[str, Tuple[str, str, bytes]] = {}
+
+
+def _default(obj: Any) -> Any:
+    to_dict = getattr(obj, "to_dict", None)
+    if to_dict is None:
+        raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+    return to_dict()
+
+def dumps(body: Any) -> bytes:
+    """UTF-8 JSON for a body that may hold Book_models records."""
+    if orjson is not None:
+        return orjson.dumps(body, default=_default)
+    return json.dumps(Book_models.dump(body), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _etag_of(raw: bytes) -> str:
+    return 'W/"' + hashlib.blake2b(raw, digest_size=12).hexdigest() + '"'
+
+def _matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # weak comparison: W/"x" and "x" name the same body
+    tag = etag[2:]
+    return any(t.strip().removeprefix("W/") == tag for t in header.split(","))
+
+def _pick_encoding(accept: str) -> Optional[str]:
+    offered = set()
+    for part in (accept or "").lower().split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            k, _, v = param.strip().partition("=")
+            if k == "q":
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            offered.add(name.strip())
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return None
+
+def _compress(book: str, etag: str, raw: bytes, encoding: str) -> bytes:
+    hit = _last.get(book)
+    if hit is not None and hit[0] == etag and hit[1] == encoding:
+        return hit[2]
+    if encoding == "br":
+        out = brotli.compress(raw, quality=BROTLI_QUALITY)
+    else:
+        out = gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0)
+    _last[book] = (etag, encoding, out)
+    return out
+
+
+def book(request: Request, body: Any, name: str) -> Response:
+    """Encoded, validated and (if large) compressed response for one book."""
+    raw = dumps(body)
+    headers = {"Vary": "Accept-Encoding"}
+    if ETAG_ENABLED:
+        etag = _etag_of(raw)
+        # the browser may reuse the body only after asking whether it changed
+        headers.update({"ETag": etag, "Cache-Control": "no-cache"})
+        hit = _matches(request.headers.get("if-none-match"), etag)
+        Metrics.cache_hit(name, hit)
+        if hit:
+            return Response(status_code=304, headers=headers)
+    else:
+        etag = ""
+    BYTES.inc(name, "raw", by=len(raw))
+    encoding = _pick_encoding(request.headers.get("accept-encoding", "")) if len(raw) >= COMPRESS_MIN else None
+    if encoding is not None:
+        raw = _compress(name, etag or _etag_of(raw), raw, encoding)
+        headers["Content-Encoding"] = encoding
+    BYTES.inc(name, "sent", by=len(raw))
+    return Response(content=raw, media_type="application/json", headers=headers)
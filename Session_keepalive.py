@@ -0,0 +1,124 @@
+# Session_keepalive.py
+"""
+Background keep-alive for broker sessions.
+
+Every client saved with session_active is probed once per interval through
+its adapter's check_session():
+
+  * Motilal: GetProfile on the live SDK session; logs in when there is none
+    and re-logs in when the token is near its TTL or the probe is rejected.
+  * Dhan:    /v2/profile with token-validity parsing; tokens are user
+    generated, so an expiring or rejected token is reported, not renewed.
+
+Checks are spread evenly across the interval (interval / n apart) so a large
+book of clients never produces a burst of logins. The outcome of the last
+check is kept per client for /health.
+
+Env:
+  SESSION_KEEPALIVE_S         seconds between checks of the same client (default 600)
+  SESSION_RELOGIN_BEFORE_S    re-login this long before token expiry (default 1800)
+  SESSION_KEEPALIVE           0 to disable (default 1)
+"""
+import os, time, threading, importlib
+from typing import Any, Callable, Dict, List, Tuple
+
+ENABLED         = os.getenv("SESSION_KEEPALIVE", "1").strip().lower() not in ("0", "false", "no", "off")
+INTERVAL_S      = float(os.getenv("SESSION_KEEPALIVE_S", "600"))
+RELOGIN_BEFORE  = float(os.getenv("SESSION_RELOGIN_BEFORE_S", "1800"))
+
+
+def _broker_module(brk: str):
+    return importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
+
+
+class KeepAlive:
+    def __init__(self):
+        self._targets: Callable[[], List[Tuple[str, str, Dict[str, Any]]]] = lambda: []
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._health: Dict[str, Dict[str, Any]] = {}
+        self.rounds = 0
+
+    def configure(self, targets: Callable[[], List[Tuple[str, str, Dict[str, Any]]]]):
+        """targets() -> [(userid, broker, client json)] to keep alive; re-read every round."""
+        self._targets = targets
+
+    def start(self):
+        if not ENABLED or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="session-keepalive", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                targets = list(self._targets())
+            except Exception as e:
+                print(f"[keepalive] target list failed: {e}")
+                targets = []
+            if not targets:
+                self._stop.wait(INTERVAL_S)
+                continue
+            gap = INTERVAL_S / len(targets)
+            live = {uid for uid, _, _ in targets}
+            with self._lock:
+                for uid in [u for u in self._health if u not in live]:
+                    self._health.pop(uid)
+            for uid, brk, client in targets:
+                if self._stop.wait(gap):
+                    return
+                self.check(uid, brk, client)
+            self.rounds += 1
+
+    def check(self, uid: str, brk: str, client: Dict[str, Any]) -> Dict[str, Any]:
+        """Probe one client now and record the result."""
+        t0 = time.perf_counter()
+        try:
+            res = _broker_module(brk).check_session(client, RELOGIN_BEFORE)
+        except Exception as e:
+            res = {"ok": False, "action": "error", "message": str(e)}
+        now = time.time()
+        with self._lock:
+            prev = self._health.get(uid) or {}
+            h = {
+                "broker": brk,
+                "ok": bool(res.get("ok")),
+                "action": res.get("action"),
+                "message": res.get("message"),
+                "expires_at": res.get("expires_at"),
+                "checked_at": now,
+                "check_ms": round((time.perf_counter() - t0) * 1000, 1),
+                "relogins": prev.get("relogins", 0) + (1 if str(res.get("action") or "").startswith("relogin") else 0),
+                "failures": prev.get("failures", 0) + (0 if res.get("ok") else 1),
+                "last_ok_at": now if res.get("ok") else prev.get("last_ok_at"),
+            }
+            self._health[uid] = h
+        if not h["ok"] or h["action"] not in ("ok", "login"):
+            print(f"[keepalive] {brk}/{uid}: {h['action']} ok={h['ok']} {h['message'] or ''}".rstrip())
+        return h
+
+    def stats(self, per_client: bool = False) -> Dict[str, Any]:
+        with self._lock:
+            health = {k: dict(v) for k, v in self._health.items()}
+        out = {
+            "enabled": ENABLED,
+            "running": self._thread is not None,
+            "interval_s": INTERVAL_S,
+            "rounds": self.rounds,
+            "clients": len(health),
+            "healthy": sum(1 for h in health.values() if h["ok"]),
+            "unhealthy": sorted(uid for uid, h in health.items() if not h["ok"]),
+            "expiring": sorted(uid for uid, h in health.items() if h["action"] == "expiring"),
+        }
+        if per_client:
+            out["per_client"] = health
+        return out
+
+
+keepalive = KeepAlive()
@@ -0,0 +1,130 @@
+# Session_store.py
+"""
+Encrypted on-disk store for broker session tokens.
+
+Each store is one Fernet-encrypted JSON file under DATA_DIR/sessions/ holding
+{userid: {"token", "saved_at", "expires_at", ...meta}}. Expired entries are
+never returned. Writes are atomic (temp file + replace).
+
+Key: SESSION_STORE_KEY (a Fernet key) if set, otherwise a key generated once
+into DATA_DIR/sessions/.key (mode 600). Without the `cryptography` package
+the store is disabled and behaves as empty.
+"""
+import os, json, time, threading
+from typing import Any, Dict, Optional
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except Exception:
+    Fernet = None
+
+BASE_DIR     = os.path.abspath(os.environ.get("DATA_DIR", "./data"))
+SESSIONS_DIR = os.path.join(BASE_DIR, "sessions")
+KEY_PATH     = os.path.join(SESSIONS_DIR, ".key")
+
+_key_lock = threading.Lock()
+_fernet = None
+
+
+def _cipher():
+    global _fernet
+    if Fernet is None:
+        return None
+    with _key_lock:
+        if _fernet is None:
+            key = (os.getenv("SESSION_STORE_KEY") or "").strip().encode()
+            if not key:
+                os.makedirs(SESSIONS_DIR, exist_ok=True)
+                if os.path.exists(KEY_PATH):
+                    with open(KEY_PATH, "rb") as f:
+                        key = f.read().strip()
+                else:
+                    key = Fernet.generate_key()
+                    fd = os.open(KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(key)
+            _fernet = Fernet(key)
+    return _fernet
+
+
+class SessionStore:
+    """Persisted {userid: session} map for one broker."""
+
+    def __init__(self, name: str):
+        self.path = os.path.join(SESSIONS_DIR, f"{name}.bin")
+        self._lock = threading.Lock()
+        self._data: Optional[Dict[str, Dict[str, Any]]] = None
+
+    @property
+    def enabled(self) -> bool:
+        return Fernet is not None
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._data is not None:
+            return self._data
+        self._data = {}
+        f = _cipher()
+        if f is None or not os.path.exists(self.path):
+            return self._data
+        try:
+            with open(self.path, "rb") as fh:
+                self._data = json.loads(f.decrypt(fh.read()).decode("utf-8")) or {}
+        except (InvalidToken, ValueError) as e:
+            # key rotated or file damaged: start over, sessions just re-login
+            print(f"[session-store] {os.path.basename(self.path)} unreadable, ignoring: {e}")
+            self._data = {}
+        except Exception as e:
+            print(f"[session-store] load failed: {e}")
+        return self._data
+
+    def _flush(self) -> None:
+        f = _cipher()
+        if f is None:
+            return
+        now = time.time()
+        live = {k: v for k, v in (self._data or {}).items() if v.get("expires_at", 0) > now}
+        self._data = live
+        os.makedirs(SESSIONS_DIR, exist_ok=True)
+        tmp = self.path + ".tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(f.encrypt(json.dumps(live, separators=(",", ":")).encode("utf-8")))
+        os.replace(tmp, self.path)
+
+    def get(self, userid: str) -> Optional[Dict[str, Any]]:
+        """The saved session for userid, None if missing or expired."""
+        with self._lock:
+            rec = self._load().get(str(userid))
+        if not rec or rec.get("expires_at", 0) <= time.time():
+            return None
+        return dict(rec)
+
+    def put(self, userid: str, token: str, ttl_s: float, **meta: Any) -> None:
+        if not self.enabled or not token:
+            return
+        now = time.time()
+        with self._lock:
+            self._load()[str(userid)] = {"token": token, "saved_at": now, "expires_at": now + ttl_s, **meta}
+            try:
+                self._flush()
+            except Exception as e:
+                print(f"[session-store] save failed: {e}")
+
+    def drop(self, userid: str) -> None:
+        with self._lock:
+            if self._load().pop(str(userid), None) is None:
+                return
+            try:
+                self._flush()
+            except Exception as e:
+                print(f"[session-store] save failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            data = self._load()
+            return {
+                "enabled": self.enabled,
+                "saved": len(data),
+                "live": sum(1 for v in data.values() if v.get("expires_at", 0) > now),
+            }
@@ -0,0 +1,17 @@
+# tests/conftest.py
+"""
+Shared setup for the unit tests: the top-level modules are imported from the
+repo root, and anything they write at import time (journal, audit log) goes
+to a throw-away DATA_DIR instead of ./data.
+
+    python -m pytest -q
+"""
+import os, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="mbt-tests-"))
+os.environ.setdefault("AUDIT_CONSOLE", "0")
+os.environ.setdefault("AUDIT_LEVEL", "off")
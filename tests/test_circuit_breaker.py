@@ -0,0 +1,93 @@
+# tests/test_circuit_breaker.py
+import pytest
+
+import Circuit_breaker as CB
+from Circuit_breaker import CircuitOpen
+
+
+@pytest.fixture
+def reg(monkeypatch):
+    monkeypatch.setattr(CB, "ENABLED", True)
+    monkeypatch.setattr(CB, "CLIENT_FAILURES", 3)
+    monkeypatch.setattr(CB, "BROKER_FAILURES", 100)
+    monkeypatch.setattr(CB, "OPEN_S", 30.0)
+    monkeypatch.setattr(CB, "OPEN_MAX_S", 100.0)
+    return CB.Registry()
+
+
+def _fail(reg, n, client="u1"):
+    for _ in range(n):
+        reg.record("dhan", client, ok=False, reason="http 503")
+
+def _cool_down(reg, client="u1"):
+    """Move the breaker past its cool-down without sleeping."""
+    b = reg._get("dhan", client)
+    b.opened_at -= b.open_s
+    b.probe_at -= b.open_s
+
+
+def test_opens_after_consecutive_failures(reg):
+    _fail(reg, 2)
+    reg.check("dhan", "u1")
+    _fail(reg, 1)
+    assert reg.state("dhan", "u1") == CB.OPEN
+    with pytest.raises(CircuitOpen) as e:
+        reg.check("dhan", "u1")
+    assert e.value.client == "u1" and e.value.retry_in_s > 0
+    # the other accounts of the broker are not affected
+    reg.check("dhan", "u2")
+
+def test_a_success_resets_the_failure_count(reg):
+    _fail(reg, 2)
+    reg.record("dhan", "u1", ok=True)
+    _fail(reg, 2)
+    assert reg.state("dhan", "u1") == CB.CLOSED
+
+def test_one_trial_after_the_cool_down_and_success_closes(reg):
+    _fail(reg, 3)
+    _cool_down(reg)
+    reg.check("dhan", "u1")
+    assert reg.state("dhan", "u1") == CB.HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        reg.check("dhan", "u1")          # the trial slot is taken
+    reg.record("dhan", "u1", ok=True)
+    assert reg.state("dhan", "u1") == CB.CLOSED
+    reg.check("dhan", "u1")
+
+def test_failed_trial_reopens_with_a_doubled_cool_down(reg):
+    _fail(reg, 3)
+    _cool_down(reg)
+    reg.check("dhan", "u1")
+    _fail(reg, 1)
+    b = reg._get("dhan", "u1")
+    assert b.state == CB.OPEN and b.open_s == 60.0 and b.trips == 2
+    _cool_down(reg)
+    reg.check("dhan", "u1")
+    _fail(reg, 1)
+    assert b.open_s == 100.0             # capped at OPEN_MAX_S
+    reg.reset("dhan", "u1")
+    assert b.state == CB.CLOSED and b.open_s == 30.0
+
+def test_release_gives_the_trial_slot_back(reg):
+    _fail(reg, 3)
+    _cool_down(reg)
+    reg.check("dhan", "u1")
+    reg.release("dhan", "u1")            # e.g. skipped for the request deadline
+    reg.check("dhan", "u1")
+    assert reg.state("dhan", "u1") == CB.HALF_OPEN
+
+def test_open_broker_breaker_rejects_every_account(reg, monkeypatch):
+    monkeypatch.setattr(CB, "BROKER_FAILURES", 4)
+    reg = CB.Registry()
+    for i in range(4):
+        reg.record("dhan", f"u{i}", ok=False, reason="timeout")
+    assert reg.state("dhan") == CB.OPEN
+    with pytest.raises(CircuitOpen) as e:
+        reg.check("dhan", "u9")
+    assert e.value.client == ""
+    assert reg.stats()["brokers"]["dhan"]["state"] == CB.OPEN
+
+def test_disabled_never_rejects(reg, monkeypatch):
+    _fail(reg, 3)
+    monkeypatch.setattr(CB, "ENABLED", False)
+    reg.check("dhan", "u1")
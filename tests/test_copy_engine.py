@@ -0,0 +1,70 @@
+# tests/test_copy_engine.py
+import pytest
+
+import Copy_engine
+
+
+CLIENTS = {
+    "D1": {"broker": "dhan", "name": "Dhan child", "json": {}},
+    "M1": {"broker": "motilal", "name": "MO child", "json": {}},
+    "M2": {"broker": "motilal", "name": "MO small", "json": {}},
+}
+
+
+def _engine(setups, lot=25):
+    eng = Copy_engine.CopyEngine()
+    eng.configure(lambda: setups, lambda: CLIENTS, dispatch=None, lot_size=lambda sid: lot)
+    eng.reload()                         # not started: builds routes, no watchers
+    return eng
+
+def _fill(qty=10, master="MASTER"):
+    return {"master": master, "qty": qty, "action": "BUY", "security_id": 10666,
+            "symbol": "PNB EQ", "exchange": "NSE", "producttype": "CNC", "fill_id": "1:10"}
+
+@pytest.fixture
+def setup():
+    return {"id": "s1", "master": "MASTER", "enabled": True,
+            "children": ["D1", "M1", "M2", "GONE"],
+            "multipliers": {"D1": 2, "M1": 5, "M2": 1}}
+
+
+def test_legs_per_broker_with_multiplier_and_lots(setup):
+    eng = _engine([setup])
+    legs = eng.child_legs(_fill(qty=10))
+
+    assert [l["client_id"] for l in legs["dhan"]] == ["D1"]
+    assert legs["dhan"][0]["qty"] == 20  # shares
+    # Motilal orders in lots: 10 x 5 = 50 shares = 2 lots of 25
+    assert [(l["client_id"], l["qty"]) for l in legs["motilal"]] == [("M1", 2)]
+
+def test_legs_are_tagged_market_orders(setup):
+    leg = _engine([setup]).child_legs(_fill())["dhan"][0]
+    assert leg["ordertype"] == "MARKET" and leg["price"] == 0.0
+    assert leg["tag"] == "CPYs1"
+    assert leg["security_id"] == leg["symboltoken"] == "10666"
+    assert leg["producttype"] == "CNC" and leg["action"] == "BUY"
+
+def test_fill_below_one_child_lot_is_counted_not_sent(setup):
+    eng = _engine([setup])
+    legs = eng.child_legs(_fill(qty=10))
+    assert "M2" not in [l["client_id"] for l in legs["motilal"]]
+    assert eng.counters["below_lot"] == 1
+
+def test_no_routes_no_legs(setup):
+    eng = _engine([setup])
+    assert eng.child_legs(_fill(master="OTHER")) == {}
+    assert eng.child_legs(_fill(qty=0)) == {}
+    assert eng.counters["below_lot"] == 0
+
+def test_disabled_setup_has_no_routes(setup):
+    eng = _engine([{**setup, "enabled": False}])
+    assert eng.child_legs(_fill()) == {}
+
+def test_upsert_and_remove_recompile_the_master(setup):
+    eng = _engine([])
+    eng.upsert_setup(setup)
+    assert eng.child_legs(_fill())["dhan"][0]["qty"] == 20
+    eng.upsert_setup({**setup, "multipliers": {"D1": 3}})
+    assert eng.child_legs(_fill())["dhan"][0]["qty"] == 30
+    eng.remove_setup("s1")
+    assert eng.child_legs(_fill()) == {}
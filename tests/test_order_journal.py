@@ -0,0 +1,129 @@
+# tests/test_order_journal.py
+import json, time
+from datetime import datetime, timedelta
+
+import pytest
+
+import Order_journal as J
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(J, "JOURNAL_DIR", str(tmp_path))
+    monkeypatch.setattr(J, "FSYNC", False)
+    yield J
+    J.flush()
+
+
+def _dhan_leg(cid, uid="100"):
+    return {"correlation_id": cid, "broker": "dhan", "client_id": uid, "name": "D",
+            "security_id": "10666", "action": "BUY", "qty": 1, "ordertype": "MARKET"}
+
+def _mo_leg(cid, uid="M1", qty=2, lot=25, tag="T1"):
+    return {"correlation_id": cid, "broker": "motilal", "client_id": uid, "name": "M",
+            "security_id": "10666", "action": "BUY", "qty": qty, "lot_size": lot, "tag": tag}
+
+
+# ---------------------------
+# correlation ids
+# ---------------------------
+def test_request_ids_are_unique_for_a_reused_correlation_id():
+    a, b = J.new_request_id("UI-retry"), J.new_request_id("UI-retry")
+    assert a != b
+    assert a.startswith("UI-retry-") and b.startswith("UI-retry-")
+
+def test_leg_ids_fit_the_dhan_correlation_limit():
+    rid = J.new_request_id("x" * 60)
+    assert len(J.leg_id(rid, 199)) <= J._CID_MAX
+    assert J.new_request_id("").startswith("R")
+
+
+# ---------------------------
+# writing / replay
+# ---------------------------
+def test_intent_and_ack_fold_into_one_leg(journal):
+    assert journal.record_intent("R1", [_dhan_leg("R1-0"), _dhan_leg("R1-1", "101")]) is True
+    journal.record_acks("R1", [{"cid": "R1-0", "broker": "dhan", "uid": "100", "ok": True, "order_id": "9"}])
+    assert journal.flush()
+
+    legs = journal.replay()
+    assert set(legs) == {"R1-0", "R1-1"}
+    assert legs["R1-0"]["ack"]["order_id"] == "9"
+    assert legs["R1-1"]["ack"] is None
+    assert legs["R1-1"]["intent"]["uid"] == "101"
+
+def test_replay_skips_a_torn_last_line(journal):
+    journal.record_intent("R2", [_dhan_leg("R2-0")])
+    journal.flush()
+    with open(journal._path_for(time.time()), "a", encoding="utf-8") as f:
+        f.write('{"t":1,"k":"ack","cid":"R2-')
+    assert list(journal.replay()) == ["R2-0"]
+
+def test_write_failure_is_reported_to_the_caller(journal, monkeypatch):
+    monkeypatch.setattr(J, "FSYNC", True)
+    def boom(fd):
+        raise OSError("disk gone")
+    monkeypatch.setattr(J.os, "fsync", boom)
+    assert journal.record_intent("R3", [_dhan_leg("R3-0")]) is False
+
+
+# ---------------------------
+# reconcile
+# ---------------------------
+def test_dhan_legs_match_by_correlation_id(journal):
+    journal.record_intent("R4", [_dhan_leg("R4-0"), _dhan_leg("R4-1")])
+    journal.flush()
+    books = {("dhan", "100"): [{"orderId": "77", "correlationId": "R4-0", "orderStatus": "TRADED"}]}
+
+    rep = journal.reconcile(lambda brk, uid: books.get((brk, uid)))
+    by_cid = {r["cid"]: r for r in rep["unacked"]}
+    assert by_cid["R4-0"]["state"] == "found"
+    assert by_cid["R4-0"]["order_id"] == "77"
+    assert by_cid["R4-1"]["state"] == "missing"
+    assert rep["summary"] == {"found": 1, "missing": 1, "unknown": 0}
+
+    # both legs now carry a recon record and are not reported again
+    journal.flush()
+    assert journal.reconcile(lambda brk, uid: books.get((brk, uid)))["unacked"] == []
+
+def test_motilal_legs_of_the_same_shape_each_need_their_own_order(journal):
+    journal.record_intent("R5", [_mo_leg("R5-0"), _mo_leg("R5-1"), _mo_leg("R5-2")])
+    # R5-2 was acked with order 1, so order 1 cannot also stand for R5-0 / R5-1
+    journal.record_acks("R5", [{"cid": "R5-2", "broker": "motilal", "uid": "M1", "ok": True, "order_id": "1"}])
+    journal.flush()
+    order = {"symboltoken": "10666", "buyorsell": "BUY", "orderqty": 50, "tag": "T1"}
+    book = [{**order, "uniqueorderid": "1"}, {**order, "uniqueorderid": "2"}]
+
+    rep = journal.reconcile(lambda brk, uid: list(book))
+    states = {r["cid"]: (r["state"], r["order_id"]) for r in rep["unacked"]}
+    assert states == {"R5-0": ("found", "2"), "R5-1": ("missing", None)}
+
+def test_motilal_match_compares_lots_times_lot_size_with_shares(journal):
+    journal.record_intent("R6", [_mo_leg("R6-0", qty=2, lot=25)])
+    journal.flush()
+    book = [{"symboltoken": "10666", "buyorsell": "BUY", "orderqty": 2, "tag": "T1", "uniqueorderid": "5"}]
+    assert journal.reconcile(lambda brk, uid: book)["summary"]["missing"] == 1
+
+def test_unavailable_order_book_leaves_the_leg_unknown(journal):
+    journal.record_intent("R7", [_dhan_leg("R7-0"), _dhan_leg("R7-1", "101")])
+    journal.flush()
+    def book(brk, uid):
+        if uid == "101":
+            raise RuntimeError("broker down")
+        return None
+
+    rep = journal.reconcile(book)
+    assert rep["summary"] == {"found": 0, "missing": 0, "unknown": 2}
+    # unknown legs get no recon record, so the next run looks again
+    journal.flush()
+    assert len(journal.reconcile(lambda brk, uid: [])["unacked"]) == 2
+
+def test_legs_from_an_earlier_day_are_unknown(journal):
+    t = (datetime.now() - timedelta(days=1)).timestamp()
+    rec = {"t": t, "k": "intent", "req": "R8", "cid": "R8-0", "broker": "dhan", "uid": "100"}
+    with open(journal._path_for(t), "w", encoding="utf-8") as f:
+        f.write(json.dumps(rec) + "\n")
+    asked = []
+    rep = journal.reconcile(lambda brk, uid: asked.append(uid) or [])
+    assert [r["state"] for r in rep["unacked"]] == ["unknown"]
+    assert asked == []
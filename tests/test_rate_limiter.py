@@ -0,0 +1,92 @@
+# tests/test_rate_limiter.py
+import asyncio, contextvars
+
+import pytest
+
+import Rate_limiter as RL
+import Req_deadline
+from Req_deadline import DeadlineExceeded
+
+
+@pytest.fixture
+def lim(monkeypatch):
+    monkeypatch.setattr(RL, "BURST", 5.0)
+    monkeypatch.setattr(RL, "MIN_RATE", 0.5)
+    monkeypatch.setattr(RL, "RECOVER_S", 5.0)
+    monkeypatch.setattr(RL, "QUEUE_MAX_S", 30.0)
+    return RL.Limiter("dhan", "u1", 10.0)
+
+
+def _book(lim):
+    wait = lim._book_order()
+    if wait:
+        lim._order_done()
+    return wait
+
+
+def test_burst_then_one_slot_per_interval(lim):
+    waits = [_book(lim) for _ in range(7)]
+    assert waits[:5] == [0.0] * 5
+    assert waits[5] == pytest.approx(0.1, abs=0.02)
+    assert waits[6] == pytest.approx(0.2, abs=0.02)
+
+def test_orders_queue_instead_of_failing_up_to_the_cap(lim, monkeypatch):
+    monkeypatch.setattr(RL, "QUEUE_MAX_S", 0.5)
+    for _ in range(10):
+        _book(lim)
+    with pytest.raises(RL.Throttled):
+        for _ in range(10):
+            _book(lim)
+
+def test_reads_take_only_a_free_slot(lim):
+    for _ in range(5):
+        assert lim._try_read() == 0.0
+    wait = lim._try_read()
+    assert wait == pytest.approx(0.1, abs=0.02)
+
+def test_reads_yield_to_a_waiting_order(lim):
+    for _ in range(5):
+        _book(lim)
+    assert lim._book_order() > 0         # this order is now waiting
+    assert lim._try_read() == lim.interval
+    lim._order_done()
+
+def test_throttle_halves_the_rate_once_per_window_and_pauses(lim):
+    lim.throttled(2.0)
+    lim.throttled(2.0)                   # same burst of 429s: no second cut
+    assert lim.rate == 5.0 and lim.cuts == 1 and lim.throttles == 2
+    assert _book(lim) == pytest.approx(2.0, abs=0.02)
+
+def test_rate_never_drops_below_the_floor(lim):
+    for _ in range(10):
+        lim.cut_at -= RL._CUT_WINDOW_S
+        lim.throttled()
+    assert lim.rate == RL.MIN_RATE
+    assert lim.tau == 0.0                # a throttled account gets no burst
+
+def test_recovers_a_tenth_per_quiet_period(lim):
+    lim.throttled()
+    lim.ok()
+    assert lim.rate == 5.0               # not quiet long enough
+    lim.changed_at -= RL.RECOVER_S
+    lim.ok()
+    assert lim.rate == 6.0
+
+def test_read_gives_up_past_the_request_deadline(lim):
+    for _ in range(5):
+        _book(lim)
+    lim.throttled(5.0)
+
+    def run():
+        d = Req_deadline.begin(100)
+        with pytest.raises(DeadlineExceeded):
+            asyncio.run(lim.wait(RL.READ))
+        return d.marks
+
+    assert contextvars.copy_context().run(run) == {"dhan/u1": "throttled"}
+
+def test_retry_after_header():
+    assert RL.retry_after_s({"Retry-After": "3"}) == 3.0
+    assert RL.retry_after_s({"Retry-After": "Wed, 21 Oct 2026 07:28:00 GMT"}) is None
+    assert RL.retry_after_s({}) is None
+    assert RL.retry_after_s(None) is None
@@ -0,0 +1,97 @@
+# tests/test_response_codec.py
+import gzip, json
+
+import pytest
+from starlette.requests import Request
+
+import Response_codec as RC
+
+
+@pytest.fixture(autouse=True)
+def codec(monkeypatch):
+    monkeypatch.setattr(RC, "ETAG_ENABLED", True)
+    monkeypatch.setattr(RC, "COMPRESS_MIN", 1024)
+    monkeypatch.setattr(RC, "brotli", None)
+    monkeypatch.setattr(RC, "_last", {})
+
+
+def _request(**headers):
+    raw = [(k.replace("_", "-").lower().encode(), v.encode()) for k, v in headers.items()]
+    return Request({"type": "http", "method": "GET", "path": "/get_orders", "headers": raw})
+
+SMALL = {"orders": [{"orderId": "1", "status": "TRADED"}]}
+LARGE = {"orders": [{"orderId": str(i), "status": "PENDING", "symbol": "PNB EQ"} for i in range(200)]}
+
+
+# ---------------------------
+# ETag / 304
+# ---------------------------
+def test_same_body_same_etag():
+    a = RC.book(_request(), SMALL, "order_book")
+    b = RC.book(_request(), json.loads(json.dumps(SMALL)), "order_book")
+    assert a.headers["etag"] == b.headers["etag"]
+    assert a.headers["etag"].startswith('W/"')
+    assert a.headers["cache-control"] == "no-cache"
+    assert json.loads(a.body) == SMALL
+
+def test_changed_body_changes_the_etag():
+    a = RC.book(_request(), SMALL, "order_book")
+    b = RC.book(_request(), {"orders": []}, "order_book")
+    assert a.headers["etag"] != b.headers["etag"]
+
+def test_matching_if_none_match_gets_304_without_a_body():
+    etag = RC.book(_request(), SMALL, "order_book").headers["etag"]
+    r = RC.book(_request(if_none_match=etag), SMALL, "order_book")
+    assert r.status_code == 304
+    assert r.body == b""
+    assert r.headers["etag"] == etag
+
+@pytest.mark.parametrize("header", ["{strong}", "{weak}", '"other", {weak}', "*"])
+def test_if_none_match_forms(header):
+    etag = RC.book(_request(), SMALL, "order_book").headers["etag"]
+    header = header.format(weak=etag, strong=etag[2:])
+    assert RC.book(_request(if_none_match=header), SMALL, "order_book").status_code == 304
+
+def test_stale_if_none_match_gets_the_body():
+    r = RC.book(_request(if_none_match='W/"stale"'), SMALL, "order_book")
+    assert r.status_code == 200 and json.loads(r.body) == SMALL
+
+def test_no_etag_when_disabled(monkeypatch):
+    monkeypatch.setattr(RC, "ETAG_ENABLED", False)
+    r = RC.book(_request(if_none_match="*"), SMALL, "order_book")
+    assert r.status_code == 200
+    assert "etag" not in r.headers
+
+
+# ---------------------------
+# encoding negotiation
+# ---------------------------
+def test_large_body_is_gzipped_when_accepted():
+    r = RC.book(_request(accept_encoding="gzip, deflate"), LARGE, "order_book")
+    assert r.headers["content-encoding"] == "gzip"
+    assert r.headers["vary"] == "Accept-Encoding"
+    assert json.loads(gzip.decompress(r.body)) == LARGE
+
+def test_small_body_is_sent_as_is():
+    r = RC.book(_request(accept_encoding="gzip"), SMALL, "order_book")
+    assert "content-encoding" not in r.headers
+
+@pytest.mark.parametrize("accept, expected", [
+    ("", None),
+    ("identity", None),
+    ("gzip;q=0", None),
+    ("br", None),                        # brotli not installed
+    ("br;q=1.0, gzip;q=0.5", "gzip"),
+    ("deflate, GZIP", "gzip"),
+])
+def test_pick_encoding(accept, expected):
+    assert RC._pick_encoding(accept) == expected
+
+def test_br_preferred_when_brotli_is_installed(monkeypatch):
+    monkeypatch.setattr(RC, "brotli", object())
+    assert RC._pick_encoding("gzip, br") == "br"
+
+def test_unchanged_book_is_not_recompressed():
+    a = RC.book(_request(accept_encoding="gzip"), LARGE, "order_book")
+    b = RC.book(_request(accept_encoding="gzip"), LARGE, "order_book")
+    assert a.body is b.body